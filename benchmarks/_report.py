@@ -0,0 +1,42 @@
+import resource
+import sys
+from typing import Dict, List, Sequence
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max of ``samples`` (seconds) in milliseconds."""
+    return {
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples, default=0.0) * 1000,
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def print_table(rows: List[Dict[str, object]]) -> None:
+    if not rows:
+        return
+    columns = list(rows[0])
+    formatted = [
+        [f"{row[c]:.2f}" if isinstance(row[c], float) else str(row[c]) for c in columns]
+        for row in rows
+    ]
+    widths = [max(len(c), *(len(r[i]) for r in formatted)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in formatted:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
@@ -0,0 +1,121 @@
+"""Drive a StreamlitView FastAPI app with concurrent simulated chat clients.
+
+The app is the real one from ``define_endpoints``, backed by a StubAgent, and
+every client goes through the real StreamlitView client calls::
+
+    PYTHONPATH=src python benchmarks/load_test.py --clients 32 --requests 20 \\
+        --latency 0.05 --jitter 0.02 --mode stream
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _report import latency_summary, peak_rss_mb, print_table  # noqa: E402
+from stub_agent import StubAgent  # noqa: E402
+from streamlit_view.streaming import StreamError  # noqa: E402
+from streamlit_view.view import StreamlitView  # noqa: E402
+
+
+def start_server(view: StreamlitView) -> uvicorn.Server:
+    config = uvicorn.Config(view.app, host=view.host, port=view.port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def run_client(client_id: int, requests_per_client: int, mode: str):
+    chat_id = f"bench-{client_id}"
+    latencies, first_chunks, errors = [], [], 0
+    for turn in range(requests_per_client):
+        prompt = f"client {client_id} turn {turn}"
+        message_id = str(uuid.uuid4())
+        stream = mode == "stream" or (mode == "mixed" and turn % 2)
+        started = time.perf_counter()
+        if stream:
+            try:
+                first = None
+                for _ in StreamlitView.stream_message(prompt, chat_id, message_id):
+                    if first is None:
+                        first = time.perf_counter() - started
+                first_chunks.append(first or 0.0)
+            except StreamError:
+                errors += 1
+                continue
+        else:
+            result = StreamlitView.send_message(prompt, chat_id, message_id)
+            if isinstance(result, str):
+                errors += 1
+                continue
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    StreamlitView.delete_chat(chat_id)
+    delete_latency = time.perf_counter() - started
+    return latencies, first_chunks, errors, delete_latency
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=20, help="turns per client")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- latency jitter (s)")
+    parser.add_argument("--response-size", type=int, default=256)
+    parser.add_argument("--mode", choices=("send", "stream", "mixed"), default="send")
+    parser.add_argument("--workers", type=int, default=8, help="job queue workers")
+    parser.add_argument("--port", type=int, default=5091)
+    args = parser.parse_args(argv)
+
+    agent = StubAgent(args.latency, args.jitter, args.response_size)
+    view = StreamlitView(
+        SimpleNamespace(title="benchmark", ui_file=""),
+        agent.view_callback,
+        host="127.0.0.1",
+        port=args.port,
+        http_options={"pool_maxsize": max(args.clients, 1)},
+        stream_callback=agent.stream_callback,
+        job_options={"workers": args.workers, "max_queue_size": args.clients * 2},
+    )
+    server = start_server(view)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        results = list(
+            pool.map(
+                lambda i: run_client(i, args.requests, args.mode), range(args.clients)
+            )
+        )
+    elapsed = time.perf_counter() - started
+    server.should_exit = True
+
+    latencies = [x for r in results for x in r[0]]
+    first_chunks = [x for r in results for x in r[1]]
+    errors = sum(r[2] for r in results)
+    deletes = [r[3] for r in results]
+
+    rows = [{"path": "turn", "n": len(latencies), **latency_summary(latencies)}]
+    if first_chunks:
+        rows.append({"path": "first_chunk", "n": len(first_chunks), **latency_summary(first_chunks)})
+    rows.append({"path": "delete_chat", "n": len(deletes), **latency_summary(deletes)})
+    print_table(rows)
+    print(
+        f"\nclients={args.clients} mode={args.mode} stub_latency={args.latency}s "
+        f"rps={len(latencies) / elapsed:.1f} errors={errors} "
+        f"elapsed={elapsed:.2f}s peak_rss={peak_rss_mb():.1f}MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
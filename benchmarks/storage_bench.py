@@ -0,0 +1,109 @@
+"""Micro-benchmarks for chat persistence and exports at growing history sizes.
+
+    PYTHONPATH=src python benchmarks/storage_bench.py --sizes 1000 10000 100000
+
+``shelve full rewrite`` reproduces the old save_chat_history (re-pickling
+every chat on each save) as a baseline for the ChatStore numbers.
+"""
+import argparse
+import os
+import shelve
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _report import peak_rss_mb, print_table  # noqa: E402
+from streamlit_view.chat_store import ChatStore  # noqa: E402
+from streamlit_view.export import EXPORT_FORMATS, export_cache, export_chat  # noqa: E402
+
+CHATS = 10
+CONTENT = "lorem ipsum dolor sit amet " * 8
+
+
+def timed(fn, repeat: int = 1) -> float:
+    """Average wall time of ``fn`` in milliseconds."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def bench_size(size: int, directory: str):
+    rows = []
+    per_chat = size // CHATS
+    legacy = {
+        str(c): {
+            "title": str(c),
+            "messages": [
+                {"role": "user" if i % 2 else "assistant", "content": CONTENT}
+                for i in range(per_chat)
+            ],
+        }
+        for c in range(CHATS)
+    }
+
+    shelve_path = os.path.join(directory, f"shelve_{size}")
+
+    def shelve_save():
+        with shelve.open(shelve_path) as db:
+            db["chats"] = legacy
+            db["current_chat_id"] = "0"
+
+    def shelve_load():
+        with shelve.open(shelve_path) as db:
+            db.get("chats", {})
+
+    rows.append({"size": size, "operation": "shelve full rewrite", "ms": timed(shelve_save, 3)})
+    rows.append({"size": size, "operation": "shelve load all", "ms": timed(shelve_load, 3)})
+
+    store = ChatStore(os.path.join(directory, f"store_{size}.db"))
+    started = time.perf_counter()
+    for c in range(CHATS):
+        for i in range(per_chat):
+            store.append_message(str(c), "user" if i % 2 else "assistant", CONTENT)
+    append_ms = (time.perf_counter() - started) / max(size, 1) * 1000
+    rows.append({"size": size, "operation": "store append (per msg)", "ms": append_ms})
+    rows.append({"size": size, "operation": "store list_chats", "ms": timed(store.list_chats, 10)})
+    rows.append(
+        {
+            "size": size,
+            "operation": "store last 50 msgs",
+            "ms": timed(lambda: store.load_messages("0", limit=50), 10),
+        }
+    )
+    rows.append(
+        {
+            "size": size,
+            "operation": "store iter one chat",
+            "ms": timed(lambda: sum(1 for _ in store.iter_messages("0"))),
+        }
+    )
+
+    message_count = store.get_chat("0")["message_count"]
+    for fmt in EXPORT_FORMATS:
+        export_cache.invalidate()
+        cold = timed(lambda: export_chat(store, "0", fmt, message_count))
+        warm = timed(lambda: export_chat(store, "0", fmt, message_count), 10)
+        rows.append({"size": size, "operation": f"export {fmt} cold", "ms": cold})
+        rows.append({"size": size, "operation": f"export {fmt} cached", "ms": warm})
+    store.close()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args(argv)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            rows.extend(bench_size(size, directory))
+    print_table(rows)
+    print(f"\npeak_rss={peak_rss_mb():.1f}MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Configurable stand-in for a real agent, used by the benchmark scripts."""
+import asyncio
+import random
+from typing import AsyncIterator
+
+from common_utils.schemas import AgentRequest, AgentResponse
+
+
+class StubAgent:
+    """Answers every prompt after ``latency`` +/- ``jitter`` seconds.
+
+    ``view_callback`` returns the whole answer at once; ``stream_callback``
+    spreads the same latency over ``chunks`` partial responses.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        response_size: int = 256,
+        chunks: int = 8,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.response_size = response_size
+        self.chunks = max(1, chunks)
+        self._random = random.Random(seed)
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _text(self, agent_request: AgentRequest) -> str:
+        seed = f"echo {agent_request.message or ''} "
+        return (seed * (self.response_size // len(seed) + 1))[: self.response_size]
+
+    async def view_callback(self, agent_request: AgentRequest) -> AgentResponse:
+        await asyncio.sleep(self._delay())
+        return AgentResponse(chat_id=agent_request.chat_id, message=self._text(agent_request))
+
+    async def stream_callback(self, agent_request: AgentRequest) -> AsyncIterator[AgentResponse]:
+        text = self._text(agent_request)
+        step = len(text) // self.chunks + 1
+        delay = self._delay() / self.chunks
+        for start in range(0, len(text), step):
+            await asyncio.sleep(delay)
+            yield AgentResponse(chat_id=agent_request.chat_id, message=text[start : start + step])
@@ -10,6 +10,9 @@ setup(
         "streamlit",
         "python-dotenv",
     ],
+    extras_require={
+        "fast": ["orjson", "msgpack", "brotli"],
+    },
     entry_points={
         'console_scripts': [
             'streamlit-chat-ui=streamlit_view.streamlit_chat_ui:main',
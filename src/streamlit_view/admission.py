@@ -0,0 +1,182 @@
+"""Admission control in front of the view callback.
+
+Every request that would reach the callback first passes an
+AdmissionController:
+
+- a token bucket per client IP and one per chat_id bound the sustained
+  request rate (with bursts up to the bucket size), answered with 429;
+- a global cap on admitted, unfinished requests sheds load once the agent
+  is saturated, answered with 503.
+
+Both carry a Retry-After so well-behaved clients back off instead of
+piling on. Everything is opt-in; a limit left as None is not enforced.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+
+from streamlit_view.metrics import ADMISSION_REJECTIONS, ADMITTED
+
+if TYPE_CHECKING:
+    from fastapi import Request
+
+
+logger = logging.getLogger(__name__)
+
+# Buckets kept per limiter; the least recently used key is forgotten first
+MAX_TRACKED_KEYS = 10000
+
+
+class AdmissionError(Exception):
+    """A request was turned away before reaching the callback."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After value: whole seconds, at least one."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateLimitedError(AdmissionError):
+    """The chat or client is over its request rate."""
+
+    status_code = 429
+
+
+class OverloadedError(AdmissionError):
+    """Too many requests are already in flight."""
+
+    status_code = 503
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity``."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float, amount: float = 1.0) -> float:
+        """Take ``amount`` tokens; returns 0 on success, else the seconds until they accrue."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """One TokenBucket per key (chat_id or client IP), bounded in the number of keys.
+
+    A forgotten key starts over with a full bucket, which only ever errs on
+    the side of admitting.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, max_keys: int = MAX_TRACKED_KEYS):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1.0)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def check(self, key: str, now: float) -> float:
+        """0 when ``key`` may proceed, else the seconds it should wait."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(now)
+
+
+class AdmissionController:
+    """Decides whether a request may go on to the callback.
+
+    ``chat_rate``/``ip_rate`` are requests per second (``*_burst`` the bucket
+    size, defaulting to one second's worth); ``max_in_flight`` caps admitted
+    requests that have not finished, including queued ones. Every
+    successful ``admit`` must be paired with a ``release`` of the same slots.
+    """
+
+    def __init__(
+        self,
+        chat_rate: Optional[float] = None,
+        chat_burst: Optional[float] = None,
+        ip_rate: Optional[float] = None,
+        ip_burst: Optional[float] = None,
+        max_in_flight: Optional[int] = None,
+        overload_retry_after: float = 1.0,
+        trust_forwarded_for: bool = False,
+    ):
+        self.chat_limiter = RateLimiter(chat_rate, chat_burst) if chat_rate else None
+        self.ip_limiter = RateLimiter(ip_rate, ip_burst) if ip_rate else None
+        self.max_in_flight = max_in_flight
+        self.overload_retry_after = overload_retry_after
+        self.trust_forwarded_for = trust_forwarded_for
+        self._admitted = 0
+        self._lock = threading.Lock()
+        ADMITTED.set_function(lambda: self._admitted)
+
+    @property
+    def admitted(self) -> int:
+        return self._admitted
+
+    def admit(
+        self, chat_id: Optional[str], client_ip: Optional[str] = None, slots: int = 1
+    ) -> int:
+        """Admit a request or raise RateLimitedError / OverloadedError.
+
+        Returns the slots taken, to hand back to ``release``. Overload is
+        checked first so shed requests do not also use up their rate.
+        """
+        with self._lock:
+            if self.max_in_flight is not None:
+                # A batch may ask for more than the cap; it then runs alone
+                slots = min(slots, self.max_in_flight)
+                if self._admitted + slots > self.max_in_flight:
+                    ADMISSION_REJECTIONS.inc(reason="overload")
+                    raise OverloadedError(
+                        "The agent is busy, please retry shortly",
+                        self.overload_retry_after,
+                    )
+            now = time.monotonic()
+            if self.ip_limiter is not None and client_ip is not None:
+                wait = self.ip_limiter.check(client_ip, now)
+                if wait:
+                    ADMISSION_REJECTIONS.inc(reason="ip")
+                    raise RateLimitedError("Too many requests from this client", wait)
+            if self.chat_limiter is not None and chat_id is not None:
+                wait = self.chat_limiter.check(str(chat_id), now)
+                if wait:
+                    ADMISSION_REJECTIONS.inc(reason="chat")
+                    raise RateLimitedError("Too many requests for this chat", wait)
+            self._admitted += slots
+        return slots
+
+    def release(self, slots: int = 1) -> None:
+        with self._lock:
+            self._admitted = max(self._admitted - slots, 0)
+
+    def client_ip(self, request: "Request") -> Optional[str]:
+        """The caller's address; the first X-Forwarded-For hop behind a trusted proxy."""
+        if self.trust_forwarded_for:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",", 1)[0].strip()
+        return request.client.host if request.client else None
@@ -0,0 +1,190 @@
+"""Replay many prompts through the agent in one /input/batch request.
+
+    python -m streamlit_view.batch prompts.jsonl responses.jsonl [--concurrency 8]
+
+Each input line is a JSON object with a "prompt" (or "message") and
+optionally a "chat_id" and an "id" that is copied to the output; a bare
+JSON string is taken as the prompt. Prompts without a chat_id each get a
+chat of their own. Results are written as they finish, one JSON object per
+line, with the server's per-item timings.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from common_utils.schemas import AgentRequest, AgentResponse
+from streamlit_view.streaming import DONE, ERROR, StreamError
+
+
+logger = logging.getLogger(__name__)
+
+# Values of the "status" field on each NDJSON line of a batch response,
+# besides DONE and ERROR (the whole batch failed)
+RESULT = "result"
+FAILED = "failed"
+
+MAX_BATCH_SIZE = 10000
+MAX_BATCH_CONCURRENCY = 64
+DEFAULT_BATCH_CONCURRENCY = 8
+
+
+class BatchResult(NamedTuple):
+    index: int
+    chat_id: Optional[str]
+    response: Optional[AgentResponse]
+    error: Optional[str]
+    timings: Dict[str, float]
+
+
+def clamp_concurrency(concurrency: Optional[int]) -> int:
+    if not concurrency:
+        return DEFAULT_BATCH_CONCURRENCY
+    return max(1, min(int(concurrency), MAX_BATCH_CONCURRENCY))
+
+
+def encode_batch_request(
+    agent_requests: Sequence[AgentRequest], concurrency: int
+) -> bytes:
+    """Request body for /input/batch, encoding each request once."""
+    return b"".join(
+        (
+            b'{"concurrency":',
+            str(concurrency).encode("ascii"),
+            b',"requests":[',
+            b",".join(r.model_dump_json().encode("utf-8") for r in agent_requests),
+            b"]}",
+        )
+    )
+
+
+def encode_result(result: BatchResult) -> bytes:
+    fields: Dict[str, Any] = {
+        "status": RESULT if result.error is None else FAILED,
+        "index": result.index,
+        "chat_id": result.chat_id,
+        "timings": result.timings,
+    }
+    if result.response is not None:
+        fields["response"] = result.response.model_dump(mode="json")
+    if result.error is not None:
+        fields["detail"] = result.error
+    return (json.dumps(fields) + "\n").encode("utf-8")
+
+
+def decode_batch(
+    lines: Iterable[bytes], trailer: Optional[Dict[str, Any]] = None
+) -> Iterator[BatchResult]:
+    """Turn the NDJSON lines of a /input/batch response into BatchResults."""
+    for line in lines:
+        if not line:
+            continue
+        data = json.loads(line)
+        status = data.get("status")
+        if status in (RESULT, FAILED):
+            response = data.get("response")
+            yield BatchResult(
+                index=data["index"],
+                chat_id=data.get("chat_id"),
+                response=AgentResponse.model_validate(response) if response else None,
+                error=data.get("detail"),
+                timings=data.get("timings", {}),
+            )
+        elif status == DONE:
+            if trailer is not None:
+                trailer.update({k: v for k, v in data.items() if k != "status"})
+            return
+        elif status == ERROR:
+            raise StreamError(data.get("detail", "Batch failed"))
+    raise StreamError("Batch ended before completion")
+
+
+def read_prompts(lines: Iterable[str], run_id: str) -> List[Tuple[Dict[str, Any], AgentRequest]]:
+    """Parse JSONL prompt lines into (input record, AgentRequest) pairs."""
+    prompts = []
+    for number, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, str):
+            record = {"prompt": record}
+        prompt = record.get("prompt", record.get("message"))
+        if prompt is None:
+            raise ValueError(f"Line {number + 1} has no prompt")
+        chat_id = record.get("chat_id") or f"batch-{run_id}-{len(prompts)}"
+        prompts.append((record, AgentRequest.text(chat_id=str(chat_id), message=prompt)))
+    return prompts
+
+
+def run_file(
+    input_path: str,
+    output_path: str,
+    concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    bypass_cache: bool = False,
+) -> Dict[str, Any]:
+    """Send every prompt in ``input_path`` and write the responses to ``output_path``."""
+    from streamlit_view.view import StreamlitView
+
+    with open(input_path, encoding="utf-8") as f:
+        prompts = read_prompts(f, uuid.uuid4().hex[:8])
+
+    started = time.perf_counter()
+    failed = 0
+    with open(output_path, "w", encoding="utf-8") as out:
+        for result in StreamlitView.send_batch(
+            [agent_request for _, agent_request in prompts],
+            concurrency=concurrency,
+            bypass_cache=bypass_cache,
+        ):
+            record, agent_request = prompts[result.index]
+            line = {
+                "index": result.index,
+                "chat_id": result.chat_id,
+                "prompt": agent_request.message,
+                "response": result.response.message if result.response else None,
+                "error": result.error,
+                "timings": {
+                    **result.timings,
+                    "elapsed": round((time.perf_counter() - started) * 1000, 2),
+                },
+            }
+            if "id" in record:
+                line["id"] = record["id"]
+            failed += result.error is not None
+            out.write(json.dumps(line) + "\n")
+            out.flush()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "count": len(prompts),
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "per_second": round(len(prompts) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("output", help="JSONL file to write responses to")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_BATCH_CONCURRENCY,
+        help=f"Prompts in flight at once (max {MAX_BATCH_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--bypass-cache", action="store_true", help="Skip the server's response cache"
+    )
+    args = parser.parse_args(argv)
+    summary = run_file(args.input, args.output, args.concurrency, args.bypass_cache)
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
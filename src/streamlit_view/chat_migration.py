@@ -0,0 +1,104 @@
+"""Bringing chat history kept by earlier versions into the current store.
+
+Covers three generations: the shelve files the UIs wrote before the
+SQLite store, a store file under its earlier name, and ``messages``
+tables that predate the per-message token and latency columns.
+"""
+import dbm
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# First bytes of every SQLite database file
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# Added to ``messages`` after the first release; older files gain them on open
+MESSAGE_COLUMN_MIGRATIONS = (
+    ("prompt_tokens", "INTEGER"),
+    ("completion_tokens", "INTEGER"),
+    ("latency_ms", "REAL"),
+)
+
+
+def is_dbm(path: str) -> bool:
+    """Whether a dbm database (what shelve wrote) exists at ``path``."""
+    try:
+        return bool(dbm.whichdb(path))
+    except Exception:
+        # whichdb opens a bare .db file with ndbm, which fails on anything else
+        return False
+
+
+def is_sqlite(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+
+def adopt_previous_file(path: str, previous_path: str) -> None:
+    """Move a store kept under an earlier file name to ``path``, with its WAL."""
+    if os.path.exists(path) or not is_sqlite(previous_path):
+        return
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(previous_path + suffix):
+            os.replace(previous_path + suffix, path + suffix)
+    logger.info("Moved chat store %s to %s", previous_path, path)
+
+
+def migrate_columns(conn: sqlite3.Connection) -> None:
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+    for column, column_type in MESSAGE_COLUMN_MIGRATIONS:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {column_type}")
+
+
+def read_shelve(shelve_path: str) -> Tuple[Dict[Any, Dict[str, Any]], Optional[Any]]:
+    """``(chats, current_chat_id)`` from a legacy shelve history.
+
+    Understands both layouts: the multi-chat ``chats``/``current_chat_id``
+    keys and the single-chat ``chat_id``/``messages`` keys.
+    """
+    import shelve
+
+    with shelve.open(shelve_path, flag="r") as db:
+        if "chats" in db:
+            return db.get("chats", {}), db.get("current_chat_id", None)
+        if db.get("chat_id"):
+            chat_id = db.get("chat_id", None)
+            return {chat_id: {"title": chat_id, "messages": db.get("messages", [])}}, chat_id
+    return {}, None
+
+
+def insert_legacy_chats(conn: sqlite3.Connection, chats: Dict[Any, Dict[str, Any]]) -> None:
+    """Insert shelve-era chats; callers hold an open transaction."""
+    now = time.time()
+    for order, (chat_id, chat) in enumerate(chats.items()):
+        # Keep the original sidebar order via strictly increasing timestamps
+        created_at = now + order * 1e-6
+        conn.execute(
+            "INSERT OR IGNORE INTO chats"
+            " (chat_id, title, created_at, updated_at, message_count)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                str(chat_id),
+                chat.get("title") or str(chat_id),
+                created_at,
+                created_at,
+                len(chat.get("messages", [])),
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO messages (chat_id, role, content, created_at)"
+            " VALUES (?, ?, ?, ?)",
+            [
+                (str(chat_id), msg["role"], msg["content"], created_at)
+                for msg in chat.get("messages", [])
+            ],
+        )
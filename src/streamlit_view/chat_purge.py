@@ -0,0 +1,76 @@
+"""Background removal of the messages of deleted chats."""
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Optional, Tuple
+
+if TYPE_CHECKING:
+    from streamlit_view.chat_store import ChatStore
+
+
+logger = logging.getLogger(__name__)
+
+# Messages deleted per transaction, so purging a long history never holds
+# the database (or the store's lock) for long
+PURGE_BATCH_SIZE = 1000
+
+
+class MessagePurger:
+    """Deletes a ChatStore's orphaned messages on a thread of its own, in batches.
+
+    Deleting a chat drops its row at once and hands its messages to this
+    class. While purges are outstanding the store's meta carries
+    ``purge_pending``, so a purge cut short by a restart is picked up again
+    the next time the store is opened.
+    """
+
+    def __init__(self, store: "ChatStore"):
+        self._store = store
+        # (WHERE clause, parameters) of message purges still to run
+        self._purges: Deque[Tuple[str, tuple]] = deque()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, where: str, params: tuple) -> None:
+        """Purge the messages matching ``where``.
+
+        Callers hold the store's lock and an open transaction, which the
+        ``purge_pending`` marker is written in.
+        """
+        self._purges.append((where, params))
+        self._store._write_meta("purge_pending", "1")
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="chat-store-purge", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        store = self._store
+        while True:
+            with store._lock:
+                if store.closed:
+                    self._thread = None
+                    return
+                if not self._purges:
+                    with store._conn:
+                        store._write_meta("purge_pending", None)
+                    self._thread = None
+                    return
+                where, params = self._purges[0]
+                try:
+                    with store._conn:
+                        cursor = store._conn.execute(
+                            "DELETE FROM messages WHERE id IN"
+                            f" (SELECT id FROM messages WHERE {where} LIMIT ?)",
+                            (*params, PURGE_BATCH_SIZE),
+                        )
+                except sqlite3.Error as e:
+                    logger.error(f"Purging messages of {store.path} failed: {e}")
+                    self._thread = None
+                    return
+                if cursor.rowcount < PURGE_BATCH_SIZE:
+                    self._purges.popleft()
+            # Lets the UI's reads and writes in between batches
+            time.sleep(0)
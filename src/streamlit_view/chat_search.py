@@ -0,0 +1,135 @@
+"""Full-text search over chat titles and message bodies.
+
+The FTS5 indexes are external content tables, so the text is not stored
+twice, and triggers keep them in step with every insert, rename and
+delete. Where SQLite lacks FTS5 the search falls back to LIKE scans.
+Changes a ChatStore has queued but not written are matched in memory by
+``matches``, with the same every-word-as-a-prefix rule as the index.
+"""
+import re
+import sqlite3
+from typing import List, NamedTuple, Optional
+
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content)
+    VALUES ('delete', old.id, old.content);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+    title, content='chats', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS chats_fts_insert AFTER INSERT ON chats BEGIN
+    INSERT INTO chats_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_delete AFTER DELETE ON chats BEGIN
+    INSERT INTO chats_fts (chats_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_update AFTER UPDATE OF title ON chats BEGIN
+    INSERT INTO chats_fts (chats_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+    INSERT INTO chats_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+"""
+
+
+class SearchHit(NamedTuple):
+    chat_id: str
+    title: str
+    # None when the chat's title matched rather than one of its messages
+    message_id: Optional[int]
+    snippet: str
+
+
+def rebuild_search_index(conn: sqlite3.Connection) -> None:
+    """Index the history written before the indexes existed."""
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO chats_fts (chats_fts) VALUES ('rebuild')")
+
+
+def match_query(text: str) -> Optional[str]:
+    """FTS5 query matching every word of ``text`` as a prefix; None if it has no words.
+
+    Quoting each word keeps FTS5 operators and punctuation in user input
+    from being interpreted as query syntax.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def matches(text: str, words: List[str]) -> bool:
+    """Whether every word prefixes a word of ``text``, as the FTS query matches."""
+    tokens = [token.casefold() for token in re.findall(r"\w+", text)]
+    return all(any(token.startswith(word) for token in tokens) for word in words)
+
+
+def highlight(text: str, words: List[str]) -> str:
+    return re.sub(
+        r"\w+",
+        lambda match: (
+            f"**{match.group()}**"
+            if any(match.group().casefold().startswith(word) for word in words)
+            else match.group()
+        ),
+        text,
+    )
+
+
+def snippet(text: str, words: List[str], width: int = 80) -> str:
+    """About ``width`` characters of ``text`` around its first match, highlighted."""
+    start = 0
+    for match in re.finditer(r"\w+", text):
+        if any(match.group().casefold().startswith(word) for word in words):
+            start = max(match.start() - width // 4, 0)
+            break
+    end = start + width
+    return (
+        ("…" if start else "")
+        + highlight(text[start:end], words)
+        + ("…" if end < len(text) else "")
+    )
+
+
+def search_indexed(conn: sqlite3.Connection, query: str, limit: int) -> List[SearchHit]:
+    """Title hits, then message hits, for a ``match_query`` query; best first."""
+    title_rows = conn.execute(
+        "SELECT c.chat_id, c.title, NULL,"
+        " highlight(chats_fts, 0, '**', '**')"
+        " FROM chats_fts JOIN chats c ON c.rowid = chats_fts.rowid"
+        " WHERE chats_fts MATCH ? ORDER BY rank LIMIT ?",
+        (query, limit),
+    ).fetchall()
+    message_rows = conn.execute(
+        "SELECT m.chat_id, c.title, m.id,"
+        " snippet(messages_fts, 0, '**', '**', '…', 12)"
+        " FROM messages_fts"
+        " JOIN messages m ON m.id = messages_fts.rowid"
+        # Skips messages of deleted chats still waiting to be purged
+        " JOIN chats c ON c.chat_id = m.chat_id"
+        " WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+        (query, limit),
+    ).fetchall()
+    return [SearchHit(*row) for row in (title_rows + message_rows)[:limit]]
+
+
+def search_unindexed(conn: sqlite3.Connection, text: str, limit: int) -> List[SearchHit]:
+    """Substring scan for SQLite builds without FTS5."""
+    pattern = f"%{text.strip()}%"
+    rows = conn.execute(
+        "SELECT chat_id, title, NULL, title FROM chats WHERE title LIKE ?"
+        " UNION ALL"
+        " SELECT m.chat_id, c.title, m.id, substr(m.content, 1, 120)"
+        " FROM messages m JOIN chats c ON c.chat_id = m.chat_id"
+        " WHERE m.content LIKE ? LIMIT ?",
+        (pattern, pattern, limit),
+    ).fetchall()
+    return [SearchHit(*row) for row in rows]
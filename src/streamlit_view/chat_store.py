@@ -0,0 +1,1024 @@
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from streamlit_view.chat_migration import (
+    adopt_previous_file,
+    insert_legacy_chats,
+    is_dbm,
+    migrate_columns,
+    read_shelve,
+)
+from streamlit_view.chat_purge import MessagePurger
+from streamlit_view.chat_search import (
+    SEARCH_SCHEMA,
+    SearchHit,
+    highlight,
+    match_query,
+    matches,
+    rebuild_search_index,
+    search_indexed,
+    search_unindexed,
+    snippet,
+)
+from streamlit_view.messages import ChatMessage, Role
+
+
+logger = logging.getLogger(__name__)
+
+# Point every UI replica at the same volume to share chat history
+CHAT_DATA_DIR = os.environ.get("STREAMLIT_VIEW_CHAT_DATA_DIR", "data/chats/.streamlit")
+
+# Message ids taken from the table's AUTOINCREMENT sequence at a time, so
+# a message has its id before its write-behind insert (see _reserve_ids)
+ID_BLOCK_SIZE = 100
+
+# Seconds before a batch that could not be written (busy, disk full) is retried
+FLUSH_RETRY_DELAY = 1.0
+
+# Keys per IN (...) query, well under SQLite's limit on bound parameters
+MAX_QUERY_PARAMETERS = 500
+
+# PRAGMA synchronous values: "off" leaves fsync to the OS, "normal" syncs the
+# WAL at checkpoints (survives an app crash), "full" syncs every flush
+SYNC_MODES = ("off", "normal", "full")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+CHAT_COLUMNS = "chat_id, title, created_at, updated_at, message_count"
+MESSAGE_COLUMNS = (
+    "id, role, content, created_at, prompt_tokens, completion_tokens, latency_ms"
+)
+
+
+def _message(row: tuple) -> ChatMessage:
+    return ChatMessage(row[0], Role(row[1]), *row[2:])
+
+
+def _chat(row: tuple) -> Dict[str, Any]:
+    return dict(zip(("chat_id", "title", "created_at", "updated_at", "message_count"), row))
+
+
+_INSERT_CHAT = (
+    "INSERT OR IGNORE INTO chats (chat_id, title, created_at, updated_at)"
+    " VALUES (?, ?, ?, ?)"
+)
+_INSERT_MESSAGE = (
+    "INSERT INTO messages (id, chat_id, role, content, created_at,"
+    " prompt_tokens, completion_tokens, latency_ms)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_COUNT_MESSAGE = (
+    "UPDATE chats SET message_count = message_count + 1,"
+    " updated_at = MAX(updated_at, ?) WHERE chat_id = ?"
+)
+_RENAME_CHAT = (
+    "UPDATE chats SET title = ?, updated_at = MAX(updated_at, ?) WHERE chat_id = ?"
+)
+_SET_META = (
+    "INSERT INTO meta (key, value) VALUES (?, ?)"
+    " ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+)
+
+
+class _PendingWrites:
+    """Changes a ChatStore has accepted but not committed yet.
+
+    Every entry is absolute (a chat as created, its latest title, a message
+    with its id, a meta value), so reads can lay them over what the database
+    returns and drop the ones that turn out to be committed already. A
+    newer rename or meta value replaces the queued one.
+    """
+
+    def __init__(self):
+        # chat_id -> (title, created_at); the first wins, as with INSERT OR IGNORE
+        self.chats: Dict[str, Tuple[str, float]] = {}
+        # chat_id -> (title, renamed at)
+        self.titles: Dict[str, Tuple[str, float]] = {}
+        # message id -> (chat_id, message), in id order
+        self.messages: Dict[int, Tuple[str, ChatMessage]] = {}
+        self.meta: Dict[str, Optional[str]] = {}
+        # monotonic time of the oldest change
+        self.since: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.chats) + len(self.titles) + len(self.messages) + len(self.meta)
+
+    def touch(self) -> None:
+        if self.since is None:
+            self.since = time.monotonic()
+
+    def merged(self, newer: "_PendingWrites") -> "_PendingWrites":
+        merged = _PendingWrites()
+        merged.chats = dict(self.chats)
+        for chat_id, chat in newer.chats.items():
+            merged.chats.setdefault(chat_id, chat)
+        merged.titles = {**self.titles, **newer.titles}
+        merged.messages = {**self.messages, **newer.messages}
+        merged.meta = {**self.meta, **newer.meta}
+        merged.since = self.since if self.since is not None else newer.since
+        return merged
+
+    def discard_chat(self, chat_id: str) -> None:
+        self.chats.pop(chat_id, None)
+        self.titles.pop(chat_id, None)
+        self.messages = {
+            message_id: entry
+            for message_id, entry in self.messages.items()
+            if entry[0] != chat_id
+        }
+
+    def changes(self) -> List[Tuple[str, Any, List[Tuple[str, tuple]]]]:
+        """``(kind, key, statements)`` per change, each to be committed whole."""
+        changes = [
+            ("chats", chat_id, [(_INSERT_CHAT, (chat_id, title, created_at, created_at))])
+            for chat_id, (title, created_at) in self.chats.items()
+        ]
+        for message_id, (chat_id, message) in self.messages.items():
+            changes.append(
+                (
+                    "messages",
+                    message_id,
+                    [
+                        (
+                            _INSERT_CHAT,
+                            (chat_id, chat_id, message.created_at, message.created_at),
+                        ),
+                        (
+                            _INSERT_MESSAGE,
+                            (
+                                message_id,
+                                chat_id,
+                                message.role.value,
+                                message.content,
+                                message.created_at,
+                                message.prompt_tokens,
+                                message.completion_tokens,
+                                message.latency_ms,
+                            ),
+                        ),
+                        (_COUNT_MESSAGE, (message.created_at, chat_id)),
+                    ],
+                )
+            )
+        changes += [
+            ("titles", chat_id, [(_RENAME_CHAT, (title, renamed_at, chat_id))])
+            for chat_id, (title, renamed_at) in self.titles.items()
+        ]
+        changes += [
+            ("meta", key, [(_SET_META, (key, value))]) for key, value in self.meta.items()
+        ]
+        return changes
+
+    def subset(self, keys: Iterable[Tuple[str, Any]]) -> "_PendingWrites":
+        """The changes named by ``(kind, key)``, as listed by ``changes``."""
+        subset = _PendingWrites()
+        for kind, key in keys:
+            getattr(subset, kind)[key] = getattr(self, kind)[key]
+        subset.since = self.since
+        return subset
+
+
+def _select_in(conn: sqlite3.Connection, query: str, keys: Iterable[Any]) -> List[tuple]:
+    """Rows of ``query`` + ``(?, ?, ...)`` over ``keys``, in chunks."""
+    keys = list(keys)
+    rows = []
+    for start in range(0, len(keys), MAX_QUERY_PARAMETERS):
+        chunk = keys[start:start + MAX_QUERY_PARAMETERS]
+        rows += conn.execute(f"{query} ({','.join('?' * len(chunk))})", chunk).fetchall()
+    return rows
+
+
+def _merge_messages(
+    committed: List[ChatMessage], queued: List[ChatMessage]
+) -> List[ChatMessage]:
+    """Both lists in id order; a queued message committed meanwhile appears once."""
+    if not queued:
+        return committed
+    merged = {message.id: message for message in committed}
+    merged.update((message.id, message) for message in queued)
+    return sorted(merged.values(), key=lambda message: message.id)
+
+
+def _message_deltas(
+    overlay: _PendingWrites, unwritten: set
+) -> Dict[str, Tuple[int, float]]:
+    """chat_id -> (queued messages, newest created_at) over the unwritten messages."""
+    deltas: Dict[str, Tuple[int, float]] = {}
+    for message_id in unwritten:
+        chat_id, message = overlay.messages[message_id]
+        count, updated_at = deltas.get(chat_id, (0, 0.0))
+        deltas[chat_id] = (count + 1, max(updated_at, message.created_at))
+    return deltas
+
+
+def _patched(
+    chat: Dict[str, Any],
+    overlay: _PendingWrites,
+    deltas: Dict[str, Tuple[int, float]],
+) -> Dict[str, Any]:
+    """Chat metadata with its queued rename and messages applied."""
+    title = overlay.titles.get(chat["chat_id"])
+    if title is not None:
+        chat["title"] = title[0]
+        chat["updated_at"] = max(chat["updated_at"], title[1])
+    delta = deltas.get(chat["chat_id"])
+    if delta is not None:
+        chat["message_count"] += delta[0]
+        chat["updated_at"] = max(chat["updated_at"], delta[1])
+    return chat
+
+
+class ChatStore:
+    """SQLite (WAL) chat persistence that writes only what changed.
+
+    Every mutation touches a single message row or a single chat's metadata,
+    so saving no longer costs O(total history) the way re-pickling the whole
+    ``chats`` dict into shelve did.
+
+    Deleting drops the chat rows at once and leaves their messages to a
+    background thread that removes them in batches. A purge cut short by a
+    restart is finished the next time the store is opened.
+
+    Titles and message bodies are indexed with FTS5 as they are written, so
+    ``search`` never scans the history.
+
+    With a ``flush_interval``, creating chats, appending messages, renaming
+    and switching chats are write-behind: they are queued in memory and a
+    background thread commits them together once the interval has passed
+    or ``flush_batch_size`` changes are waiting, so the Streamlit script
+    thread never waits on the disk for them. Successive renames of a chat
+    (typing in the rename box) and chat switches collapse into one write.
+    Reads lay the queue over what they find in the database, so the store
+    always reads its own writes without waiting for them. ``flush`` (also
+    run on close and at exit) writes everything out, but a process killed
+    outright loses up to ``flush_interval`` seconds of queued writes.
+    Without an interval, the default, every call is committed before it
+    returns, in one transaction.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 0.0,
+        flush_batch_size: int = 100,
+        synchronous: str = "normal",
+    ):
+        if synchronous not in SYNC_MODES:
+            raise ValueError(f"Unknown synchronous mode: {synchronous}")
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.synchronous = synchronous
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.RLock()
+        # Streamlit runs each session's script in its own thread
+        self._conn = self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        migrate_columns(self._conn)
+        self._conn.commit()
+        self._searchable = self._create_search_index()
+
+        self._purger = MessagePurger(self)
+        self._closed = False
+
+        # Write-behind: changes not committed yet, and the batch being committed
+        self._pending = _PendingWrites()
+        self._inflight: Optional[_PendingWrites] = None
+        self._pending_lock = threading.Lock()
+        # monotonic time before which a failed batch is not retried
+        self._retry_at = 0.0
+        # Held while a batch is committed
+        self._write_lock = threading.Lock()
+        # Separate connection: in WAL mode it commits while readers carry on
+        self._writer: Optional[sqlite3.Connection] = None
+        self._next_id = 0
+        self._id_limit = 0
+        if self._get_meta("purge_pending"):
+            with self._lock, self._conn:
+                self._purger.schedule("chat_id NOT IN (SELECT chat_id FROM chats)", ())
+
+    # ------------------------------------------------------------------ reads
+    #
+    # Reads never wait for the queue to be written: they query the database
+    # and lay the queued changes (see _PendingWrites) over the result.
+
+    def list_chats(
+        self, limit: Optional[int] = None, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        """Return chat metadata only (no message bodies), in sidebar order."""
+        overlay = self._overlay()
+        if overlay is None:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {CHAT_COLUMNS} FROM chats"
+                    " ORDER BY created_at, rowid LIMIT ? OFFSET ?",
+                    (-1 if limit is None else limit, offset),
+                ).fetchall()
+            return [_chat(row) for row in rows]
+
+        with self._reading() as conn:
+            # Queued chats may sort anywhere before the page's end
+            rows = conn.execute(
+                f"SELECT {CHAT_COLUMNS} FROM chats ORDER BY created_at, rowid LIMIT ?",
+                (-1 if limit is None else offset + limit,),
+            ).fetchall()
+            unwritten, new_chats = self._unwritten(conn, overlay)
+        chats = [_chat(row) for row in rows] + list(new_chats.values())
+        # Stable, so committed chats keep their rowid order on ties
+        chats.sort(key=lambda chat: chat["created_at"])
+        chats = chats[offset:None if limit is None else offset + limit]
+        deltas = _message_deltas(overlay, unwritten)
+        return [_patched(chat, overlay, deltas) for chat in chats]
+
+    def count_chats(self) -> int:
+        overlay = self._overlay()
+        with self._reading() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+            if overlay is not None:
+                count += len(self._unwritten(conn, overlay)[1])
+        return count
+
+    def load_messages(
+        self,
+        chat_id: str,
+        limit: Optional[int] = None,
+        before_id: Optional[int] = None,
+    ) -> List[ChatMessage]:
+        """Return messages oldest-first.
+
+        With ``limit`` only the newest ``limit`` messages are returned, and
+        ``before_id`` pages further back from an already loaded message.
+        """
+        query = f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE chat_id = ?"
+        params: List[Any] = [chat_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(-1 if limit is None else limit)
+
+        queued = self._queued_messages(chat_id)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        messages = [_message(row) for row in reversed(rows)]
+        if before_id is not None:
+            queued = [message for message in queued if message.id < before_id]
+        if queued:
+            messages = _merge_messages(messages, queued)
+            if limit is not None:
+                messages = messages[-limit:] if limit else []
+        return messages
+
+    def load_messages_since(
+        self, chat_id: str, after_id: int, limit: Optional[int] = None
+    ) -> List[ChatMessage]:
+        """Return the messages added after ``after_id``, oldest-first (a delta).
+
+        With ``limit`` only the oldest ``limit`` of them, to page forward.
+        """
+        queued = [
+            message for message in self._queued_messages(chat_id) if message.id > after_id
+        ]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM messages"
+                " WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (chat_id, after_id, -1 if limit is None else limit),
+            ).fetchall()
+        messages = _merge_messages([_message(row) for row in rows], queued)
+        return messages if limit is None else messages[:limit]
+
+    def load_contents(self, message_ids: Iterable[int]) -> Dict[int, str]:
+        """Return the bodies of the given messages, keyed by id."""
+        contents = {}
+        overlay = self._overlay()
+        if overlay is not None:
+            for message_id in message_ids:
+                entry = overlay.messages.get(message_id)
+                if entry is not None:
+                    contents[message_id] = entry[1].content
+        message_ids = [message_id for message_id in message_ids if message_id not in contents]
+        for start in range(0, len(message_ids), MAX_QUERY_PARAMETERS):
+            chunk = message_ids[start:start + MAX_QUERY_PARAMETERS]
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, content FROM messages WHERE id IN"
+                    f" ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            contents.update(rows)
+        return contents
+
+    def iter_messages(
+        self, chat_id: str, batch_size: int = 500
+    ) -> Iterator[ChatMessage]:
+        """Yield every message of a chat oldest-first, reading in batches."""
+        queued = deque(self._queued_messages(chat_id))
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM messages"
+                    " WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (chat_id, last_id, batch_size),
+                ).fetchall()
+            for row in rows:
+                while queued and queued[0].id < row[0]:
+                    yield queued.popleft()
+                if queued and queued[0].id == row[0]:
+                    # Written since the iteration started
+                    queued.popleft()
+                yield _message(row)
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1][0]
+        yield from queued
+
+    def search(self, text: str, limit: int = 20) -> List[SearchHit]:
+        """Chats whose title, then messages whose body, match every word of ``text``.
+
+        Best matches first within each group; snippets mark matches with **.
+        Queued changes are matched in memory and listed first.
+        """
+        query = match_query(text)
+        if query is None:
+            return []
+        overlay = self._overlay()
+        with self._reading() as conn:
+            if self._searchable:
+                hits = search_indexed(conn, query, limit)
+            else:
+                hits = search_unindexed(conn, text, limit)
+            if overlay is None:
+                return hits
+            unwritten, new_chats = self._unwritten(conn, overlay)
+            titles = {chat_id: chat["title"] for chat_id, chat in new_chats.items()}
+            titles.update((chat_id, title) for chat_id, (title, _) in overlay.titles.items())
+            missing = {
+                chat_id
+                for chat_id, _ in overlay.messages.values()
+                if chat_id not in titles
+            }
+            committed_titles = dict(
+                _select_in(conn, "SELECT chat_id, title FROM chats WHERE chat_id IN", missing)
+            )
+
+        words = [word.casefold() for word in re.findall(r"\w+", text)]
+        title_hits = [
+            SearchHit(chat_id, title, None, highlight(title, words))
+            for chat_id, title in titles.items()
+            if matches(title, words)
+        ]
+        message_hits = [
+            SearchHit(
+                chat_id,
+                titles.get(chat_id) or committed_titles.get(chat_id, chat_id),
+                message.id,
+                snippet(message.content, words),
+            )
+            for chat_id, message in reversed(overlay.messages.values())
+            if message.id in unwritten and matches(message.content, words)
+        ]
+        for hit in hits:
+            if hit.message_id is None:
+                # A queued rename decides whether the title matches
+                if hit.chat_id not in titles:
+                    title_hits.append(hit)
+            else:
+                message_hits.append(hit._replace(title=titles.get(hit.chat_id, hit.title)))
+        return (title_hits + message_hits)[:limit]
+
+    def get_chat(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """Return the metadata of one chat, or None if it does not exist."""
+        overlay = self._overlay()
+        with self._reading() as conn:
+            row = conn.execute(
+                f"SELECT {CHAT_COLUMNS} FROM chats WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if overlay is None:
+                return _chat(row) if row is not None else None
+            unwritten, new_chats = self._unwritten(conn, overlay)
+        chat = _chat(row) if row is not None else new_chats.get(chat_id)
+        if chat is None:
+            return None
+        return _patched(chat, overlay, _message_deltas(overlay, unwritten))
+
+    def get_current_chat_id(self) -> Optional[str]:
+        overlay = self._overlay()
+        if overlay is not None and "current_chat_id" in overlay.meta:
+            return overlay.meta["current_chat_id"]
+        return self._get_meta("current_chat_id")
+
+    def is_empty(self) -> bool:
+        overlay = self._overlay()
+        if overlay is not None and (overlay.chats or overlay.messages):
+            return False
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM chats LIMIT 1").fetchone() is None
+
+    # ----------------------------------------------------------------- writes
+    #
+    # Creating, appending, renaming and switching only queue the change;
+    # _queued then commits it now (write-through) or leaves it to the
+    # writer thread. Deletes are written at once.
+
+    def create_chat(self, chat_id: str, title: Optional[str] = None) -> None:
+        with self._pending_lock:
+            self._check_open()
+            self._pending.chats.setdefault(chat_id, (title or chat_id, time.time()))
+            self._pending.touch()
+        self._queued()
+
+    def append_message(
+        self,
+        chat_id: str,
+        role: Union[Role, str],
+        content: str,
+        prompt_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+        latency_ms: Optional[float] = None,
+    ) -> ChatMessage:
+        """Persist one message and return it with its id."""
+        role = Role(role)
+        with self._lock:
+            message_id = self._next_message_id()
+        message = ChatMessage(
+            message_id,
+            role,
+            content,
+            time.time(),
+            prompt_tokens,
+            completion_tokens,
+            latency_ms,
+        )
+        with self._pending_lock:
+            self._check_open()
+            self._pending.messages[message_id] = (chat_id, message)
+            self._pending.touch()
+        self._queued()
+        return message
+
+    def rename_chat(self, chat_id: str, title: str) -> None:
+        with self._pending_lock:
+            self._check_open()
+            # Replaces a rename still queued, so typing a title costs one write
+            self._pending.titles[chat_id] = (title, time.time())
+            self._pending.touch()
+        self._queued()
+
+    def set_current_chat_id(self, chat_id: Optional[str]) -> None:
+        with self._pending_lock:
+            self._check_open()
+            self._pending.meta["current_chat_id"] = chat_id
+            self._pending.touch()
+        self._queued()
+
+    def delete_chat(self, chat_id: str) -> None:
+        # The write lock waits out a commit that may hold this chat's messages
+        with self._write_lock:
+            with self._pending_lock:
+                self._check_open()
+                self._pending.discard_chat(chat_id)
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+                # Bounded by id so a chat re-created under the same id keeps its new messages
+                self._purger.schedule(
+                    "chat_id = ? AND id <= ?", (chat_id, self._last_message_id())
+                )
+
+    def delete_all(self) -> None:
+        with self._write_lock:
+            with self._pending_lock:
+                self._check_open()
+                self._pending = _PendingWrites()
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM chats")
+                self._conn.execute("DELETE FROM meta WHERE key = 'current_chat_id'")
+                self._purger.schedule("id <= ?", (self._last_message_id(),))
+                # New messages must number past the purge bound, whatever
+                # another process sharing the file reserved meanwhile
+                self._id_limit = self._next_id
+
+    def close(self) -> None:
+        """Write out what is queued and close the connections; later use raises."""
+        with self._write_lock:
+            with self._pending_lock:
+                if self._closed:
+                    return
+                # Writes are refused from here on
+                self._closed = True
+            self._write_pending()
+            if self._pending:
+                logger.error(
+                    f"Closed {self.path} with {len(self._pending)} changes"
+                    " that could not be written"
+                )
+            with self._lock:
+                # A pending purge stays recorded and resumes on the next open
+                self._conn.close()
+                if self._writer is not None:
+                    self._writer.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    # ------------------------------------------------------------ write-behind
+
+    def flush(self) -> None:
+        """Commit every queued write now; returns once they are on disk.
+
+        Changes that cannot be written for now (database busy, disk full)
+        stay queued, and the writer thread retries them.
+        """
+        with self._write_lock:
+            self._check_open()
+            self._write_pending()
+
+    def flush_due(self) -> Optional[float]:
+        """``time.monotonic()`` at which the queue should be written; None when empty."""
+        with self._pending_lock:
+            if self._closed or not self._pending:
+                return None
+            due = self._pending.since
+            if len(self._pending) < self.flush_batch_size:
+                due += self.flush_interval
+            return max(due, self._retry_at)
+
+    def _queued(self) -> None:
+        if self.flush_interval > 0:
+            _persister.schedule(self)
+        else:
+            self.flush()
+
+    def _write_pending(self) -> None:
+        # Callers hold the write lock. The batch stays visible to reads
+        # until its commit is over.
+        with self._pending_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, _PendingWrites()
+            self._inflight = batch
+        unwritten = self._commit(batch)
+        with self._pending_lock:
+            self._inflight = None
+            if unwritten is None:
+                self._retry_at = 0.0
+            else:
+                self._pending = unwritten.merged(self._pending)
+                self._retry_at = time.monotonic() + FLUSH_RETRY_DELAY
+        if unwritten is not None and not self._closed:
+            _persister.schedule(self)
+
+    def _commit(self, batch: "_PendingWrites") -> Optional["_PendingWrites"]:
+        """Write ``batch`` in one transaction; returns what is left to retry, if anything."""
+        if self._writer is None:
+            self._writer = self._connect()
+        changes = batch.changes()
+        try:
+            self._execute(changes)
+            return None
+        except sqlite3.OperationalError as e:
+            logger.error(f"Writing {len(changes)} changes to {self.path} failed, will retry: {e}")
+            return batch
+        except sqlite3.Error as e:
+            logger.warning(
+                f"Writing {len(changes)} changes to {self.path} failed ({e}),"
+                " writing them one at a time"
+            )
+        # One bad change must not take the rest of its batch down with it
+        for index, (kind, key, statements) in enumerate(changes):
+            try:
+                self._execute([(kind, key, statements)])
+            except sqlite3.OperationalError as e:
+                logger.error(f"Writing changes to {self.path} failed, will retry: {e}")
+                return batch.subset((kind, key) for kind, key, _ in changes[index:])
+            except sqlite3.Error as e:
+                logger.error(f"Dropped change {kind} {key!r} to {self.path}: {e}")
+        return None
+
+    def _execute(self, changes: List[Tuple[str, Any, List[Tuple[str, tuple]]]]) -> None:
+        with self._writer:
+            for _, _, statements in changes:
+                for sql, params in statements:
+                    self._writer.execute(sql, params)
+
+    def _overlay(self) -> Optional["_PendingWrites"]:
+        """A copy of every change not yet committed, or None when there is none."""
+        with self._pending_lock:
+            self._check_open()
+            if self._inflight is None and not self._pending:
+                return None
+            return (self._inflight or _PendingWrites()).merged(self._pending)
+
+    def _queued_messages(self, chat_id: str) -> List[ChatMessage]:
+        overlay = self._overlay()
+        if overlay is None:
+            return []
+        return [message for key, message in overlay.messages.values() if key == chat_id]
+
+    def _unwritten(
+        self, conn: sqlite3.Connection, overlay: "_PendingWrites"
+    ) -> Tuple[set, Dict[str, Dict[str, Any]]]:
+        """What of ``overlay`` the database does not have yet, as ``conn`` sees it.
+
+        Returns the ids of those messages, and the metadata of the chats
+        they (or create_chat) will add, before renames and counts apply.
+        """
+        unwritten = set(overlay.messages) - {
+            row[0]
+            for row in _select_in(conn, "SELECT id FROM messages WHERE id IN", overlay.messages)
+        }
+        candidates = dict(overlay.chats)
+        for chat_id, message in overlay.messages.values():
+            candidates.setdefault(chat_id, (chat_id, message.created_at))
+        existing = {
+            row[0]
+            for row in _select_in(conn, "SELECT chat_id FROM chats WHERE chat_id IN", candidates)
+        }
+        new_chats = {
+            chat_id: {
+                "chat_id": chat_id,
+                "title": title,
+                "created_at": created_at,
+                "updated_at": created_at,
+                "message_count": 0,
+            }
+            for chat_id, (title, created_at) in candidates.items()
+            if chat_id not in existing
+        }
+        return unwritten, new_chats
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        """The connection inside one read transaction, so its queries agree."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield self._conn
+            finally:
+                self._conn.rollback()
+
+    def _check_open(self) -> None:
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"Chat store {self.path} is closed")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute(f"PRAGMA synchronous={self.synchronous.upper()}")
+        return conn
+
+    def _next_message_id(self) -> int:
+        # Callers hold the lock
+        if self._next_id >= self._id_limit:
+            self._reserve_ids()
+        self._next_id += 1
+        return self._next_id
+
+    def _reserve_ids(self) -> None:
+        """Claim the next ID_BLOCK_SIZE message ids from the AUTOINCREMENT sequence.
+
+        Other connections and processes sharing the file then number their
+        messages past the block, so ids stay unique without waiting for
+        the queued inserts.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'messages'"
+            ).fetchone()
+            start = max(row[0] if row else 0, self._last_message_id())
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', ?)",
+                    (start + ID_BLOCK_SIZE,),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE sqlite_sequence SET seq = ? WHERE name = 'messages'",
+                    (start + ID_BLOCK_SIZE,),
+                )
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._next_id, self._id_limit = start, start + ID_BLOCK_SIZE
+
+    def _last_message_id(self) -> int:
+        row = self._conn.execute("SELECT MAX(id) FROM messages").fetchone()
+        return row[0] or 0
+
+    # -------------------------------------------------------------- migration
+
+    def migrate_from_shelve(self, shelve_path: str) -> bool:
+        """Import a legacy shelve history once; returns True if anything was copied."""
+        if self._get_meta("migrated_from_shelve") or not is_dbm(shelve_path):
+            return False
+        self.flush()
+
+        chats, current_chat_id = read_shelve(shelve_path)
+        with self._lock, self._conn:
+            insert_legacy_chats(self._conn, chats)
+            if current_chat_id is not None:
+                self._write_meta("current_chat_id", str(current_chat_id))
+            self._write_meta("migrated_from_shelve", shelve_path)
+
+        logger.info("Migrated %d chats from shelve %s", len(chats), shelve_path)
+        return bool(chats)
+
+    # ---------------------------------------------------------------- helpers
+
+    def _create_search_index(self) -> bool:
+        """Set up the FTS5 indexes, building them once for pre-existing history."""
+        try:
+            with self._lock:
+                self._conn.executescript(SEARCH_SCHEMA)
+                if not self._get_meta("search_index_built"):
+                    with self._conn:
+                        rebuild_search_index(self._conn)
+                        self._write_meta("search_index_built", "1")
+        except sqlite3.OperationalError as e:
+            logger.warning(
+                f"SQLite has no FTS5 ({e}); chat search in {self.path} will scan the history"
+            )
+            return False
+        return True
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write_meta(self, key: str, value: Optional[str]) -> None:
+        # Callers hold the lock and an open transaction
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+
+# Per-user/session namespaces each open a store; past this many the least
+# recently used ones are let go (callers re-fetch their store every rerun)
+MAX_OPEN_STORES = 128
+
+_stores: "OrderedDict[str, ChatStore]" = OrderedDict()
+# Every store still referenced anywhere, so a session holding an evicted
+# store and the next caller for its path share the one instance
+_live_stores: "weakref.WeakValueDictionary[str, ChatStore]" = weakref.WeakValueDictionary()
+_stores_lock = threading.Lock()
+
+
+def get_chat_store(
+    path: str,
+    legacy_shelve: Optional[str] = None,
+    previous_path: Optional[str] = None,
+) -> ChatStore:
+    """Return the process-wide ChatStore for ``path``, migrating shelve data once.
+
+    A store still at ``previous_path`` (an earlier file name) is moved to
+    ``path`` first.
+
+    Write-behind is set up from ``ServerConfig().persist_*``. Stores past
+    MAX_OPEN_STORES are never closed here, since a session may still be in
+    the middle of a rerun with one: they are only dropped from the LRU, and
+    their connections close once the last holder lets go of them (queued
+    writes keep a store alive until they are flushed).
+    """
+    from streamlit_view.view_configurations import ServerConfig
+
+    with _stores_lock:
+        store = _stores.get(path) or _live_stores.get(path)
+        if store is None or store.closed:
+            if previous_path:
+                adopt_previous_file(path, previous_path)
+            server_config = ServerConfig()
+            store = ChatStore(
+                path,
+                flush_interval=server_config.persist_interval,
+                flush_batch_size=server_config.persist_batch_size,
+                synchronous=server_config.persist_sync,
+            )
+            if legacy_shelve and store.is_empty():
+                store.migrate_from_shelve(legacy_shelve)
+            _live_stores[path] = store
+        _stores[path] = store
+        _stores.move_to_end(path)
+        while len(_stores) > MAX_OPEN_STORES:
+            _stores.popitem(last=False)
+    return store
+
+
+class _Persister:
+    """The one thread that writes every store's write-behind queue when it is due."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._dirty: Dict[int, ChatStore] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, store: ChatStore) -> None:
+        with self._cond:
+            self._dirty[id(store)] = store
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="chat-store-writer", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def flush_all(self) -> None:
+        with self._cond:
+            stores = list(self._dirty.values())
+            self._dirty.clear()
+        for store in stores:
+            if not store.closed:
+                store.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                due: List[ChatStore] = []
+                wake_at = None
+                now = time.monotonic()
+                for key, store in list(self._dirty.items()):
+                    at = store.flush_due()
+                    if at is None:
+                        # Flushed in the meantime, by a read or another thread
+                        del self._dirty[key]
+                    elif at <= now:
+                        due.append(store)
+                        del self._dirty[key]
+                    else:
+                        wake_at = at if wake_at is None else min(wake_at, at)
+                if not due:
+                    self._cond.wait(None if wake_at is None else wake_at - now)
+                    continue
+            for store in due:
+                try:
+                    store.flush()
+                except Exception as e:
+                    logger.error(f"Flushing {store.path} failed: {e}", exc_info=True)
+
+
+_persister = _Persister()
+
+
+def flush_all() -> None:
+    """Write out every store's queued changes; runs at interpreter exit."""
+    _persister.flush_all()
+    with _stores_lock:
+        stores = list(_live_stores.values())
+    for store in stores:
+        if not store.closed:
+            store.flush()
+
+
+atexit.register(flush_all)
@@ -0,0 +1,202 @@
+"""Optional client-side context management for outgoing prompts.
+
+The agent normally gets only the current prompt. With a context budget
+configured (``ServerConfig().context_max_tokens``), the UI's history is
+trimmed to fit the budget and sent along with the prompt, as a separate
+``ChatContext`` that leaves the prompt itself untouched:
+
+- "window" keeps the newest messages that fit.
+- "summary" also condenses the dropped messages into a short summary.
+
+Token counts come from a pluggable tokenizer (``set_tokenizer``). The
+default is a regex word/punctuation counter that needs no model files.
+
+On the server, the view callback reads the context sent with the request
+it is handling through ``current_context()``.
+"""
+import contextlib
+import re
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Mapping, NamedTuple, Optional, Sequence
+
+from streamlit_view.messages import ChatMessage, Role
+
+
+WINDOW_STRATEGY = "window"
+SUMMARY_STRATEGY = "summary"
+CONTEXT_STRATEGIES = (WINDOW_STRATEGY, SUMMARY_STRATEGY)
+
+# Role label and separators each message adds around its content
+MESSAGE_OVERHEAD_TOKENS = 4
+# Share of the budget the "summary" strategy sets aside for the summary
+SUMMARY_SHARE = 0.25
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def count_tokens_regex(text: str) -> int:
+    """Words and punctuation marks; close enough to BPE counts for budgeting."""
+    return sum(1 for _ in _TOKEN_PATTERN.finditer(text))
+
+
+def summarize_extractive(messages: Sequence[ChatMessage], max_tokens: int) -> str:
+    """First sentence of each message, oldest first, until ``max_tokens`` is used."""
+    lines = []
+    used = 0
+    for message in messages:
+        sentence = _SENTENCE_END.split((message.content or "").strip(), 1)[0]
+        line = f"{message.role.value}: {sentence}"
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(lines)
+
+
+_tokenizer: Callable[[str], int] = count_tokens_regex
+_summarizer: Callable[[Sequence[ChatMessage], int], str] = summarize_extractive
+
+
+def set_tokenizer(tokenizer: Optional[Callable[[str], int]]) -> None:
+    """Count tokens with ``tokenizer(text) -> int`` (e.g. tiktoken); None restores the default."""
+    global _tokenizer
+    _tokenizer = tokenizer or count_tokens_regex
+
+
+def set_summarizer(summarizer: Optional[Callable[[Sequence[ChatMessage], int], str]]) -> None:
+    """Summarize dropped messages with ``summarizer(messages, max_tokens) -> str``."""
+    global _summarizer
+    _summarizer = summarizer or summarize_extractive
+
+
+def count_tokens(text: str) -> int:
+    return _tokenizer(text)
+
+
+class ChatContext(NamedTuple):
+    """Trimmed history that travels next to a prompt, never inside it."""
+
+    messages: List[ChatMessage]
+    summary: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "messages": [
+                {"role": m.role.value, "content": m.content or ""} for m in self.messages
+            ]
+        }
+        if self.summary:
+            data["summary"] = self.summary
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "ChatContext":
+        """Parse the wire form; raises ValueError when it is malformed."""
+        if not isinstance(data, Mapping):
+            raise ValueError("Context must be an object")
+        raw_messages = data.get("messages") or []
+        summary = data.get("summary")
+        if not isinstance(raw_messages, list) or not (
+            summary is None or isinstance(summary, str)
+        ):
+            raise ValueError("Context needs a list of messages and a text summary")
+        messages = []
+        for raw in raw_messages:
+            if not isinstance(raw, Mapping) or not isinstance(raw.get("content"), str):
+                raise ValueError("Context messages need a role and text content")
+            messages.append(ChatMessage(None, Role(raw.get("role")), raw["content"], 0.0))
+        return cls(messages, summary or None)
+
+    def transcript(self) -> str:
+        """Summary and turns as plain text, for agents that take a single string."""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation:\n{self.summary}")
+        if self.messages:
+            parts.append("\n".join(f"{m.role.value}: {m.content}" for m in self.messages))
+        return "\n\n".join(parts)
+
+
+_current_context: ContextVar[Optional[ChatContext]] = ContextVar(
+    "streamlit_view_chat_context", default=None
+)
+
+
+def current_context() -> Optional[ChatContext]:
+    """The history the UI sent with the request the view callback is handling."""
+    return _current_context.get()
+
+
+@contextlib.contextmanager
+def using_context(context: Optional[ChatContext]) -> Iterator[None]:
+    """Make ``context`` current; tasks created inside keep it after the block."""
+    token = _current_context.set(context)
+    try:
+        yield
+    finally:
+        _current_context.reset(token)
+
+
+class ContextWindow(NamedTuple):
+    messages: List[ChatMessage]
+    summary: Optional[str]
+    prompt_tokens: int
+    context_tokens: int
+    dropped: int
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.context_tokens
+
+    def context(self) -> Optional[ChatContext]:
+        """What to send with the prompt; None when nothing of the history fit."""
+        if not self.messages and not self.summary:
+            return None
+        return ChatContext(list(self.messages), self.summary)
+
+    def report(self) -> Dict[str, int]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "context_tokens": self.context_tokens,
+            "total_tokens": self.total_tokens,
+            "kept_messages": len(self.messages),
+            "dropped_messages": self.dropped,
+        }
+
+
+def build_context(
+    history: Sequence[ChatMessage],
+    prompt: str,
+    max_tokens: int,
+    strategy: str = WINDOW_STRATEGY,
+) -> ContextWindow:
+    """Fit as much of ``history`` (oldest first, without ``prompt``) as ``max_tokens`` allows.
+
+    Walks back from the newest message, so only kept messages (and, for the
+    summary strategy, the summarized ones) are ever tokenized.
+    """
+    if strategy not in CONTEXT_STRATEGIES:
+        raise ValueError(f"Unknown context strategy: {strategy}")
+    prompt_tokens = count_tokens(prompt)
+    budget = max(max_tokens - prompt_tokens, 0)
+    summary_budget = int(budget * SUMMARY_SHARE) if strategy == SUMMARY_STRATEGY else 0
+
+    kept: List[ChatMessage] = []
+    used = 0
+    for message in reversed(history):
+        tokens = count_tokens(message.content or "") + MESSAGE_OVERHEAD_TOKENS
+        if used + tokens > budget - summary_budget:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    dropped = len(history) - len(kept)
+
+    summary = None
+    if dropped and summary_budget:
+        summary = _summarizer(history[:dropped], summary_budget) or None
+        if summary:
+            used += count_tokens(summary)
+    return ContextWindow(kept, summary, prompt_tokens, used, dropped)
@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Iterable, Optional, Tuple
+
+from common_utils.schemas import AgentRequest, AgentResponse
+from streamlit_view.admission import AdmissionController
+from streamlit_view.context import ChatContext
+from streamlit_view.batch import BatchResult
+from streamlit_view.jobs import Job, JobManager, JobStatus, QueueFullError, call_view_callback
+from streamlit_view.metrics import RequestTimer
+from streamlit_view.response_cache import ResponseCache
+from streamlit_view.streaming import (
+    SharedStream,
+    StreamCancelledError,
+    StreamRegistry,
+    iter_agent_chunks,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobFailedError(Exception):
+    """Raised when the view callback failed while producing a response."""
+
+
+class JobCancelledError(Exception):
+    """Raised when a job was cancelled before it produced a response."""
+
+
+class DeadlineExceededError(JobCancelledError):
+    """Raised when a job's deadline passed before it produced a response."""
+
+
+async def _replay(response: AgentResponse) -> AsyncIterator[AgentResponse]:
+    yield response
+
+
+class Dispatcher:
+    """Everything between a parsed AgentRequest and the view callback.
+
+    Holds the response cache, the admission controller, the job queue and
+    the in-flight stream registry.
+    The FastAPI endpoints translate HTTP to and from these calls, and the
+    in-process transport calls them directly on the server's event loop.
+    """
+
+    def __init__(
+        self,
+        view_callback: Callable,
+        stream_callback: Optional[Callable] = None,
+        job_manager: Optional[JobManager] = None,
+        response_cache: Optional[ResponseCache] = None,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.view_callback = view_callback
+        self.stream_callback = stream_callback
+        self.job_manager = job_manager or JobManager(view_callback)
+        self.response_cache = response_cache
+        self.admission = admission
+        self.streams = StreamRegistry()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self) -> None:
+        """Remember the serving event loop so other threads can submit work to it."""
+        self.loop = asyncio.get_running_loop()
+
+    async def lookup_cache(
+        self, agent_request: AgentRequest, read_cache: bool = True
+    ) -> Optional[AgentResponse]:
+        if self.response_cache is None or not read_cache:
+            return None
+        return await self.response_cache.fetch(agent_request)
+
+    def admit(
+        self, chat_id: Optional[str], client_ip: Optional[str] = None, slots: int = 1
+    ) -> Callable[..., None]:
+        """Pass admission control; returns the callable that hands the slots back.
+
+        Raises AdmissionError when the request is to be shed. The returned
+        callable ignores its arguments and only releases once, so it can be
+        used as a done callback and from ``finally`` blocks alike.
+        """
+        if self.admission is None:
+            return lambda *_: None
+        taken = self.admission.admit(chat_id, client_ip, slots)
+        released = []
+
+        def release(*_):
+            if not released:
+                released.append(True)
+                self.admission.release(taken)
+
+        return release
+
+    def admit_batch(
+        self, concurrency: int, client_ip: Optional[str] = None
+    ) -> Tuple[int, Callable[..., None]]:
+        """Admit a batch as one request holding a slot per worker.
+
+        Only the client's rate applies, not that of each chat. Returns the
+        concurrency to run at (never above the in-flight cap) and the release.
+        """
+        if self.admission is not None and self.admission.max_in_flight:
+            concurrency = min(concurrency, self.admission.max_in_flight)
+        return concurrency, self.admit(None, client_ip, slots=concurrency)
+
+    def submit(
+        self,
+        agent_request: AgentRequest,
+        idempotency_key: Optional[str] = None,
+        write_cache: bool = True,
+        client_ip: Optional[str] = None,
+        deadline: Optional[float] = None,
+        context: Optional[ChatContext] = None,
+    ) -> Job:
+        """Queue a request, to expire at ``deadline`` (a ``time.time()``) if given.
+
+        ``context`` is the history sent next to the prompt. Raises
+        AdmissionError when admission control sheds the request and
+        QueueFullError when the queue is at capacity.
+        """
+        release = self.admit(agent_request.chat_id, client_ip)
+        try:
+            job = self.job_manager.submit(
+                agent_request, idempotency_key, deadline=deadline, context=context
+            )
+        except QueueFullError:
+            release()
+            raise
+        job.add_done_callback(release)
+        if write_cache:
+            job.add_done_callback(self._cache_result)
+        return job
+
+    def _cache_result(self, job: Job) -> None:
+        if self.response_cache is not None and job.status == JobStatus.SUCCEEDED:
+            self.response_cache.put(job.request, job.result)
+
+    async def wait(self, job: Job, timer: Optional[RequestTimer] = None) -> AgentResponse:
+        """The job's response; raises JobFailedError or JobCancelledError.
+
+        If the waiting task is cancelled (the client went away) and no one
+        else waits on the job, the job is cancelled too.
+        """
+        job.waiters += 1
+        abandoned = True
+        try:
+            await self.job_manager.wait(job)
+            abandoned = False
+        finally:
+            job.waiters -= 1
+            if abandoned and not job.waiters:
+                self.job_manager.cancel(job)
+        if timer is not None and job.started_at is not None:
+            timer.record("queue", job.started_at - job.created_at)
+            timer.record("callback", job.finished_at - job.started_at)
+        if job.status == JobStatus.FAILED:
+            raise JobFailedError(job.error)
+        if job.status == JobStatus.EXPIRED:
+            raise DeadlineExceededError(job.error)
+        if job.status == JobStatus.CANCELLED:
+            raise JobCancelledError(job.error)
+        return job.result
+
+    async def respond(
+        self,
+        agent_request: AgentRequest,
+        idempotency_key: Optional[str] = None,
+        read_cache: bool = True,
+        write_cache: bool = True,
+        timer: Optional[RequestTimer] = None,
+        client_ip: Optional[str] = None,
+        deadline: Optional[float] = None,
+        context: Optional[ChatContext] = None,
+    ) -> AgentResponse:
+        """Cache lookup, queueing and waiting in one call."""
+        cached = await self.lookup_cache(agent_request, read_cache)
+        if cached is not None:
+            return cached
+        job = self.submit(
+            agent_request, idempotency_key, write_cache, client_ip, deadline, context
+        )
+        return await self.wait(job, timer)
+
+    async def open_stream(
+        self,
+        agent_request: AgentRequest,
+        idempotency_key: Optional[str] = None,
+        read_cache: bool = True,
+        write_cache: bool = True,
+        client_ip: Optional[str] = None,
+        deadline: Optional[float] = None,
+        context: Optional[ChatContext] = None,
+    ) -> SharedStream:
+        """Start (or join, for a duplicate key) a streamed turn.
+
+        A new turn is queued as a job like any other, so it waits for a
+        worker in its chat's lane and counts against the queue bound.
+        Raises AdmissionError or QueueFullError before anything starts when
+        the turn is shed. The job expires at ``deadline`` (a ``time.time()``),
+        and ``context`` works as in ``submit``.
+        """
+        chat_id = agent_request.chat_id
+        cached = await self.lookup_cache(agent_request, read_cache)
+        if cached is not None:
+            return self.streams.get_or_start(
+                chat_id, idempotency_key, lambda: _replay(cached)
+            )
+
+        release = self.admit(chat_id, client_ip)
+        jobs = []
+
+        def start():
+            job, source = self._queue_stream(agent_request, deadline, context)
+            jobs.append(job)
+            return source
+
+        try:
+            stream = self.streams.get_or_start(chat_id, idempotency_key, start)
+        except QueueFullError:
+            release()
+            raise
+        if not jobs:
+            # Joined a stream already running under its own admission
+            release()
+            return stream
+        job = jobs[0]
+        job.add_done_callback(release)
+        if write_cache:
+            job.add_done_callback(self._cache_result)
+        # Also covers a stream cancelled before its pump ever stepped the source
+        stream._task.add_done_callback(lambda _: self.job_manager.cancel(job))
+        return stream
+
+    def _queue_stream(
+        self,
+        agent_request: AgentRequest,
+        deadline: Optional[float],
+        context: Optional[ChatContext],
+    ) -> Tuple[Job, AsyncIterator[AgentResponse]]:
+        """Submit a streamed turn as a job; returns it and the chunks it produces."""
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        async def run() -> AgentResponse:
+            parts = []
+            async for chunk in iter_agent_chunks(
+                agent_request, self.view_callback, self.stream_callback
+            ):
+                parts.append(chunk.message or "")
+                chunks.put_nowait(chunk)
+            return AgentResponse(chat_id=agent_request.chat_id, message="".join(parts))
+
+        # Not keyed: the stream registry coalesces streams, and an /input job
+        # under the same key has no chunks to follow
+        job = self.job_manager.submit(
+            agent_request, deadline=deadline, runner=run, context=context
+        )
+        job.add_done_callback(lambda _: chunks.put_nowait(None))
+
+        async def follow():
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+            if job.status == JobStatus.FAILED:
+                raise JobFailedError(job.error)
+            if job.status == JobStatus.EXPIRED:
+                raise StreamCancelledError(job.error, expired=True)
+            if job.status == JobStatus.CANCELLED:
+                raise StreamCancelledError(job.error)
+
+        return job, follow()
+
+    def cancel(self, chat_id: Optional[str], idempotency_key: str) -> bool:
+        """Stop the turn sent under ``idempotency_key`` (the UI's message_id).
+
+        Covers queued or running jobs and streams alike; returns False when
+        there was nothing left to stop.
+        """
+        cancelled = False
+        job = self.job_manager.find(chat_id, idempotency_key)
+        if job is not None:
+            cancelled = self.job_manager.cancel(job)
+        stream = self.streams.find(chat_id, idempotency_key)
+        if stream is not None:
+            cancelled = stream.cancel() or cancelled
+        return cancelled
+
+    async def run_batch(
+        self,
+        items: Iterable[Tuple[int, AgentRequest]],
+        concurrency: int,
+        read_cache: bool = True,
+        write_cache: bool = True,
+    ) -> AsyncIterator[BatchResult]:
+        """Run (index, request) pairs through the callback, yielding results as they finish.
+
+        At most ``concurrency`` items are in progress at once, and every
+        callback call waits for a slot of the job manager's batch lane, which
+        all batches share, so replays never get more than ``batch_workers``
+        callbacks between them. Turns of one chat still take the chat's lock.
+        A failing item is reported in its result and never stops the batch.
+        """
+
+        async def run_one(index: int, agent_request: AgentRequest) -> BatchResult:
+            chat_id = agent_request.chat_id
+            submitted = time.perf_counter()
+            try:
+                cached = await self.lookup_cache(agent_request, read_cache)
+                if cached is not None:
+                    return BatchResult(index, chat_id, cached, None, {"cache": 0.0})
+                # The lane slot first: a slot idling on a chat's lock only
+                # slows batches, while a held lock would stall the chat's user
+                async with self.job_manager.batch_slot():
+                    async with self.job_manager.serialized(chat_id):
+                        started = time.perf_counter()
+                        response = await call_view_callback(
+                            self.view_callback, agent_request
+                        )
+                finished = time.perf_counter()
+                if response is None:
+                    response = AgentResponse(
+                        chat_id=chat_id,
+                        message="Request received and queued for processing",
+                    )
+                if self.response_cache is not None and write_cache:
+                    self.response_cache.put(agent_request, response)
+                timings = {
+                    "queue": round((started - submitted) * 1000, 2),
+                    "callback": round((finished - started) * 1000, 2),
+                }
+                return BatchResult(index, chat_id, response, None, timings)
+            except Exception as e:
+                logger.error(f"Batch item {index} failed: {e}", exc_info=True)
+                elapsed = round((time.perf_counter() - submitted) * 1000, 2)
+                return BatchResult(index, chat_id, None, str(e), {"total": elapsed})
+
+        items = iter(items)
+        pending = set()
+        try:
+            while True:
+                for index, agent_request in items:
+                    pending.add(asyncio.create_task(run_one(index, agent_request)))
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            # The client went away; sync callbacks already running finish anyway
+            for task in pending:
+                task.cancel()
+
+    def purge(
+        self, agent_request: AgentRequest, idempotency_key: Optional[str] = None
+    ) -> Job:
+        """Queue a delete request for the callback and drop what the caches hold.
+
+        A request without a chat_id purges the whole history. The job runs in
+        the chat's lane after the turns already queued for it, and a full
+        queue never refuses it. The caches are purged right away and again
+        once the job finishes, so no turn that completed in between leaves a
+        stale answer behind.
+        """
+        chat_id = agent_request.chat_id
+
+        def purge_caches(job=None):
+            if chat_id is None:
+                self.clear_caches()
+            else:
+                self.invalidate_chat(chat_id)
+
+        purge_caches()
+        job = self.job_manager.submit(agent_request, idempotency_key, bounded=False)
+        job.add_done_callback(purge_caches)
+        return job
+
+    def invalidate_chat(self, chat_id: Optional[str]) -> None:
+        if self.response_cache is not None:
+            self.response_cache.invalidate_chat(chat_id)
+
+    def clear_caches(self) -> None:
+        if self.response_cache is not None:
+            self.response_cache.clear()
@@ -0,0 +1,129 @@
+import gzip
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from common_utils.schemas import AgentResponse
+
+# Optional speedups; the JSON envelope works without any of them
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+ENVELOPE_VERSION = 2
+LEGACY_MEDIA_TYPE = "application/json"
+V2_JSON_MEDIA_TYPE = "application/vnd.streamlit-view.v2+json"
+V2_MSGPACK_MEDIA_TYPE = "application/vnd.streamlit-view.v2+msgpack"
+
+
+def available_media_types() -> Tuple[str, ...]:
+    """v2 media types this process can produce, most compact first."""
+    if msgpack is not None:
+        return (V2_MSGPACK_MEDIA_TYPE, V2_JSON_MEDIA_TYPE)
+    return (V2_JSON_MEDIA_TYPE,)
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Pick the response media type for an Accept header.
+
+    Clients that do not ask for a v2 type by name (every client written
+    before the envelope existed) keep getting the legacy format.
+    """
+    accepted = {
+        part.split(";")[0].strip().lower() for part in (accept or "").split(",")
+    }
+    for media_type in available_media_types():
+        if media_type in accepted:
+            return media_type
+    return LEGACY_MEDIA_TYPE
+
+
+def encode_response(agent_response: AgentResponse, media_type: str) -> bytes:
+    """Serialise a successful /input result in the negotiated format."""
+    if media_type == V2_MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(
+            {
+                "status": "success",
+                "version": ENVELOPE_VERSION,
+                "response": agent_response.model_dump(mode="json"),
+            }
+        )
+    if media_type == V2_JSON_MEDIA_TYPE:
+        # Splice pydantic's own encoding in so the response is encoded once
+        return b"".join(
+            (
+                b'{"status":"success","version":2,"response":',
+                agent_response.model_dump_json().encode("utf-8"),
+                b"}",
+            )
+        )
+    # Legacy: the response travels as a JSON string inside the JSON body
+    return dumps({"status": "success", "response": agent_response.model_dump_json()})
+
+
+def decode_response(content: bytes, content_type: Optional[str]) -> AgentResponse:
+    """Parse an /input body of any version back into an AgentResponse."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type == V2_MSGPACK_MEDIA_TYPE:
+        data = msgpack.unpackb(content)
+    else:
+        data = loads(content)
+    response = data["response"]
+    if isinstance(response, str):
+        return AgentResponse.model_validate_json(response)
+    return AgentResponse.model_validate(response)
+
+
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def loads(content: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def accept_encodings() -> str:
+    """Accept-Encoding value for clients, listing brotli only when it can be decoded."""
+    return "br, gzip" if brotli is not None else "gzip"
+
+
+def compress(
+    body: bytes, accept_encoding: Optional[str], min_size: int
+) -> Tuple[bytes, Optional[str]]:
+    """Compress ``body`` with the best encoding the client accepts.
+
+    Bodies under ``min_size`` bytes are returned untouched, as are bodies
+    for clients that accept neither brotli nor gzip.
+    """
+    if min_size < 0 or len(body) < min_size:
+        return body, None
+    accepted = {
+        part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")
+    }
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=4), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=5), "gzip"
+    return body, None
+
+
+def envelope_headers(media_type: str, encoding: Optional[str]) -> Dict[str, str]:
+    headers = {"Content-Type": media_type, "Vary": "Accept, Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return headers
@@ -0,0 +1,161 @@
+import itertools
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, NamedTuple, Optional, Tuple, Union
+
+from streamlit_view.messages import ChatMessage, as_message
+
+
+logger = logging.getLogger(__name__)
+
+
+def _sender(msg: ChatMessage) -> str:
+    return "human" if msg.is_user else "ai"
+
+
+def iter_text(messages: Iterable[ChatMessage]) -> Iterator[str]:
+    """Yield the plain-text transcript one message at a time."""
+    for msg in messages:
+        yield f"{_sender(msg)}: {msg.content}\n\n"
+
+
+def iter_csv(messages: Iterable[ChatMessage]) -> Iterator[str]:
+    """Yield CSV rows with sender and message columns."""
+    # Imported lazily, only exports ever need it
+    import csv
+    import io
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["sender", "message"])
+    for msg in messages:
+        writer.writerow([_sender(msg), msg.content])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(messages: Iterable[ChatMessage]) -> Iterator[str]:
+    """Yield one JSON object per message."""
+    for msg in messages:
+        yield json.dumps({"role": msg.role.value, "content": msg.content}) + "\n"
+
+
+def iter_markdown(messages: Iterable[ChatMessage]) -> Iterator[str]:
+    """Yield a Markdown transcript with a heading per speaker turn."""
+    for msg in messages:
+        heading = "User" if msg.is_user else "Assistant"
+        yield f"### {heading}\n\n{msg.content}\n\n"
+
+
+class ExportFormat(NamedTuple):
+    label: str
+    extension: str
+    mime: str
+    writer: Callable[[Iterable[ChatMessage]], Iterator[str]]
+
+
+EXPORT_FORMATS: Dict[str, ExportFormat] = {
+    "txt": ExportFormat("TXT", "txt", "text/plain", iter_text),
+    "csv": ExportFormat("CSV", "csv", "text/csv", iter_csv),
+    "jsonl": ExportFormat("JSONL", "jsonl", "application/jsonl", iter_jsonl),
+    "md": ExportFormat("Markdown", "md", "text/markdown", iter_markdown),
+}
+
+
+def export_chat_to_text(messages: Iterable[Union[ChatMessage, Mapping[str, Any]]]) -> str:
+    """Convert chat messages to exportable text format."""
+    return "".join(iter_text(map(as_message, messages)))
+
+
+def export_chat_to_csv(messages: Iterable[Union[ChatMessage, Mapping[str, Any]]]) -> str:
+    """Convert chat messages to CSV format with sender and message columns."""
+    return "".join(iter_csv(map(as_message, messages)))
+
+
+class ExportCache:
+    """Small LRU of rendered exports keyed by (store, chat_id, message_count, format).
+
+    Chats are append-only, so an export of a chat's first ``message_count``
+    messages never changes and can be served from here for as long as it
+    fits. Bounded by entry count and by total bytes, except that the newest
+    export is kept however large, so a prepared one is not re-rendered on
+    every rerun.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str, int, str], bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_render(
+        self,
+        namespace: str,
+        chat_id: str,
+        message_count: int,
+        fmt: str,
+        messages: Callable[[], Iterable[ChatMessage]],
+    ) -> bytes:
+        """Return the cached export or render it from ``messages()`` in chunks."""
+        key = (namespace, chat_id, message_count, fmt)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        writer = EXPORT_FORMATS[fmt].writer
+        data = "".join(writer(messages())).encode("utf-8")
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries[key])
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            self._bytes += len(data)
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return data
+
+    def invalidate(
+        self, chat_id: Optional[str] = None, namespace: Optional[str] = None
+    ) -> None:
+        """Forget exports of one chat, of a namespace's chats, or of every chat."""
+        with self._lock:
+            if chat_id is None and namespace is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [
+                k
+                for k in self._entries
+                if (namespace is None or k[0] == namespace)
+                and (chat_id is None or k[1] == chat_id)
+            ]:
+                self._bytes -= len(self._entries.pop(key))
+
+
+export_cache = ExportCache()
+
+
+def export_chat(store, chat_id: str, fmt: str, message_count: int) -> bytes:
+    """Render the first ``message_count`` messages of a chat from ``store`` in ``fmt``.
+
+    Rows are streamed from the store in batches. Pinning the count lets a
+    prepared export be served again as is while the chat keeps growing.
+    """
+    # Keyed by store too: chat ids are only unique within one namespace
+    return export_cache.get_or_render(
+        store.path,
+        chat_id,
+        message_count,
+        fmt,
+        lambda: itertools.islice(store.iter_messages(chat_id), message_count),
+    )
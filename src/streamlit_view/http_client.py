@@ -0,0 +1,210 @@
+import logging
+import socket
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.util.retry import Retry
+
+from streamlit_view.view_configurations import ServerConfig
+
+
+logger = logging.getLogger(__name__)
+
+# Gateway-style failures are safe to replay; anything else is surfaced as-is.
+# 429 and 503 (with Retry-After) are how the server sheds load, so they are
+# left to the caller: the UI shows a "busy, retrying" state for them. A 504
+# means the turn's deadline passed, and replaying it would only start over.
+RETRY_STATUSES = (502,)
+
+
+class HttpClient:
+    """Process-wide pooled HTTP client for talking to the FastAPI server.
+
+    Streamlit re-executes the UI script on every rerun but keeps imported
+    modules alive, so a single instance is shared by all reruns and sessions.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(HttpClient, cls).__new__(cls)
+                    instance._session = None
+                    cls._instance = instance
+        return cls._instance
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session(ServerConfig())
+        return self._session
+
+    @property
+    def base_url(self) -> str:
+        return ServerConfig().base_url
+
+    @staticmethod
+    def _retry(server_config: ServerConfig) -> Retry:
+        return Retry(
+            total=server_config.max_retries,
+            connect=server_config.max_retries,
+            read=0,
+            status=server_config.max_retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "POST"}),
+            backoff_factor=server_config.backoff_factor,
+            # Otherwise urllib3 replays 429/503 on its own, silently
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+
+    def _build_session(self, server_config: ServerConfig) -> requests.Session:
+        adapter = HTTPAdapter(
+            pool_connections=server_config.pool_connections,
+            pool_maxsize=server_config.pool_maxsize,
+            max_retries=self._retry(server_config),
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Connection": "keep-alive"})
+        logger.info(
+            "Created pooled HTTP session (pool_maxsize=%s, timeout=%s, retries=%s)",
+            server_config.pool_maxsize,
+            server_config.timeout,
+            server_config.max_retries,
+        )
+        return session
+
+    def post(
+        self,
+        path: str,
+        agent_request,
+        timeout: Optional[tuple] = None,
+        base_url: Optional[str] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """POST an AgentRequest, serialising it to JSON exactly once.
+
+        ``base_url`` targets a specific replica instead of ``self.base_url``.
+        """
+        return self.post_body(
+            path, agent_request.model_dump_json(), timeout, base_url, **kwargs
+        )
+
+    def post_body(
+        self,
+        path: str,
+        body,
+        timeout: Optional[tuple] = None,
+        base_url: Optional[str] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """POST an already encoded JSON body."""
+        server_config = ServerConfig()
+        headers = {"Content-Type": "application/json"}
+        headers.update(kwargs.pop("headers", None) or {})
+        return self.session.post(
+            f"{base_url or self.base_url}{path}",
+            data=body,
+            headers=headers,
+            timeout=timeout or server_config.timeout,
+            **kwargs,
+        )
+
+    def get(
+        self,
+        path: str,
+        timeout: Optional[tuple] = None,
+        base_url: Optional[str] = None,
+        **kwargs,
+    ) -> requests.Response:
+        server_config = ServerConfig()
+        return self.session.get(
+            f"{base_url or self.base_url}{path}",
+            timeout=timeout or server_config.timeout,
+            **kwargs,
+        )
+
+    def close(self) -> None:
+        """Drop pooled connections; the next call builds a fresh session."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class _UnixSocketConnection(HTTPConnection):
+    def __init__(self, *args, socket_path: str, **kwargs):
+        self.socket_path = socket_path
+        super().__init__(*args, **kwargs)
+
+    def _new_conn(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+
+class _UnixSocketConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _UnixSocketConnection
+
+
+class _UnixSocketAdapter(HTTPAdapter):
+    """Sends every request to one Unix domain socket, whatever the URL's host."""
+
+    def __init__(self, socket_path: str, pool_maxsize: int, **kwargs):
+        self.socket_path = socket_path
+        self._pool = _UnixSocketConnectionPool(
+            "localhost", maxsize=pool_maxsize, block=False, socket_path=socket_path
+        )
+        super().__init__(pool_maxsize=pool_maxsize, **kwargs)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def get_connection(self, url, proxies=None):
+        return self._pool
+
+    def close(self):
+        super().close()
+        self._pool.close()
+
+
+class UnixSocketClient(HttpClient):
+    """HttpClient that reaches a uvicorn server bound to ``ServerConfig().uds_path``.
+
+    Skips the TCP stack on single-host deployments; the URL host is ignored.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return "http://localhost"
+
+    def _build_session(self, server_config: ServerConfig) -> requests.Session:
+        adapter = _UnixSocketAdapter(
+            server_config.uds_path,
+            pool_maxsize=server_config.pool_maxsize,
+            max_retries=self._retry(server_config),
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.headers.update({"Connection": "keep-alive"})
+        logger.info(
+            "Created pooled Unix socket session on %s (pool_maxsize=%s)",
+            server_config.uds_path,
+            server_config.pool_maxsize,
+        )
+        return session
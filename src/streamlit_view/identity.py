@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import secrets
+from typing import Optional
+
+import streamlit as st
+
+from streamlit_view.chat_store import CHAT_DATA_DIR, ChatStore, get_chat_store
+from streamlit_view.view_configurations import (
+    SHARED_NAMESPACE_MODE,
+    USER_NAMESPACE_MODE,
+    ServerConfig,
+)
+
+
+logger = logging.getLogger(__name__)
+
+SHARED_NAMESPACE = "shared"
+# Query parameter carrying an anonymous visitor's session token, so a page
+# reload (which starts a new Streamlit session) finds the same history
+SESSION_QUERY_PARAM = "sid"
+# Set by authenticating reverse proxies (oauth2-proxy, IAP, basic auth, ...)
+USER_HEADERS = (
+    "X-Forwarded-Email",
+    "X-Forwarded-User",
+    "X-Auth-Request-Email",
+    "X-Auth-Request-User",
+    "X-Remote-User",
+)
+
+
+def _logged_in_user() -> Optional[str]:
+    """The user signed in through Streamlit's own auth, if any."""
+    user = getattr(st, "user", None) or getattr(st, "experimental_user", None)
+    if user is None:
+        return None
+    try:
+        if getattr(user, "is_logged_in", True) is False:
+            return None
+        return user.get("email") or None
+    except Exception:
+        return None
+
+
+def _proxy_user() -> Optional[str]:
+    context = getattr(st, "context", None)
+    headers = getattr(context, "headers", None)
+    if not headers:
+        return None
+    for header in USER_HEADERS:
+        value = headers.get(header)
+        if value:
+            return value
+    return None
+
+
+def _session_token() -> str:
+    token = st.query_params.get(SESSION_QUERY_PARAM)
+    if not token:
+        token = secrets.token_urlsafe(16)
+        st.query_params[SESSION_QUERY_PARAM] = token
+    return token
+
+
+def resolve_identity(mode: Optional[str] = None) -> Optional[str]:
+    """Who this session belongs to under ``mode``; None means everyone.
+
+    In "user" mode anonymous visitors fall back to a per-session identity
+    rather than landing in a history shared with every other anonymous user.
+    """
+    mode = mode or ServerConfig().namespace_mode
+    if mode == SHARED_NAMESPACE_MODE:
+        return None
+    if mode == USER_NAMESPACE_MODE:
+        user = _logged_in_user() or _proxy_user()
+        if user:
+            return f"user:{user.strip().lower()}"
+    return f"session:{_session_token()}"
+
+
+def namespace_for(identity: Optional[str]) -> str:
+    """Directory-safe namespace name; identities themselves never touch the disk."""
+    if identity is None:
+        return SHARED_NAMESPACE
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+
+
+def get_session_namespace() -> str:
+    """The current session's namespace, resolved once and kept in session state."""
+    if "chat_namespace" not in st.session_state:
+        st.session_state.chat_namespace = namespace_for(resolve_identity())
+    return st.session_state.chat_namespace
+
+
+def get_session_store(
+    filename: str,
+    legacy_shelve: Optional[str] = None,
+    previous_filename: Optional[str] = None,
+) -> ChatStore:
+    """The ChatStore holding this session's chats.
+
+    Each namespace has its own SQLite file, so users never contend on one
+    database file or lock. The pre-SQLite shelve file held everyone's chats
+    and is therefore only migrated into the shared namespace. A store kept
+    under ``previous_filename`` is renamed to ``filename``.
+    """
+    namespace = get_session_namespace()
+    directory = (
+        CHAT_DATA_DIR
+        if namespace == SHARED_NAMESPACE
+        else f"{CHAT_DATA_DIR}/namespaces/{namespace}"
+    )
+    return get_chat_store(
+        f"{directory}/{filename}",
+        legacy_shelve=(
+            f"{CHAT_DATA_DIR}/{legacy_shelve}"
+            if legacy_shelve and namespace == SHARED_NAMESPACE
+            else None
+        ),
+        previous_path=f"{directory}/{previous_filename}" if previous_filename else None,
+    )
+
+
+def current_session_id() -> Optional[str]:
+    """Streamlit's id for the browser session running this script, if any."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def is_shared_namespace() -> bool:
+    return get_session_namespace() == SHARED_NAMESPACE
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from streamlit_view.jobs import FINISHED_STATUSES
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    chat_id TEXT,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs (updated_at);
+"""
+
+
+# Seconds the writer waits before retrying a batch SQLite refused
+RETRY_DELAY = 1.0
+
+
+class JobRegistry:
+    """Job status shared by every replica, so any of them can answer /jobs.
+
+    Each replica still runs its own queue; the registry only mirrors the
+    ``Job.to_dict()`` snapshots as jobs move through it. This SQLite-backed
+    one works for replicas on one host (or a shared volume) and doubles as
+    the local stand-in for a networked store.
+
+    ``put`` and ``prune`` never touch the file: they are called from the
+    event loop, where a write waiting out another replica's lock would stall
+    every request. A writer thread stores the latest snapshot of each job in
+    one transaction per batch. Use ``fetch`` to read from async code.
+    """
+
+    def __init__(self, path: str, result_ttl: float = 300.0):
+        self.path = path
+        self.result_ttl = result_ttl
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+        # Latest unwritten (snapshot, JSON) per job, and whether a prune is due
+        self._pending: Dict[str, Tuple[Dict[str, Any], str]] = {}
+        self._writing: Dict[str, Tuple[Dict[str, Any], str]] = {}
+        self._prune_due = False
+        self._closed = False
+        self._changed = threading.Condition()
+        # One batch at a time, so an older snapshot never lands after a newer one
+        self._flushing = threading.Lock()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="job-registry", daemon=True
+        )
+        self._writer.start()
+
+    def put(self, job: Dict[str, Any]) -> None:
+        """Queue ``job``'s snapshot; a newer one of the same job replaces it."""
+        # Serialised here so a bad snapshot fails its caller, not the writer
+        data = json.dumps(job)
+        with self._changed:
+            self._pending[job["job_id"]] = (job, data)
+            self._changed.notify()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Blocking read; async code should use ``fetch``."""
+        with self._changed:
+            queued = self._pending.get(job_id) or self._writing.get(job_id)
+        if queued is not None:
+            return queued[0]
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def fetch(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """``get`` on a worker thread, so a busy file never blocks the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, job_id)
+
+    async def wait(
+        self, job_id: str, timeout: float, interval: float = 0.25
+    ) -> Optional[Dict[str, Any]]:
+        """Poll until the job has finished or ``timeout`` runs out; returns the last snapshot."""
+        deadline = time.monotonic() + timeout
+        job = await self.fetch(job_id)
+        while job is not None and not _finished(job) and time.monotonic() < deadline:
+            await asyncio.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+            job = await self.fetch(job_id)
+        return job
+
+    def prune(self) -> None:
+        """Have the writer drop finished jobs older than ``result_ttl``."""
+        with self._changed:
+            self._prune_due = True
+            self._changed.notify()
+
+    def flush(self) -> None:
+        """Write everything queued so far from the calling thread."""
+        with self._flushing:
+            with self._changed:
+                batch, self._pending = self._pending, {}
+                prune, self._prune_due = self._prune_due, False
+                self._writing = batch
+            try:
+                self._write(batch, prune)
+            except sqlite3.Error:
+                self._requeue(batch, prune)
+                raise
+            finally:
+                with self._changed:
+                    self._writing = {}
+
+    def close(self) -> None:
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        self._writer.join()
+        with self._lock:
+            self._conn.close()
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._changed:
+                self._changed.wait_for(
+                    lambda: self._pending or self._prune_due or self._closed
+                )
+                closed = self._closed
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                if closed:
+                    logger.error(f"Dropping {len(self._pending)} job snapshots: {e}")
+                    return
+                logger.warning(f"Could not write job snapshots, retrying: {e}")
+                time.sleep(RETRY_DELAY)
+                continue
+            if closed:
+                return
+
+    def _write(self, batch: Dict[str, Tuple[Dict[str, Any], str]], prune: bool) -> None:
+        if not batch and not prune:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO jobs (job_id, chat_id, status, data, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [
+                    (job_id, job.get("chat_id"), job["status"], data, now)
+                    for job_id, (job, data) in batch.items()
+                ],
+            )
+            if prune:
+                self._conn.execute(
+                    "DELETE FROM jobs WHERE updated_at < ? AND status IN (?, ?, ?, ?)",
+                    (now - self.result_ttl, *_FINISHED_VALUES),
+                )
+
+    def _requeue(self, batch: Dict[str, Tuple[Dict[str, Any], str]], prune: bool) -> None:
+        with self._changed:
+            # Snapshots queued since are newer than the ones that failed
+            self._pending = {**batch, **self._pending}
+            self._prune_due = self._prune_due or prune
+
+
+_FINISHED_VALUES = tuple(status.value for status in FINISHED_STATUSES)
+
+
+def _finished(job: Dict[str, Any]) -> bool:
+    return job["status"] in _FINISHED_VALUES
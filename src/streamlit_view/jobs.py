@@ -0,0 +1,438 @@
+import asyncio
+import contextlib
+import contextvars
+import inspect
+import logging
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from common_utils.schemas import AgentRequest, AgentResponse
+from streamlit_view.context import ChatContext, using_context
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    # Stopped by the client, or because its deadline passed first
+    CANCELLED = "cancelled"
+    EXPIRED = "expired"
+
+
+FINISHED_STATUSES = (
+    JobStatus.SUCCEEDED,
+    JobStatus.FAILED,
+    JobStatus.CANCELLED,
+    JobStatus.EXPIRED,
+)
+
+
+class QueueFullError(Exception):
+    """Raised by JobManager.submit when the bounded queue has no room left.
+
+    The server is saturated rather than the client over its rate, so the
+    endpoints answer it with 503.
+    """
+
+
+class Job:
+    def __init__(
+        self,
+        agent_request: AgentRequest,
+        idempotency_key: Optional[str] = None,
+        deadline: Optional[float] = None,
+        runner: Optional[Callable[[], Awaitable[AgentResponse]]] = None,
+        context: Optional[ChatContext] = None,
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.request = agent_request
+        self.chat_id = agent_request.chat_id
+        self.idempotency_key = idempotency_key
+        self.status = JobStatus.QUEUED
+        self.result: Optional[AgentResponse] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Wall-clock time (like created_at) after which the result is useless
+        self.deadline = deadline
+        # Produces the result instead of the view callback (streamed turns)
+        self.runner = runner
+        # History sent next to the prompt, current while the job runs
+        self.context = context
+        # Callers blocked on the result (see Dispatcher.wait)
+        self.waiters = 0
+        self._done = asyncio.Event()
+        self._callbacks: List[Callable[["Job"], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def add_done_callback(self, callback: Callable[["Job"], None]) -> None:
+        """Call ``callback(job)`` once the job finishes (right away if it has)."""
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _finish(self) -> None:
+        self.finished_at = time.time()
+        self._done.set()
+        for callback in self._callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"Job {self.job_id} done callback failed: {e}", exc_info=True)
+        self._callbacks = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "job_id": self.job_id,
+            "chat_id": self.chat_id,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.deadline is not None:
+            data["deadline"] = self.deadline
+        if self.result is not None:
+            data["response"] = self.result.model_dump(mode="json")
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+async def call_view_callback(
+    view_callback: Callable, agent_request: AgentRequest, executor=None
+) -> Any:
+    """Run a sync or async callback without blocking the event loop.
+
+    Sync callbacks see the caller's context variables (``current_context()``)
+    on the executor thread too.
+    """
+    if inspect.iscoroutinefunction(view_callback):
+        return await view_callback(agent_request)
+
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(
+        executor, contextvars.copy_context().run, view_callback, agent_request
+    )
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class JobManager:
+    """Bounded work queue in front of ``view_callback``.
+
+    Jobs are kept in one lane per chat_id and a chat is handed to at most one
+    worker at a time, so turns of the same chat run in submission order while
+    different chats proceed in parallel. Sync callbacks run on a thread pool,
+    async ones as tasks on the server's event loop.
+
+    Streamed turns are queued the same way (see Dispatcher.open_stream),
+    with a runner that forwards chunks in place of the callback.
+
+    Submissions carrying an idempotency key (the UI's message_id) that is
+    already known for the chat are coalesced onto the existing job.
+
+    Jobs can be cancelled, and a job with a deadline expires once it passes:
+    still queued, it never reaches the callback; running, an async callback
+    is cancelled.
+
+    With a ``registry`` (see job_registry.JobRegistry) every status change is
+    mirrored there so other replicas can report on this replica's jobs.
+
+    Batch items (see Dispatcher.run_batch) skip the queue but share a lane of
+    ``batch_workers`` slots across all batches, half the workers by default,
+    so replays cannot take every callback slot from interactive turns.
+    """
+
+    def __init__(
+        self,
+        view_callback: Callable,
+        max_queue_size: int = 100,
+        workers: int = 4,
+        result_ttl: float = 300.0,
+        registry=None,
+        batch_workers: Optional[int] = None,
+    ):
+        self.view_callback = view_callback
+        self.registry = registry
+        self.max_queue_size = max_queue_size
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.batch_workers = batch_workers or max(1, workers // 2)
+
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[Tuple[Optional[str], str], Job] = {}
+        self._chat_locks: Dict[Optional[str], list] = {}
+        self._lanes: Dict[Optional[str], Deque[Job]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._pending = 0
+        self._in_flight = 0
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._cancellable = inspect.iscoroutinefunction(view_callback)
+        self._batch_lane = asyncio.Semaphore(self.batch_workers)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def find(self, chat_id: Optional[str], idempotency_key: str) -> Optional[Job]:
+        """The job submitted for ``chat_id`` under ``idempotency_key``, if still known."""
+        return self._by_key.get((chat_id, idempotency_key))
+
+    def submit(
+        self,
+        agent_request: AgentRequest,
+        idempotency_key: Optional[str] = None,
+        bounded: bool = True,
+        deadline: Optional[float] = None,
+        runner: Optional[Callable[[], Awaitable[AgentResponse]]] = None,
+        context: Optional[ChatContext] = None,
+    ) -> Job:
+        """Enqueue a request; raises QueueFullError when at capacity.
+
+        Returns the already known job instead when ``idempotency_key`` matches
+        a queued, running or recently finished job of the same chat. Jobs
+        submitted with ``bounded=False`` are queued even when it is full.
+        ``deadline`` is a ``time.time()`` after which the job expires.
+        A ``runner`` coroutine function, when given, is awaited in the job's
+        turn in place of the view callback; it can always be cancelled.
+        ``context`` is what ``current_context()`` returns while the job runs.
+        """
+        self._ensure_started()
+        self._prune()
+        if idempotency_key is not None:
+            existing = self._by_key.get((agent_request.chat_id, idempotency_key))
+            if existing is not None:
+                logger.info(
+                    f"Coalescing duplicate request {idempotency_key} onto job {existing.job_id}"
+                )
+                return existing
+
+        if bounded and self._pending >= self.max_queue_size:
+            raise QueueFullError(
+                f"Job queue is full ({self._pending}/{self.max_queue_size})"
+            )
+
+        job = Job(agent_request, idempotency_key, deadline, runner, context)
+        self._jobs[job.job_id] = job
+        if idempotency_key is not None:
+            self._by_key[(job.chat_id, idempotency_key)] = job
+        self._pending += 1
+        self._publish(job)
+
+        lane = self._lanes.get(job.chat_id)
+        if lane is None:
+            # No lane means no job of this chat is queued or running
+            self._lanes[job.chat_id] = deque([job])
+            self._ready.put_nowait(job.chat_id)
+        else:
+            lane.append(job)
+        if deadline is not None:
+            expiry = asyncio.get_running_loop().call_later(
+                max(deadline - time.time(), 0), self.cancel, job, JobStatus.EXPIRED
+            )
+            job.add_done_callback(lambda _: expiry.cancel())
+        return job
+
+    def cancel(self, job: Job, status: JobStatus = JobStatus.CANCELLED) -> bool:
+        """Stop a job that has not finished; False when it already had.
+
+        Waiters are released right away with ``status`` (CANCELLED or
+        EXPIRED). A queued job is skipped by the workers. A running async
+        callback is cancelled; a sync one cannot be interrupted, so it keeps
+        its thread and the chat's turn until it returns, and its result is
+        dropped.
+        """
+        if job.done:
+            return False
+        if job.status == JobStatus.QUEUED:
+            lane = self._lanes.get(job.chat_id)
+            if lane is not None and job in lane:
+                self._pending -= 1
+        elif job._task is not None and (self._cancellable or job.runner is not None):
+            job._task.cancel()
+        logger.info(f"Job {job.job_id} {status.value}")
+        job.status = status
+        job.error = "Deadline exceeded" if status == JobStatus.EXPIRED else "Cancelled"
+        job._finish()
+        self._publish(job)
+        return True
+
+    async def wait(self, job: Job, timeout: Optional[float] = None) -> Job:
+        await asyncio.wait_for(job._done.wait(), timeout)
+        return job
+
+    @contextlib.asynccontextmanager
+    async def serialized(self, chat_id: Optional[str]) -> AsyncIterator[None]:
+        """Hold the chat's lock so only one turn touches its model state at a time.
+
+        Queued jobs and streamed turns share this lock; entries are dropped
+        once no one holds or waits on them.
+        """
+        entry = self._chat_locks.get(chat_id)
+        if entry is None:
+            entry = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[chat_id]
+
+    @contextlib.asynccontextmanager
+    async def batch_slot(self) -> AsyncIterator[None]:
+        """Hold one of the ``batch_workers`` slots shared by every batch."""
+        async with self._batch_lane:
+            yield
+
+    async def shutdown(self) -> None:
+        """Stop the workers; running and queued jobs end up CANCELLED."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in list(self._jobs.values()):
+            # No worker is left to run what was still queued
+            self.cancel(job)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _ensure_started(self) -> None:
+        # Started lazily so the queue binds to the loop uvicorn is serving on
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="view-callback"
+        )
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info("Started %d job workers", self.workers)
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            lane = self._lanes[chat_id]
+            job = lane.popleft()
+            if job.done:
+                # Cancelled while queued; cancel() already took it off the count
+                if lane:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._lanes[chat_id]
+                continue
+            self._pending -= 1
+            try:
+                await self._run(job)
+            finally:
+                if lane:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._lanes[chat_id]
+
+    async def _run(self, job: Job) -> None:
+        async with self.serialized(job.chat_id):
+            await self._execute(job)
+
+    async def _execute(self, job: Job) -> None:
+        if job.done:
+            # Cancelled while waiting for the chat's turn
+            return
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        self._publish(job)
+        self._in_flight += 1
+        # The task copies the job's context as it is created
+        with using_context(job.context):
+            if job.runner is not None:
+                job._task = asyncio.ensure_future(job.runner())
+            else:
+                job._task = asyncio.ensure_future(
+                    call_view_callback(self.view_callback, job.request, self._executor)
+                )
+        try:
+            result = await job._task
+            if job.done:
+                # Cancelled while a sync callback ran; the result is moot
+                return
+            if result is None:
+                result = AgentResponse(
+                    chat_id=job.chat_id,
+                    message="Request received and queued for processing",
+                )
+            job.result = result
+            job.status = JobStatus.SUCCEEDED
+        except asyncio.CancelledError:
+            if not job.done:
+                # The worker itself is being cancelled (shutdown); finish the
+                # job first so no waiter or registry entry is left RUNNING
+                self.cancel(job)
+                raise
+            return
+        except Exception as e:
+            if job.done:
+                return
+            logger.error(f"Job {job.job_id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            self._in_flight -= 1
+            job._task = None
+            if job.status not in (JobStatus.CANCELLED, JobStatus.EXPIRED):
+                job._finish()
+                self._publish(job)
+
+    def _publish(self, job: Job) -> None:
+        if self.registry is None:
+            return
+        try:
+            self.registry.put(job.to_dict())
+        except Exception as e:
+            # The local queue keeps working; only cross-replica lookups suffer
+            logger.error(f"Could not publish job {job.job_id}: {e}")
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.done and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if job.idempotency_key is not None:
+                self._by_key.pop((job.chat_id, job.idempotency_key), None)
+        if expired and self.registry is not None:
+            self.registry.prune()
@@ -0,0 +1,76 @@
+"""Start the Streamlit UI with its modules already imported.
+
+    python -m streamlit_view.launcher <ui_file> [streamlit options] [-- script args]
+
+Takes the same arguments as ``streamlit run``. ``streamlit run`` starts the
+server first and imports the UI's dependencies only when the first session
+executes the script, so the first visitor waits on every cold import. Here
+they are imported (and the transport's connection pool built) before the
+server starts listening, and every session reuses them.
+"""
+import importlib
+import logging
+import sys
+import time
+from typing import Dict, Sequence
+
+from streamlit_view.startup_profile import UI_MODULES, format_report, profile_imports
+from streamlit_view.view_configurations import INPROCESS_TRANSPORT, ServerConfig
+
+
+logger = logging.getLogger(__name__)
+
+
+def preload(modules: Sequence[str]) -> Dict[str, float]:
+    """Import ``modules``, returning the seconds each one added."""
+    timings = {}
+    for module in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            # The UI script will hit (and report) the same error itself
+            logger.warning(f"Could not preload {module}: {e}")
+        timings[module] = time.perf_counter() - started
+    return timings
+
+
+def warm_up() -> Dict[str, float]:
+    """Preload the UI's imports and build the client transport."""
+    server_config = ServerConfig()
+    modules = list(UI_MODULES)
+    if server_config.transport != INPROCESS_TRANSPORT:
+        modules.append("streamlit_view.http_client")
+    timings = preload(modules)
+
+    if server_config.transport != INPROCESS_TRANSPORT:
+        from streamlit_view.transport import get_transport
+
+        started = time.perf_counter()
+        get_transport()
+        timings["transport"] = time.perf_counter() - started
+    return timings
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    started = time.perf_counter()
+    timings = warm_up()
+    logger.info(
+        "Preloaded the UI in %.0f ms", (time.perf_counter() - started) * 1000
+    )
+
+    if ServerConfig().profile_startup:
+        for name, seconds in timings.items():
+            print(f"preload {name}: {seconds * 1000:.1f} ms", file=sys.stderr)
+        # Per-module breakdown from a cold interpreter
+        print(format_report(profile_imports()), file=sys.stderr)
+
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", *argv]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()
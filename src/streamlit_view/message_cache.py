@@ -0,0 +1,214 @@
+"""Bounded memory for the chat data the UI holds per session.
+
+Session state keeps each loaded message as a ChatMessage whose ``content``
+is set for only the newest ``RECENT_WINDOW`` messages. Older bodies are
+held once per process in a size-bounded LRU shared by every session, and
+read back from the ChatStore once evicted, so memory no longer grows with
+users x history.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from streamlit_view.chat_store import ChatStore
+from streamlit_view.messages import ChatMessage
+from streamlit_view.metrics import MESSAGE_CACHE_BYTES, SESSION_STATE_BYTES
+from streamlit_view.view_configurations import ServerConfig
+
+
+logger = logging.getLogger(__name__)
+
+# Messages per session whose bodies stay in session state
+RECENT_WINDOW = 20
+# Sessions not seen for this long drop out of the memory report
+SESSION_REPORT_TTL = 3600.0
+# Seconds a session's measured size is reused before it is walked again
+SESSION_SAMPLE_INTERVAL = 30.0
+
+
+class MessageCache:
+    """LRU of message bodies keyed by (store path, message id), bounded in bytes.
+
+    Message ids are never reused and messages never change, so entries
+    cannot go stale; those of deleted chats simply age out.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, namespace: str, message_id: int, content: str) -> None:
+        with self._lock:
+            self._insert((namespace, message_id), content)
+
+    def get_many(self, store: ChatStore, message_ids: Iterable[int]) -> Dict[int, str]:
+        """Bodies of ``message_ids``, loading the ones not cached from ``store``."""
+        found: Dict[int, str] = {}
+        missing: List[int] = []
+        with self._lock:
+            for message_id in message_ids:
+                key = (store.path, message_id)
+                content = self._entries.get(key)
+                if content is None:
+                    missing.append(message_id)
+                else:
+                    self._entries.move_to_end(key)
+                    found[message_id] = content
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            loaded = store.load_contents(missing)
+            with self._lock:
+                for message_id, content in loaded.items():
+                    self._insert((store.path, message_id), content)
+            found.update(loaded)
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    # Callers hold self._lock for everything below
+
+    def _insert(self, key: Tuple[str, int], content: str) -> None:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = content
+        self._bytes += sys.getsizeof(content)
+        while self._entries and self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= sys.getsizeof(evicted)
+            self.evictions += 1
+
+
+_message_cache: Optional[MessageCache] = None
+_message_cache_lock = threading.Lock()
+
+
+def get_message_cache() -> MessageCache:
+    """The process-wide MessageCache, sized by ``ServerConfig().message_cache_bytes``."""
+    global _message_cache
+    with _message_cache_lock:
+        if _message_cache is None:
+            _message_cache = MessageCache(ServerConfig().message_cache_bytes)
+            MESSAGE_CACHE_BYTES.set_function(lambda: _message_cache.stats()["bytes"])
+        return _message_cache
+
+
+def keep_window(
+    store: ChatStore, messages: List[ChatMessage], window: int = RECENT_WINDOW
+) -> List[ChatMessage]:
+    """Move the bodies of all but the newest ``window`` messages to the shared cache.
+
+    Works in place and returns ``messages`` for convenience.
+    """
+    cache = get_message_cache()
+    for index in range(max(len(messages) - window, 0)):
+        message = messages[index]
+        if message.content is not None:
+            cache.put(store.path, message.id, message.content)
+            messages[index] = message._replace(content=None)
+    return messages
+
+
+def with_content(store: ChatStore, messages: List[ChatMessage]) -> List[ChatMessage]:
+    """``messages`` with every body filled in, for rendering; session state is untouched."""
+    missing = [message.id for message in messages if message.content is None]
+    if not missing:
+        return messages
+    contents = get_message_cache().get_many(store, missing)
+    return [
+        message
+        if message.content is not None
+        else message._replace(content=contents.get(message.id, ""))
+        for message in messages
+    ]
+
+
+def estimate_size(obj: Any, _seen: Optional[set] = None) -> int:
+    """Approximate bytes held by ``obj`` and the containers nested in it."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, Mapping):
+        size += sum(
+            estimate_size(key, _seen) + estimate_size(value, _seen)
+            for key, value in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in obj)
+    return size
+
+
+# session id -> (last seen, last measured, estimated session_state bytes)
+_sessions: Dict[str, Tuple[float, float, int]] = {}
+_sessions_lock = threading.Lock()
+
+
+def _session_bytes_total() -> int:
+    with _sessions_lock:
+        return sum(size for _, _, size in _sessions.values())
+
+
+SESSION_STATE_BYTES.set_function(_session_bytes_total)
+
+
+def record_session(
+    session_id: Optional[str], state: Mapping, max_age: float = SESSION_SAMPLE_INTERVAL
+) -> int:
+    """Note a session for the memory report; returns its estimated bytes.
+
+    Walking the whole state costs time proportional to its size, so it is
+    only re-measured once its last estimate is ``max_age`` seconds old;
+    reruns in between reuse that estimate.
+    """
+    now = time.time()
+    with _sessions_lock:
+        recorded = _sessions.get(session_id) if session_id is not None else None
+    if recorded is not None and recorded[1] > now - max_age:
+        measured_at, size = recorded[1], recorded[2]
+    else:
+        measured_at, size = now, estimate_size(dict(state.items()))
+    if session_id is not None:
+        with _sessions_lock:
+            _sessions[session_id] = (now, measured_at, size)
+            for stale in [
+                sid for sid, (seen, _, _) in _sessions.items()
+                if seen < now - SESSION_REPORT_TTL
+            ]:
+                del _sessions[stale]
+    return size
+
+
+def memory_report() -> Dict[str, Any]:
+    """Session state and message cache memory of this UI process, for capacity planning."""
+    with _sessions_lock:
+        sizes = [size for _, _, size in _sessions.values()]
+    return {
+        "sessions": len(sizes),
+        "session_bytes": sum(sizes),
+        "largest_session_bytes": max(sizes, default=0),
+        "message_cache": get_message_cache().stats(),
+    }
@@ -0,0 +1,66 @@
+import json
+from enum import Enum
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Union
+
+
+class Role(str, Enum):
+    USER = "user"
+    ASSISTANT = "assistant"
+    SYSTEM = "system"
+
+
+class ChatMessage(NamedTuple):
+    """One chat message, as persisted, cached, rendered and exported.
+
+    A tuple rather than a dict: no per-instance ``__dict__`` and no repeated
+    key strings. ``content`` is None while the body lives only in the shared
+    message cache (see message_cache). ``id`` grows monotonically within a
+    store, so "everything after id N" is a complete delta.
+    """
+
+    id: Optional[int]
+    role: Role
+    content: Optional[str]
+    created_at: float
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    latency_ms: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "ChatMessage":
+        """Build a message from its dict form, including the legacy role/content dicts."""
+        return cls(
+            id=data.get("id"),
+            role=Role(data["role"]),
+            content=data.get("content"),
+            created_at=data.get("created_at", 0.0),
+            prompt_tokens=data.get("prompt_tokens"),
+            completion_tokens=data.get("completion_tokens"),
+            latency_ms=data.get("latency_ms"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Compact dict form; fields that are unset are left out."""
+        data = {
+            field: value for field, value in zip(self._fields, self) if value is not None
+        }
+        data["role"] = self.role.value
+        return data
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: Union[str, bytes]) -> "ChatMessage":
+        return cls.from_dict(json.loads(data))
+
+    @property
+    def is_user(self) -> bool:
+        return self.role is Role.USER
+
+
+def as_message(message: Union[ChatMessage, Mapping[str, Any]]) -> ChatMessage:
+    """Accept either form, for callers that still pass role/content dicts."""
+    if isinstance(message, ChatMessage):
+        return message
+    return ChatMessage.from_dict(message)
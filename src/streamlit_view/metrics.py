@@ -0,0 +1,308 @@
+import bisect
+import contextlib
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from sub-millisecond parsing up to slow generations
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """A gauge read from a callable at scrape time (queue depth, in-flight, ...)."""
+
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def render(self) -> List[str]:
+        value = self._function() if self._function is not None else 0.0
+        return self.header() + [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(
+                (key, (list(entry[0]), entry[1], entry[2]))
+                for key, entry in self._values.items()
+            )
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # Registering twice (e.g. module reloads) hands back the original
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "streamlit_view_request_seconds",
+    "Time spent handling a request, per endpoint.",
+    ("endpoint",),
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "streamlit_view_stage_seconds",
+    "Time spent in each hot-path stage (parse, validate, queue, callback, serialize).",
+    ("endpoint", "stage"),
+)
+REQUESTS_TOTAL = REGISTRY.counter(
+    "streamlit_view_requests_total",
+    "Requests handled, per endpoint and HTTP status.",
+    ("endpoint", "status"),
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "streamlit_view_queue_depth", "Jobs waiting for a worker."
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "streamlit_view_in_flight", "view_callback invocations currently running."
+)
+ADMITTED = REGISTRY.gauge(
+    "streamlit_view_admitted",
+    "Requests past admission control that have not finished yet.",
+)
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "streamlit_view_admission_rejections_total",
+    "Requests shed by admission control, per reason (chat, ip, overload).",
+    ("reason",),
+)
+MESSAGE_CACHE_BYTES = REGISTRY.gauge(
+    "streamlit_view_message_cache_bytes",
+    "Message bodies held by the UI's shared message cache.",
+)
+SESSION_STATE_BYTES = REGISTRY.gauge(
+    "streamlit_view_session_state_bytes",
+    "Estimated session_state size summed over recently active UI sessions.",
+)
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "streamlit_view_context_tokens",
+    "Tokens sent per prompt (prompt plus trimmed history), when context is enabled.",
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+CLIENT_ROUND_TRIP_SECONDS = REGISTRY.histogram(
+    "streamlit_view_client_round_trip_seconds",
+    "Client-side round trip of StreamlitView calls, per endpoint.",
+    ("endpoint",),
+)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the UI's own log
+        pass
+
+
+_metrics_server: Optional[ThreadingHTTPServer] = None
+_metrics_server_lock = threading.Lock()
+
+
+def serve_metrics(host: str, port: int) -> None:
+    """Expose REGISTRY at ``http://host:port/metrics`` from a background thread.
+
+    An empty ``host`` listens on every interface.
+
+    Meant for the Streamlit UI process, which has no FastAPI app. Only the
+    first call in a process starts a server.
+    """
+    global _metrics_server
+    with _metrics_server_lock:
+        if _metrics_server is not None:
+            return
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            logger.error(f"Could not serve metrics on {host}:{port}: {e}")
+            return
+        _metrics_server.daemon_threads = True
+        threading.Thread(
+            target=_metrics_server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logger.info(f"Serving UI metrics on http://{host}:{port}/metrics")
+
+
+class RequestTimer:
+    """Collects stage timings for one request and records them on finish."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        self._elapsed: Optional[float] = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = seconds
+        STAGE_SECONDS.observe(seconds, endpoint=self.endpoint, stage=name)
+
+    def finish(self, status: int) -> float:
+        """Record the request's total time; only the first call counts."""
+        if self._elapsed is None:
+            self._elapsed = time.perf_counter() - self._start
+            REQUEST_SECONDS.observe(self._elapsed, endpoint=self.endpoint)
+            REQUESTS_TOTAL.inc(endpoint=self.endpoint, status=str(status))
+        return self._elapsed
+
+    def server_timing(self) -> str:
+        """Stage timings in the Server-Timing header format (milliseconds)."""
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()
+        )
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
@@ -0,0 +1,137 @@
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+import streamlit as st
+
+from streamlit_view.messages import ChatMessage
+from streamlit_view.streaming import StreamError, read_in_background, retry_busy
+
+
+USER_AVATAR = "👤"
+BOT_AVATAR = "🤖"
+
+# How often a turn the server turned away as busy is retried, and the
+# longest pause between tries whatever Retry-After says
+BUSY_RETRIES = 3
+MAX_BUSY_WAIT = 10.0
+# How often a turn waiting for its next chunk lets a Stop click through
+STOP_POLL_SECONDS = 0.25
+
+
+def _no_fragment(func=None, **kwargs):
+    return func if func is not None else (lambda f: f)
+
+
+# st.fragment (and st.rerun's scope) arrived in Streamlit 1.37; older
+# versions simply rerun the whole script as they always did
+fragment = getattr(st, "fragment", None) or _no_fragment
+
+
+def rerun_fragment() -> None:
+    """Rerun just the calling fragment, or the app where fragments are unsupported."""
+    if fragment is _no_fragment:
+        st.rerun()
+    else:
+        st.rerun(scope="fragment")
+
+
+def render_message(message: ChatMessage, highlight: bool = False) -> None:
+    avatar = USER_AVATAR if message.is_user else BOT_AVATAR
+    with st.chat_message(message.role.value, avatar=avatar):
+        if highlight:
+            st.caption("🔎 Search result")
+        st.markdown(message.content)
+
+
+def render_history(
+    messages: Iterable[ChatMessage], highlight_id: Optional[int] = None
+) -> int:
+    """Render settled messages on a full run; returns how many were drawn.
+
+    Turns added afterwards are drawn by the conversation fragment, so its
+    reruns leave these elements alone and cost only the new turn.
+    """
+    count = 0
+    for message in messages:
+        render_message(message, highlight=message.id == highlight_id)
+        count += 1
+    return count
+
+
+def render_timings(timings: Optional[Dict[str, float]]) -> None:
+    if timings:
+        st.caption(" · ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items()))
+
+
+def render_context_report(report: Optional[Dict[str, int]]) -> None:
+    if report:
+        st.caption(
+            f"context {report['total_tokens']} tokens · "
+            f"{report['kept_messages']} messages kept · "
+            f"{report['dropped_messages']} dropped"
+        )
+
+
+def render_memory_report(session_bytes: int, report: Dict[str, Any]) -> None:
+    cache = report["message_cache"]
+    st.caption(
+        f"This session {session_bytes / 1024:.0f} KB · "
+        f"{report['sessions']} sessions {report['session_bytes'] / 1024 ** 2:.1f} MB · "
+        f"message cache {cache['bytes'] / 1024 ** 2:.1f}"
+        f"/{cache['max_bytes'] / 1024 ** 2:.0f} MB"
+    )
+
+
+def write_stream_with_retry(
+    make_stream: Callable[[], Iterator[str]], retries: int = BUSY_RETRIES
+) -> str:
+    """``st.write_stream`` a new ``make_stream()``, waiting out "busy" answers.
+
+    A request shed by the server's rate limits or load shedding fails before
+    its first chunk, so it is retried (with the same message_id) after the
+    server's Retry-After while a notice says so. Raises the last StreamError
+    once the retries are used up, or one that came after the first chunk.
+    """
+    return retry_busy(
+        lambda: _interruptible(make_stream()), st.write_stream, _wait_busy, retries
+    )
+
+
+def _wait_busy(retry_after: float) -> None:
+    wait = min(retry_after, MAX_BUSY_WAIT)
+    notice = st.empty()
+    notice.info(f"The assistant is busy, retrying in {wait:.0f} s…")
+    time.sleep(wait)
+    notice.empty()
+
+
+def _interruptible(stream: Iterator[str]) -> Iterator[str]:
+    """``stream``, read on a worker thread so the run can be stopped while it waits.
+
+    Streamlit only interrupts a run (for a Stop click's rerun) when the
+    script sends the browser something, so while no chunk arrives, in the
+    queue or before a slow first token, an invisible placeholder is
+    touched every STOP_POLL_SECONDS.
+    """
+    heartbeat = st.empty()
+    yield from read_in_background(stream, heartbeat.empty, STOP_POLL_SECONDS)
+
+
+def render_stop_button(on_stop: Callable[[], None], key: str):
+    """A "Stop generating" button for the turn being streamed.
+
+    Clicking it reruns the script, which interrupts the stream within
+    STOP_POLL_SECONDS, even before its first chunk; ``on_stop`` runs first
+    thing in that rerun. Returns the button's placeholder so the caller can
+    clear it once the turn is over.
+    """
+    placeholder = st.empty()
+    placeholder.button("Stop generating", key=key, on_click=on_stop)
+    return placeholder
+
+
+def render_stream_error(error: StreamError) -> None:
+    if error.retry_after is not None:
+        st.warning("The assistant is busy right now. Please send your message again in a moment.")
+    else:
+        st.error(f"Error: {error}")
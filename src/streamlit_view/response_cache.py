@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from common_utils.schemas import AgentRequest, AgentResponse
+
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_SCOPE = "global"
+CHAT_SCOPE = "chat"
+
+# Seconds the disk writer waits before retrying a batch SQLite refused
+DISK_RETRY_DELAY = 1.0
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    chat_id TEXT,
+    expires_at REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_chat ON responses (chat_id);
+"""
+
+# (expires_at, origin chat_id, AgentResponse as UTF-8 JSON)
+Entry = Tuple[float, Optional[str], bytes]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt used for cache keys."""
+    return " ".join(prompt.casefold().split())
+
+
+class ResponseCache:
+    """LRU + TTL cache of agent responses for repeated prompts.
+
+    With the default ``scope="chat"`` the chat_id is part of the key, so an
+    answer is only reused within the chat that produced it; ``scope="global"``
+    lets identical prompts share an answer across chats, which only suits
+    stateless, FAQ-style agents. Entries remember the chat that produced
+    them so deleting a chat drops what it contributed.
+
+    An optional SQLite file at ``disk_path`` keeps entries evicted from
+    memory (and across restarts) until their TTL runs out. Writes to it go
+    through a background thread and async code reads it with ``fetch``, so
+    the event loop never waits on the file.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        max_bytes: int = 16 * 1024 * 1024,
+        scope: str = CHAT_SCOPE,
+        disk_path: Optional[str] = None,
+    ):
+        if scope not in (GLOBAL_SCOPE, CHAT_SCOPE):
+            raise ValueError(f"Unknown cache scope: {scope}")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.scope = scope
+        self.disk_path = disk_path
+
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._disk: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def key_for(self, agent_request: AgentRequest) -> Optional[str]:
+        if not agent_request.message:
+            return None
+        parts = [normalize_prompt(agent_request.message)]
+        if self.scope == CHAT_SCOPE:
+            parts.insert(0, str(agent_request.chat_id))
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, agent_request: AgentRequest) -> Optional[AgentResponse]:
+        """Blocking lookup; async code should use ``fetch``."""
+        key = self.key_for(agent_request)
+        if key is None:
+            return None
+        entry = self._memory_get(key)
+        if entry is None and self._disk is not None:
+            entry = self._disk_get(key)
+        return self._answer(agent_request, key, entry)
+
+    async def fetch(self, agent_request: AgentRequest) -> Optional[AgentResponse]:
+        """``get`` that reads the disk tier on a worker thread."""
+        key = self.key_for(agent_request)
+        if key is None:
+            return None
+        entry = self._memory_get(key)
+        if entry is None and self._disk is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(
+                None, self._disk_get, key
+            )
+        return self._answer(agent_request, key, entry)
+
+    def put(self, agent_request: AgentRequest, response: AgentResponse) -> None:
+        key = self.key_for(agent_request)
+        if key is None or response is None:
+            return
+        entry = (
+            time.time() + self.ttl,
+            agent_request.chat_id,
+            response.model_dump_json().encode("utf-8"),
+        )
+        with self._lock:
+            self._insert(key, entry)
+        self._queue_disk(
+            "INSERT OR REPLACE INTO responses (key, chat_id, expires_at, data)"
+            " VALUES (?, ?, ?, ?)",
+            (key, _chat_key(entry[1]), entry[0], entry[2]),
+        )
+
+    def invalidate_chat(self, chat_id: Optional[str]) -> int:
+        """Drop every entry produced by ``chat_id``; returns how many left memory.
+
+        Entries on disk are deleted by the writer, before any later lookup
+        reads the file.
+        """
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry[1] == chat_id]
+            for key in keys:
+                self._remove(key)
+        self._queue_disk("DELETE FROM responses WHERE chat_id = ?", (_chat_key(chat_id),))
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        self._queue_disk("DELETE FROM responses", ())
+
+    def flush(self) -> None:
+        """Apply the disk writes queued so far, from the calling thread."""
+        if self._disk is None:
+            return
+        with self._flushing:
+            with self._disk_changed:
+                batch, self._disk_queue = self._disk_queue, []
+            try:
+                with self._disk:
+                    for statement, params in batch:
+                        self._disk.execute(statement, params)
+            except sqlite3.Error:
+                with self._disk_changed:
+                    # Keep the order: the failed batch goes before newer writes
+                    self._disk_queue = batch + self._disk_queue
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "scope": self.scope,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _memory_get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                self._remove(key)
+                entry = None
+            return entry
+
+    def _answer(
+        self, agent_request: AgentRequest, key: str, entry: Optional[Entry]
+    ) -> Optional[AgentResponse]:
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # Promoted from disk
+                self._insert(key, entry)
+            self.hits += 1
+
+        response = AgentResponse.model_validate_json(entry[2])
+        # A globally shared answer is re-addressed to the asking chat
+        return response.model_copy(update={"chat_id": agent_request.chat_id})
+
+    # Callers hold self._lock for the two below
+
+    def _insert(self, key: str, entry: Entry) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += len(key) + len(entry[2])
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(key) + len(entry[2])
+
+    # The disk tier
+
+    def _open_disk(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                header = f.read(len(SQLITE_HEADER))
+            if header != SQLITE_HEADER:
+                # A shelve left by an earlier version; its entries are only a cache
+                logger.warning(f"Setting aside response cache {path} of an older format")
+                os.replace(path, path + ".old")
+
+        self._disk = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._disk.execute("PRAGMA journal_mode=WAL")
+        self._disk.execute("PRAGMA synchronous=NORMAL")
+        self._disk.executescript(DISK_SCHEMA)
+        self._disk.commit()
+
+        self._disk_queue: List[Tuple[str, tuple]] = []
+        self._disk_changed = threading.Condition()
+        # One batch at a time, so writes land in the order they were made
+        self._flushing = threading.Lock()
+        self._disk_writer = threading.Thread(
+            target=self._write_disk, name="response-cache", daemon=True
+        )
+        self._disk_writer.start()
+
+    def _queue_disk(self, statement: str, params: tuple) -> None:
+        if self._disk is None:
+            return
+        with self._disk_changed:
+            self._disk_queue.append((statement, params))
+            self._disk_changed.notify()
+
+    def _write_disk(self) -> None:
+        while True:
+            with self._disk_changed:
+                self._disk_changed.wait_for(lambda: self._disk_queue)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not write the response cache, retrying: {e}")
+                time.sleep(DISK_RETRY_DELAY)
+
+    def _disk_get(self, key: str) -> Optional[Entry]:
+        try:
+            # Queued puts and invalidations land first so nothing stale is read
+            self.flush()
+            with self._flushing:
+                row = self._disk.execute(
+                    "SELECT expires_at, chat_id, data FROM responses WHERE key = ?",
+                    (key,),
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read the response cache: {e}")
+            return None
+        if row is None:
+            return None
+        if row[0] <= time.time():
+            self._queue_disk("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        return row[0], _chat_from_key(row[1]), bytes(row[2])
+
+
+# chat_id None (no chat) is stored as "" so it can be matched with "="
+
+
+def _chat_key(chat_id: Optional[str]) -> str:
+    return "" if chat_id is None else str(chat_id)
+
+
+def _chat_from_key(value: str) -> Optional[str]:
+    return value or None
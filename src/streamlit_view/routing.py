@@ -0,0 +1,20 @@
+import hashlib
+from typing import Optional, Sequence
+
+
+def rendezvous_pick(key: Optional[str], nodes: Sequence[str]) -> str:
+    """Pick the node that owns ``key`` by highest-random-weight hashing.
+
+    Every client computes the same owner without coordination, and adding
+    or removing a replica only moves the keys that belonged to it. Uses
+    sha1 rather than ``hash()``, which is salted per process.
+    """
+    if not nodes:
+        raise ValueError("No nodes to route to")
+    if len(nodes) == 1:
+        return nodes[0]
+    key_bytes = str(key).encode("utf-8")
+    return max(
+        nodes,
+        key=lambda node: hashlib.sha1(node.encode("utf-8") + b"\x00" + key_bytes).digest(),
+    )
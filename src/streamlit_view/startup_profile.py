@@ -0,0 +1,96 @@
+"""Report how long importing the UI's modules takes.
+
+    python -m streamlit_view.startup_profile [--top 25] [module ...]
+
+Runs the imports in a fresh interpreter under ``python -X importtime`` so
+nothing is already cached, then lists the slowest modules by cumulative
+time (a module's own time plus everything it imported).
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple, Sequence
+
+
+# What the Streamlit process imports before it can render the first page
+UI_MODULES = (
+    "streamlit_view.view",
+    "streamlit_view.identity",
+    "streamlit_view.rendering",
+    "streamlit_view.export",
+    "streamlit_view.chat_store",
+    "streamlit_view.message_cache",
+)
+
+
+class ImportTiming(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(lines: Sequence[str]) -> List[ImportTiming]:
+    """Parse ``-X importtime`` stderr lines into timings, in import order."""
+    timings = []
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # Skips the header row
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        timings.append(
+            ImportTiming(
+                module=stripped,
+                self_us=int(fields[0]),
+                cumulative_us=int(fields[1]),
+                depth=(len(name) - len(stripped)) // 2,
+            )
+        )
+    return timings
+
+
+def profile_imports(modules: Sequence[str] = UI_MODULES) -> List[ImportTiming]:
+    """Import ``modules`` in a child interpreter and return its import timings."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {', '.join(modules)} failed:\n{result.stderr}")
+    return parse_importtime(result.stderr.splitlines())
+
+
+def format_report(timings: Sequence[ImportTiming], top: int = 25) -> str:
+    total = sum(t.cumulative_us for t in timings if t.depth == 0)
+    rows = sorted(timings, key=lambda t: t.cumulative_us, reverse=True)[:top]
+    width = max([len(t.module) for t in rows] + [len("module")])
+    lines = [
+        f"{'module':<{width}}  {'cumulative ms':>13}  {'self ms':>8}",
+        "-" * (width + 25),
+    ]
+    for t in rows:
+        lines.append(
+            f"{t.module:<{width}}  {t.cumulative_us / 1000:>13.1f}  {t.self_us / 1000:>8.1f}"
+        )
+    lines.append("-" * (width + 25))
+    lines.append(f"{'total':<{width}}  {total / 1000:>13.1f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=list(UI_MODULES))
+    parser.add_argument("--top", type=int, default=25, help="Rows to show")
+    args = parser.parse_args(argv)
+    print(format_report(profile_imports(args.modules), args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+import asyncio
+import inspect
+import json
+import logging
+import queue
+import threading
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from common_utils.schemas import AgentRequest, AgentResponse
+from streamlit_view.jobs import call_view_callback
+
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Values of the "status" field on each NDJSON line of a stream
+CHUNK = "chunk"
+DONE = "done"
+ERROR = "error"
+
+# How long a stream whose last subscriber left keeps going, so a Streamlit
+# rerun re-posting the same turn can pick it up again
+ABANDON_GRACE_SECONDS = 2.0
+
+_STREAM_END = object()
+
+T = TypeVar("T")
+
+
+class StreamError(Exception):
+    """Raised on the client when a streamed response fails part-way.
+
+    ``retry_after`` is set when the server shed the request as busy, with
+    the seconds it asked the client to wait.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StreamCancelledError(Exception):
+    """Raised to a stream's subscribers when it was stopped before finishing.
+
+    ``expired`` tells a passed deadline apart from a client stopping it.
+    """
+
+    def __init__(self, message: str, expired: bool = False):
+        super().__init__(message)
+        self.expired = expired
+
+
+def _to_response(chunk: Any, chat_id: Optional[str]) -> Optional[AgentResponse]:
+    if chunk is None or isinstance(chunk, AgentResponse):
+        return chunk
+    return AgentResponse(chat_id=chat_id, message=str(chunk))
+
+
+async def iter_agent_chunks(
+    agent_request: AgentRequest,
+    view_callback: Callable,
+    stream_callback: Optional[Callable] = None,
+) -> AsyncIterator[AgentResponse]:
+    """Yield partial AgentResponses for a request.
+
+    ``stream_callback`` (or ``view_callback`` itself) may return an async
+    iterator, a plain iterator, or a single response; each item is either an
+    AgentResponse or a text delta. A callback without streaming support simply
+    produces one chunk holding the whole answer.
+    """
+    callback = stream_callback or view_callback
+    if inspect.isgeneratorfunction(callback) or inspect.isasyncgenfunction(callback):
+        source = callback(agent_request)
+    else:
+        # Plain sync callbacks may block for the whole generation
+        source = await call_view_callback(callback, agent_request)
+
+    if hasattr(source, "__aiter__"):
+        async for chunk in source:
+            response = _to_response(chunk, agent_request.chat_id)
+            if response is not None:
+                yield response
+    elif isinstance(source, Iterable) and not isinstance(source, (str, AgentResponse)):
+        # Sync generators may block while the model works, keep them off the loop
+        from starlette.concurrency import iterate_in_threadpool
+
+        async for chunk in iterate_in_threadpool(iter(source)):
+            response = _to_response(chunk, agent_request.chat_id)
+            if response is not None:
+                yield response
+    else:
+        response = _to_response(source, agent_request.chat_id)
+        if response is not None:
+            yield response
+
+
+class SharedStream:
+    """One streamed generation that any number of identical requests can follow.
+
+    The source is pumped by its own task into a buffer; each subscriber
+    replays the buffer from the start and then follows live chunks. Once
+    every subscriber has left, or if none ever arrives, the generation is
+    cancelled after ``ABANDON_GRACE_SECONDS`` unless someone subscribes.
+    """
+
+    def __init__(self, source: AsyncIterator[AgentResponse]):
+        self._source = source
+        self._chunks: List[AgentResponse] = []
+        self._finished = False
+        self._error: Optional[BaseException] = None
+        self._cancelled: Optional[StreamCancelledError] = None
+        self._subscribers = 0
+        self._changed = asyncio.Condition()
+        self._task = asyncio.create_task(self._pump())
+        # A client that disconnects before its response body starts never
+        # subscribes; treat that like any other abandonment
+        self._abandon: Optional[asyncio.TimerHandle] = asyncio.get_running_loop().call_later(
+            ABANDON_GRACE_SECONDS, self.cancel, "Abandoned by the client"
+        )
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def cancel(self, reason: str = "Cancelled", expired: bool = False) -> bool:
+        """Stop the generation; subscribers get StreamCancelledError(reason)."""
+        if self._finished:
+            return False
+        self._cancelled = StreamCancelledError(reason, expired)
+        self._task.cancel()
+        return True
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self._source:
+                async with self._changed:
+                    self._chunks.append(chunk)
+                    self._changed.notify_all()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError) and self._cancelled is not None:
+                self._error = self._cancelled
+            else:
+                self._error = e
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+        finally:
+            # Run the source's own cleanup now rather than whenever it is collected
+            aclose = getattr(self._source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            async with self._changed:
+                self._finished = True
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[AgentResponse]:
+        self._subscribers += 1
+        if self._abandon is not None:
+            self._abandon.cancel()
+            self._abandon = None
+        try:
+            position = 0
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: len(self._chunks) > position or self._finished
+                    )
+                    chunks = self._chunks[position:]
+                    finished = self._finished
+                for chunk in chunks:
+                    yield chunk
+                position += len(chunks)
+                if finished and position == len(self._chunks):
+                    if self._error is not None:
+                        raise self._error
+                    return
+        finally:
+            self._subscribers -= 1
+            if not self._subscribers and not self._finished:
+                # Everyone went away (client disconnect, Stop button)
+                self._abandon = asyncio.get_running_loop().call_later(
+                    ABANDON_GRACE_SECONDS, self.cancel, "Abandoned by the client"
+                )
+
+
+class StreamRegistry:
+    """Tracks in-flight streams by (chat_id, idempotency key) for coalescing."""
+
+    def __init__(self):
+        self._streams: Dict[Tuple[Optional[str], str], SharedStream] = {}
+
+    def get_or_start(
+        self,
+        chat_id: Optional[str],
+        key: Optional[str],
+        source_factory: Callable[[], AsyncIterator[AgentResponse]],
+    ) -> SharedStream:
+        if key is None:
+            return SharedStream(source_factory())
+
+        stream = self._streams.get((chat_id, key))
+        if stream is None or stream.finished:
+            stream = SharedStream(source_factory())
+            self._streams[(chat_id, key)] = stream
+            stream._task.add_done_callback(
+                lambda _: self._streams.pop((chat_id, key), None)
+            )
+        else:
+            logger.info(f"Coalescing duplicate stream {key} for chat {chat_id}")
+        return stream
+
+    def find(self, chat_id: Optional[str], key: str) -> Optional[SharedStream]:
+        return self._streams.get((chat_id, key))
+
+
+def encode_line(status: str, **fields: Any) -> bytes:
+    return (json.dumps({"status": status, **fields}) + "\n").encode("utf-8")
+
+
+def encode_chunk(response: AgentResponse) -> bytes:
+    return encode_line(CHUNK, response=response.model_dump(mode="json"))
+
+
+def decode_stream(
+    lines: Iterable[bytes], trailer: Optional[Dict[str, Any]] = None
+) -> Iterator[AgentResponse]:
+    """Turn the NDJSON lines of a streamed /input response into AgentResponses.
+
+    Extra fields of the final "done" line (e.g. timings) are copied into
+    ``trailer`` when one is given.
+    """
+    for line in lines:
+        if not line:
+            continue
+        data = json.loads(line)
+        status = data.get("status")
+        if status == CHUNK:
+            yield AgentResponse.model_validate(data["response"])
+        elif status == DONE:
+            if trailer is not None:
+                trailer.update({k: v for k, v in data.items() if k != "status"})
+            return
+        elif status == ERROR:
+            raise StreamError(data.get("detail", "Stream failed"))
+    raise StreamError("Stream ended before completion")
+
+
+def read_in_background(
+    stream: Iterator[T], on_idle: Callable[[], None], poll_seconds: float
+) -> Iterator[T]:
+    """Yield ``stream``'s chunks, read on a worker thread.
+
+    ``on_idle`` runs on the consuming thread each time ``poll_seconds``
+    pass without a chunk, which gives that thread a chance to be
+    interrupted while the stream is silent. An error from ``stream`` is
+    raised here, on the consuming thread. Once this generator is closed,
+    the worker stops reading at the next chunk and closes ``stream``.
+    """
+    chunks: "queue.Queue" = queue.Queue()
+    abandoned = threading.Event()
+
+    def read():
+        try:
+            for chunk in stream:
+                if abandoned.is_set():
+                    break
+                chunks.put((chunk, None))
+            chunks.put((_STREAM_END, None))
+        except Exception as e:
+            chunks.put((None, e))
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=read, name="stream-reader", daemon=True).start()
+    try:
+        while True:
+            try:
+                chunk, error = chunks.get(timeout=poll_seconds)
+            except queue.Empty:
+                on_idle()
+                continue
+            if error is not None:
+                raise error
+            if chunk is _STREAM_END:
+                return
+            yield chunk
+    finally:
+        abandoned.set()
+
+
+def retry_busy(
+    open_stream: Callable[[], Iterator[Any]],
+    write: Callable[[Iterator[Any]], T],
+    wait: Callable[[float], None],
+    retries: int,
+) -> T:
+    """``write(open_stream())``, opening the stream again while the server is busy.
+
+    A StreamError carrying ``retry_after`` is retried after ``wait`` is
+    handed that many seconds, but only when the stream failed before its
+    first chunk, so nothing ``write`` already received is written twice.
+    Any other StreamError, or the last one, is raised.
+    """
+    attempt = 0
+    while True:
+        received = 0
+
+        def counted(chunks: Iterator[Any]) -> Iterator[Any]:
+            nonlocal received
+            try:
+                for chunk in chunks:
+                    received += 1
+                    yield chunk
+            finally:
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+
+        try:
+            return write(counted(open_stream()))
+        except StreamError as e:
+            if e.retry_after is None or received or attempt >= retries:
+                raise
+            retry_after = e.retry_after
+        wait(retry_after)
+        attempt += 1
@@ -3,23 +3,15 @@ import time
 import datetime
 import streamlit as st
 import os
-import shelve
 import argparse
 import sys
 import os
 from pathlib import Path
 import logging
 import uuid
-import random
 import time
-import csv
-import io
 from common_utils.schemas import AgentResponse
 
-# Clear any cached fragments to prevent polling
-st.cache_data.clear()
-st.cache_resource.clear()
-
 #######################################################################################################
 #######################################################################################################
 
@@ -49,6 +41,36 @@ if root_dir not in sys.path:
 # from streamlit_view.view import send_input, delete_all_history, delete_chat, get_response
 
 from streamlit_view.view import StreamlitView
+from streamlit_view.view_configurations import ServerConfig
+from streamlit_view.streaming import StreamError
+from streamlit_view.identity import (
+    current_session_id,
+    get_session_store,
+    is_shared_namespace,
+)
+from streamlit_view.context import count_tokens
+from streamlit_view.message_cache import (
+    keep_window,
+    memory_report,
+    record_session,
+    with_content,
+)
+from streamlit_view.messages import Role
+from streamlit_view.metrics import serve_metrics
+from streamlit_view.export import EXPORT_FORMATS, export_cache, export_chat
+from streamlit_view.rendering import (
+    BOT_AVATAR,
+    fragment,
+    render_history,
+    render_context_report,
+    render_memory_report,
+    render_message,
+    render_stop_button,
+    render_stream_error,
+    render_timings,
+    rerun_fragment,
+    write_stream_with_retry,
+)
 
 #######################################################################################################
 #######################################################################################################
@@ -58,18 +80,23 @@ from streamlit_view.view import StreamlitView
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Argument parser to handle command-line arguments
-parser = argparse.ArgumentParser(description="Streamlit Chatbot Interface")
-parser.add_argument(
-    "--clean", action="store_true", help="Delete chat history before startup"
-)
-parser.add_argument(
-    "--title",
-    type=str,
-    default="Streamlit Chatbot Interface",
-    help="Set the title of the app",
-)
-args = parser.parse_args()
+@st.cache_resource
+def parse_args():
+    """Parse the command-line arguments once per server, not on every rerun."""
+    parser = argparse.ArgumentParser(description="Streamlit Chatbot Interface")
+    parser.add_argument(
+        "--clean", action="store_true", help="Delete chat history before startup"
+    )
+    parser.add_argument(
+        "--title",
+        type=str,
+        default="Streamlit Chatbot Interface",
+        help="Set the title of the app",
+    )
+    return parser.parse_args()
+
+
+args = parse_args()
 
 
 # Use the title argument to set the title of the Streamlit app
@@ -77,91 +104,236 @@ st.title(args.title)
 
 logger.info("Streamlit app has started")
 
-USER_AVATAR = "👤"
-BOT_AVATAR = "🤖"
+# Client-side metrics (round trips, context sizes) are observed in this
+# process, which the API server's /metrics never sees
+if ServerConfig().ui_metrics_port:
+    serve_metrics("", ServerConfig().ui_metrics_port)
 
 
-def generate_short_uuid():
-    # return uuid.uuid4().hex[:8]
-    return str(random.randint(10000000, 99999999))
+def generate_chat_id():
+    # A full UUID: the backend holds every user's chats, so ids must never
+    # collide across namespaces (delete and the chat-scoped cache key on them)
+    return uuid.uuid4().hex
 
 
-def load_chat_history():
-    dir_path = "data/chats/.streamlit"
-
-    # Create the directory if it doesn't exist
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
+# Fetched every rerun: the store depends on who this session belongs to
+# Not chat_history.db: with ndbm that is the legacy shelve's own file name
+chat_store = get_session_store(
+    "chat_history.sqlite3",
+    legacy_shelve="chat_history",
+    previous_filename="chat_history.db",
+)
 
-    with shelve.open(f"{dir_path}/chat_history") as db:
-        return db.get("chats", {}), db.get("current_chat_id", None)
+# Only the newest messages of the open chat are loaded; older ones are paged
+# in on request, and session state keeps just the newest bodies (see
+# message_cache). The sidebar likewise grows one page at a time.
+MESSAGE_PAGE_SIZE = 50
+SIDEBAR_PAGE_SIZE = 50
+SEARCH_RESULT_LIMIT = 20
 
 
-# Save chat history to shelve file
-def save_chat_history(chats, current_chat_id):
-    with shelve.open("data/chats/.streamlit/chat_history") as db:
-        db["chats"] = chats
-        db["current_chat_id"] = current_chat_id
+def load_chat_history():
+    """Load the chat index (metadata only) and the last open chat id."""
+    chats = {
+        chat["chat_id"]: {
+            "title": chat["title"],
+            "message_count": chat["message_count"],
+            "updated_at": chat["updated_at"],
+        }
+        for chat in chat_store.list_chats()
+    }
+    return chats, chat_store.get_current_chat_id()
+
+
+def open_chat(chat_id, focus_message_id=None):
+    """Make ``chat_id`` current and load only its most recent messages.
+
+    When jumping to a search result, loads one page around
+    ``focus_message_id`` instead; newer pages follow on request.
+    """
+    st.session_state.current_chat_id = chat_id
+    st.session_state.focus_message_id = focus_message_id
+    if focus_message_id is None:
+        messages = chat_store.load_messages(chat_id, limit=MESSAGE_PAGE_SIZE)
+        st.session_state.messages = keep_window(chat_store, messages)
+        st.session_state.has_older_messages = (
+            len(messages) < st.session_state.chats[chat_id]["message_count"]
+        )
+        st.session_state.has_newer_messages = False
+        return
 
+    # Half a page leading up to the hit, the rest of the page from it on
+    older = chat_store.load_messages(
+        chat_id, limit=MESSAGE_PAGE_SIZE // 2, before_id=focus_message_id
+    )
+    newer, st.session_state.has_newer_messages = load_page_since(
+        chat_id, focus_message_id - 1, MESSAGE_PAGE_SIZE - len(older)
+    )
+    st.session_state.messages = keep_window(chat_store, older + newer)
+    st.session_state.has_older_messages = len(older) == MESSAGE_PAGE_SIZE // 2
 
-def export_chat_to_text(chat_messages):
-    export_text = ""
-    for msg in chat_messages:
-        sender = "human" if msg["role"] == "user" else "ai"
-        export_text += f"{sender}: {msg['content']}\n\n"
-    return export_text
 
+def load_page_since(chat_id, after_id, size=MESSAGE_PAGE_SIZE):
+    """The ``size`` messages after ``after_id``, and whether more follow them."""
+    page = chat_store.load_messages_since(chat_id, after_id, limit=size + 1)
+    return page[:size], len(page) > size
 
-def export_chat_to_csv(chat_messages):
-    """Convert chat messages to CSV format with sender and message columns."""
-    output = io.StringIO()
-    writer = csv.writer(output)
 
-    # Write header
-    writer.writerow(["sender", "message"])
+def load_newer_messages():
+    """Append the next page of messages to a window opened at a search hit."""
+    messages = st.session_state.messages
+    newer, st.session_state.has_newer_messages = load_page_since(
+        st.session_state.current_chat_id, messages[-1].id if messages else 0
+    )
+    st.session_state.messages = keep_window(chat_store, messages + newer)
 
-    # Write messages
-    for msg in chat_messages:
-        sender = "human" if msg["role"] == "user" else "ai"
-        writer.writerow([sender, msg["content"]])
 
-    return output.getvalue()
+def load_older_messages():
+    """Prepend the previous page of messages to the visible window."""
+    messages = st.session_state.messages
+    older = chat_store.load_messages(
+        st.session_state.current_chat_id,
+        limit=MESSAGE_PAGE_SIZE,
+        before_id=messages[0].id if messages else None,
+    )
+    st.session_state.messages = keep_window(chat_store, older + messages)
+    st.session_state.has_older_messages = len(older) == MESSAGE_PAGE_SIZE
+
+
+def create_chat():
+    """Start a new empty chat and make it the current one."""
+    new_chat_id = generate_chat_id()
+    title = new_chat_id[:8]
+    st.session_state.chats[new_chat_id] = {
+        "title": title,
+        "message_count": 0,
+        "updated_at": time.time(),
+    }
+    chat_store.create_chat(new_chat_id, title)
+    chat_store.set_current_chat_id(new_chat_id)
+    open_chat(new_chat_id)
+    return new_chat_id
+
+
+def append_message(chat_id, role, content, **stats):
+    message = chat_store.append_message(chat_id, role, content, **stats)
+    st.session_state.messages.append(message)
+    keep_window(chat_store, st.session_state.messages)
+    chat = st.session_state.chats[chat_id]
+    chat["message_count"] += 1
+    chat["updated_at"] = message.created_at
+    return message
+
+
+def stop_generating(chat_id, message_id):
+    """Stop button callback: the server drops the turn and frees the agent for others."""
+    StreamlitView.cancel_message(chat_id, message_id)
+    st.session_state.generation_stopped = True
+
+
+def render_export_controls(chat_id):
+    """Offer exports without rendering anything until one is requested."""
+    export_format = st.selectbox(
+        "Export format",
+        list(EXPORT_FORMATS),
+        format_func=lambda fmt: EXPORT_FORMATS[fmt].label,
+        key=f"export_format_{chat_id}",
+    )
+    # Rendered only when asked for, as of the chat's length then; later
+    # turns do not re-render it on every rerun but offer a refresh instead
+    prepared = st.session_state.setdefault("prepared_exports", {})
+    key = (chat_id, export_format)
+    message_count = st.session_state.chats[chat_id]["message_count"]
+    if prepared.get(key, -1) < message_count:
+        label = "Refresh export" if key in prepared else "Prepare export"
+        if st.button(label, key=f"prepare_export_{chat_id}"):
+            prepared[key] = message_count
+        elif key not in prepared:
+            return
+
+    export_format_info = EXPORT_FORMATS[export_format]
+    st.download_button(
+        label=f"Export to {export_format_info.label}",
+        data=export_chat(chat_store, chat_id, export_format, prepared[key]),
+        file_name=f"chat_{chat_id}.{export_format_info.extension}",
+        mime=export_format_info.mime,
+        key=f"export_{chat_id}",
+    )
 
 
 # Initialize session state
 if "chats" not in st.session_state or "current_chat_id" not in st.session_state:
     loaded_chats, loaded_current_id = load_chat_history()
 
-    logger.info(f"Loaded chat history: {loaded_chats}, {loaded_current_id}")
-    if not loaded_chats:
-        new_chat_id = generate_short_uuid()
-        loaded_chats = {new_chat_id: {"title": new_chat_id, "messages": []}}
-        loaded_current_id = new_chat_id
+    logger.info(f"Loaded chat index: {len(loaded_chats)} chats, {loaded_current_id}")
     st.session_state.chats = loaded_chats
-    st.session_state.current_chat_id = loaded_current_id
+    st.session_state.sidebar_limit = SIDEBAR_PAGE_SIZE
+    if not loaded_chats:
+        create_chat()
+    elif loaded_current_id in loaded_chats:
+        open_chat(loaded_current_id)
+    else:
+        open_chat(next(iter(loaded_chats)))
+
+
+def render_search():
+    """Search box over every chat's title and messages, backed by the store's index."""
+    query = st.text_input(
+        "Search chats", key="chat_search", placeholder="Search titles and messages"
+    )
+    if not query.strip():
+        return
+
+    # Chats another session of this namespace created since ours loaded are skipped
+    hits = [
+        hit
+        for hit in chat_store.search(query, limit=SEARCH_RESULT_LIMIT)
+        if hit.chat_id in st.session_state.chats
+    ]
+    if not hits:
+        st.caption("No matches")
+    for hit in hits:
+        label = hit.snippet if hit.message_id is None else f"{hit.title}: {hit.snippet}"
+        if st.button(
+            label,
+            key=f"search_{hit.chat_id}_{hit.message_id}",
+            use_container_width=True,
+        ):
+            open_chat(hit.chat_id, hit.message_id)
+            chat_store.set_current_chat_id(hit.chat_id)
+            st.rerun()
 
 
 def delete_all_chat_histories():
+    chat_ids = list(st.session_state.chats.keys())
     st.session_state.chats = {}
-    new_chat_id = generate_short_uuid()
-    st.session_state.chats[new_chat_id] = {"title": new_chat_id, "messages": []}
-    st.session_state.current_chat_id = new_chat_id
+    chat_store.delete_all()
+    export_cache.invalidate(namespace=chat_store.path)
+    create_chat()
 
-    save_chat_history(st.session_state.chats, st.session_state.current_chat_id)
-    StreamlitView.delete_all_history()
+    if is_shared_namespace():
+        StreamlitView.delete_all_history()
+    else:
+        # Other users' chats live in the same backend; only drop ours
+        for chat_id in chat_ids:
+            StreamlitView.delete_chat(chat_id)
 
-with st.sidebar:
+@fragment
+def render_sidebar():
+    """Chat list, search and actions; these rerun only this fragment."""
     if st.button("New Chat"):
-        new_chat_id = generate_short_uuid()
-        st.session_state.chats[new_chat_id] = {"title": new_chat_id, "messages": []}
-        st.session_state.current_chat_id = new_chat_id
-        save_chat_history(st.session_state.chats, st.session_state.current_chat_id)
+        create_chat()
         st.rerun()
 
+    render_search()
+
     st.write("---")
     st.subheader("Chat Sessions")
 
-    for chat_id in list(st.session_state.chats.keys()):
+    visible_chat_ids = list(st.session_state.chats.keys())[
+        : st.session_state.sidebar_limit
+    ]
+    for chat_id in visible_chat_ids:
         chat = st.session_state.chats[chat_id]
         col1, col2 = st.columns([0.7, 0.3])
 
@@ -177,10 +349,8 @@ with st.sidebar:
                 use_container_width=True,
                 type=btn_type,
             ):
-                st.session_state.current_chat_id = chat_id
-                save_chat_history(
-                    st.session_state.chats, st.session_state.current_chat_id
-                )
+                open_chat(chat_id)
+                chat_store.set_current_chat_id(chat_id)
                 st.rerun()
 
         with col2:
@@ -190,99 +360,139 @@ with st.sidebar:
                 )
                 if new_title != chat["title"]:
                     st.session_state.chats[chat_id]["title"] = new_title
-                    save_chat_history(
-                        st.session_state.chats, st.session_state.current_chat_id
-                    )
+                    chat_store.rename_chat(chat_id, new_title)
 
-                export_text = export_chat_to_text(chat["messages"])
-                st.download_button(
-                    label="Export to TXT",
-                    data=export_text,
-                    file_name=f"chat_{chat_id}.txt",
-                    mime="text/plain",
-                    key=f"export_{chat_id}",
-                )
-
-                export_csv = export_chat_to_csv(chat["messages"])
-                st.download_button(
-                    label="Export to CSV",
-                    data=export_csv,
-                    file_name=f"chat_{chat_id}.csv",
-                    mime="text/csv",
-                    key=f"export_csv_{chat_id}",
-                )
+                render_export_controls(chat_id)
 
                 if st.button("Delete", key=f"delete_{chat_id}", type="primary"):
                     del st.session_state.chats[chat_id]
+                    chat_store.delete_chat(chat_id)
+                    export_cache.invalidate(chat_id, namespace=chat_store.path)
                     StreamlitView.delete_chat(chat_id)
                     if st.session_state.current_chat_id == chat_id:
                         if len(st.session_state.chats) > 0:
-                            st.session_state.current_chat_id = next(
-                                iter(st.session_state.chats.keys())
+                            open_chat(next(iter(st.session_state.chats.keys())))
+                            chat_store.set_current_chat_id(
+                                st.session_state.current_chat_id
                             )
                         else:
-                            new_id = generate_short_uuid()
-                            st.session_state.chats[new_id] = {
-                                "title": new_id,
-                                "messages": [],
-                            }
-                            st.session_state.current_chat_id = new_id
-                    save_chat_history(
-                        st.session_state.chats, st.session_state.current_chat_id
-                    )
-                    st.rerun()
+                            create_chat()
+                        st.rerun()
+                    rerun_fragment()
+
+    if len(st.session_state.chats) > st.session_state.sidebar_limit:
+        if st.button("Show more chats", use_container_width=True):
+            st.session_state.sidebar_limit += SIDEBAR_PAGE_SIZE
+            rerun_fragment()
 
     st.write("---")
     if st.button("Delete All Chats", type="secondary"):
         delete_all_chat_histories()
         st.rerun()
 
-# Display current chat
-current_chat = st.session_state.chats[st.session_state.current_chat_id]
-for message in current_chat["messages"]:
-    avatar = USER_AVATAR if message["role"] == "user" else BOT_AVATAR
-    with st.chat_message(message["role"], avatar=avatar):
-        st.markdown(message["content"])
 
-# Process user input
-if prompt := st.chat_input("How can I help?"):
-    current_chat["messages"].append({"role": "user", "content": prompt})
-
-    with st.chat_message("user", avatar=USER_AVATAR):
-        st.markdown(prompt)
-
-    # Send the input and get immediate response
-    logger.info(
-        f"Sending input to the model: {prompt}, {st.session_state.current_chat_id}"
-    )
-    message_id = str(uuid.uuid4())
-
-    # Get response directly from agent
-    with st.spinner("Thinking..."):
-        agent_response = StreamlitView.send_message(
-            prompt,
-            st.session_state.current_chat_id,
-            message_id,
+@fragment
+def render_conversation():
+    """Turns since the last full run, plus the input; sending reruns only this."""
+    chat_id = st.session_state.current_chat_id
+    new_messages = st.session_state.messages[st.session_state.rendered_messages :]
+    for message in with_content(chat_store, new_messages):
+        render_message(message)
+    if st.session_state.pop("generation_stopped", False):
+        st.caption("Generation stopped.")
+
+    # Replies go after the newest message, so they wait until it is loaded
+    behind = st.session_state.get("has_newer_messages", False)
+    if prompt := st.chat_input(
+        "Load the newer messages to reply" if behind else "How can I help?",
+        disabled=behind,
+    ):
+        render_message(append_message(chat_id, Role.USER, prompt))
+
+        # Send the input and get immediate response
+        logger.info(f"Sending input to the model: {prompt}, {chat_id}")
+        message_id = str(uuid.uuid4())
+
+        # Stream the response into the chat bubble as it is generated
+        timings = {} if ServerConfig().show_timings else None
+        # Earlier turns go along only when a context budget is configured
+        history = (
+            with_content(chat_store, st.session_state.messages[:-1])
+            if ServerConfig().context_max_tokens > 0
+            else None
         )
+        context_report = {}
+        started = time.perf_counter()
+        with st.chat_message(Role.ASSISTANT.value, avatar=BOT_AVATAR):
+            stop_button = render_stop_button(
+                lambda: stop_generating(chat_id, message_id), key=f"stop-{message_id}"
+            )
+            try:
+                response_text = write_stream_with_retry(
+                    lambda: StreamlitView.stream_message(
+                        prompt,
+                        chat_id,
+                        message_id,
+                        timings=timings,
+                        history=history,
+                        context_report=context_report,
+                    )
+                )
+                render_timings(timings)
+                if ServerConfig().show_timings:
+                    render_context_report(context_report)
+            except StreamError as e:
+                response_text = None
+                error_msg = str(e)
+                logger.error(f"Error response: {error_msg}")
+                render_stream_error(e)
+            # Not in a finally: a Stop click unwinds this run, clearing it anyway
+            stop_button.empty()
+
+        if response_text is not None:
+            # Add the AI message to chat history
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            token_counts = (
+                {
+                    "prompt_tokens": context_report["total_tokens"],
+                    "completion_tokens": count_tokens(response_text),
+                }
+                if context_report
+                else {}
+            )
+            append_message(
+                chat_id,
+                Role.ASSISTANT,
+                response_text,
+                latency_ms=latency_ms,
+                **token_counts,
+            )
+            logger.info(f"AI response for chat {chat_id}: {response_text}")
 
-    # Process the response
-    if isinstance(agent_response, AgentResponse):
-        # Add the AI message to chat history
-        current_chat["messages"].append(
-            {"role": "assistant", "content": agent_response.message}
-        )
-        logger.info(
-            f"AI response for chat {st.session_state.current_chat_id}: {agent_response.message}"
-        )
 
-        # Display the AI response
-        with st.chat_message("assistant", avatar=BOT_AVATAR):
-            st.markdown(agent_response.message)
-    else:
-        # Handle error string
-        error_msg = str(agent_response)
-        logger.error(f"Error response: {error_msg}")
-        st.error(f"Error: {error_msg}")
+with st.sidebar:
+    render_sidebar()
+
+# Display the current window of the chat, newest messages last. Settled
+# messages are drawn only on full runs; fragment reruns draw new turns.
+if st.session_state.has_older_messages:
+    if st.button("Load older messages"):
+        load_older_messages()
+        st.rerun()
 
-    # Save chat history
-    save_chat_history(st.session_state.chats, st.session_state.current_chat_id)
+st.session_state.rendered_messages = render_history(
+    with_content(chat_store, st.session_state.messages),
+    highlight_id=st.session_state.get("focus_message_id"),
+)
+if st.session_state.get("has_newer_messages"):
+    if st.button("Load newer messages"):
+        load_newer_messages()
+        st.rerun()
+render_conversation()
+
+# Only measured when something reads it, and then sampled (see record_session)
+if ServerConfig().show_memory or ServerConfig().ui_metrics_port:
+    session_bytes = record_session(current_session_id(), st.session_state)
+    if ServerConfig().show_memory:
+        with st.sidebar:
+            render_memory_report(session_bytes, memory_report())
@@ -1,21 +1,13 @@
 import streamlit as st
 import os
-import shelve
 import argparse
 import sys
 from pathlib import Path
 import logging
 import uuid
-import random
 import time
-import csv
-import io
 from common_utils.schemas import AgentResponse
 
-# Clear any cached fragments to prevent polling
-st.cache_data.clear()
-st.cache_resource.clear()
-
 # Add the project root directory to Python path
 root_dir = str(Path(__file__).parent.parent)
 if root_dir not in sys.path:
@@ -23,90 +15,179 @@ if root_dir not in sys.path:
 
 # Import the StreamlitView
 from streamlit_view.view import StreamlitView
+from streamlit_view.view_configurations import ServerConfig
+from streamlit_view.streaming import StreamError
+from streamlit_view.identity import (
+    current_session_id,
+    get_session_store,
+    is_shared_namespace,
+)
+from streamlit_view.context import count_tokens
+from streamlit_view.message_cache import (
+    keep_window,
+    memory_report,
+    record_session,
+    with_content,
+)
+from streamlit_view.messages import Role
+from streamlit_view.metrics import serve_metrics
+from streamlit_view.export import EXPORT_FORMATS, export_cache, export_chat
+from streamlit_view.rendering import (
+    BOT_AVATAR,
+    fragment,
+    render_history,
+    render_context_report,
+    render_memory_report,
+    render_message,
+    render_stop_button,
+    render_stream_error,
+    render_timings,
+    write_stream_with_retry,
+)
 
 
 # Note: Logging is already configured by the main application
 # We just get a logger instance here to avoid overriding the main config
 logger = logging.getLogger(__name__)
 
-# Argument parser to handle command-line arguments
-parser = argparse.ArgumentParser(description="Streamlit Single Chat Interface")
-parser.add_argument(
-    "--clean", action="store_true", help="Delete chat history before startup"
-)
-parser.add_argument(
-    "--title", type=str, default="Streamlit Chat", help="Set the title of the app"
-)
-args = parser.parse_args()
+@st.cache_resource
+def parse_args():
+    """Parse the command-line arguments once per server, not on every rerun."""
+    parser = argparse.ArgumentParser(description="Streamlit Single Chat Interface")
+    parser.add_argument(
+        "--clean", action="store_true", help="Delete chat history before startup"
+    )
+    parser.add_argument(
+        "--title", type=str, default="Streamlit Chat", help="Set the title of the app"
+    )
+    return parser.parse_args()
+
+
+args = parse_args()
 
 st.title(args.title)
 logger.info("Streamlit single chat app has started")
 
-USER_AVATAR = "👤"
-BOT_AVATAR = "🤖"
+# Client-side metrics (round trips, context sizes) are observed in this
+# process, which the API server's /metrics never sees
+if ServerConfig().ui_metrics_port:
+    serve_metrics("", ServerConfig().ui_metrics_port)
 
 
 def generate_chat_id():
-    """Generate a unique ID for the chat session."""
-    return str(random.randint(10000000, 99999999))
+    """Generate a unique ID for the chat session.
 
+    A full UUID, since the backend holds the chats of every user.
+    """
+    return uuid.uuid4().hex
 
-def load_chat_history():
-    """Load chat history from disk."""
-    dir_path = "data/chats/.streamlit"
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
 
-    with shelve.open(f"{dir_path}/single_chat_history") as db:
-        chat_id = db.get("chat_id", None)
-        messages = db.get("messages", [])
-        return chat_id, messages
+# Fetched every rerun: the store depends on who this session belongs to
+# Not single_chat_history.db: with ndbm that is the legacy shelve's own file name
+chat_store = get_session_store(
+    "single_chat_history.sqlite3",
+    legacy_shelve="single_chat_history",
+    previous_filename="single_chat_history.db",
+)
 
 
-def save_chat_history(chat_id: str, messages: list):
-    """Save chat history to disk."""
-    with shelve.open("data/chats/.streamlit/single_chat_history") as db:
-        db["chat_id"] = chat_id
-        db["messages"] = messages
+# Only the newest messages are loaded up front; older ones are paged in, and
+# session state keeps just the newest bodies (see message_cache)
+MESSAGE_PAGE_SIZE = 50
 
 
-def export_chat_to_text(messages: list) -> str:
-    """Convert chat messages to exportable text format."""
-    export_text = ""
-    for msg in messages:
-        sender = "human" if msg["role"] == "user" else "ai"
-        export_text += f"{sender}: {msg['content']}\n\n"
-    return export_text
+def load_chat_history():
+    """Load the chat id and the most recent page of its messages from disk."""
+    chat_id = chat_store.get_current_chat_id()
+    messages = (
+        chat_store.load_messages(chat_id, limit=MESSAGE_PAGE_SIZE) if chat_id else []
+    )
+    return chat_id, keep_window(chat_store, messages)
 
 
-def export_chat_to_csv(messages: list) -> str:
-    """Convert chat messages to CSV format with sender and message columns."""
-    output = io.StringIO()
-    writer = csv.writer(output)
+def load_older_messages():
+    """Prepend the previous page of messages to the visible window."""
+    messages = st.session_state.messages
+    older = chat_store.load_messages(
+        st.session_state.chat_id,
+        limit=MESSAGE_PAGE_SIZE,
+        before_id=messages[0].id if messages else None,
+    )
+    st.session_state.messages = keep_window(chat_store, older + messages)
+    st.session_state.has_older_messages = len(older) == MESSAGE_PAGE_SIZE
 
-    # Write header
-    writer.writerow(["sender", "message"])
 
-    # Write messages
-    for msg in messages:
-        sender = "human" if msg["role"] == "user" else "ai"
-        writer.writerow([sender, msg["content"]])
+def append_message(role: Role, content: str, **stats):
+    """Add a message to the session and persist just that message."""
+    message = chat_store.append_message(st.session_state.chat_id, role, content, **stats)
+    st.session_state.messages.append(message)
+    st.session_state.message_count += 1
+    keep_window(chat_store, st.session_state.messages)
+    return message
 
-    return output.getvalue()
+
+def stop_generating(chat_id, message_id):
+    """Stop button callback: the server drops the turn and frees the agent for others."""
+    StreamlitView.cancel_message(chat_id, message_id)
+    st.session_state.generation_stopped = True
+
+
+def render_export_controls(chat_id):
+    """Offer exports without rendering anything until one is requested."""
+    export_format = st.selectbox(
+        "Export format",
+        list(EXPORT_FORMATS),
+        format_func=lambda fmt: EXPORT_FORMATS[fmt].label,
+        key=f"export_format_{chat_id}",
+    )
+    # Rendered only when asked for, as of the chat's length then; later
+    # turns do not re-render it on every rerun but offer a refresh instead.
+    # The session's own count decides that, so the store is only asked for
+    # the chat's length when the button is clicked.
+    prepared = st.session_state.setdefault("prepared_exports", {})
+    key = (chat_id, export_format)
+    message_count = st.session_state.message_count
+    if prepared.get(key, -1) < message_count:
+        label = "Refresh export" if key in prepared else "Prepare export"
+        if st.button(label, key=f"prepare_export_{chat_id}"):
+            chat = chat_store.get_chat(chat_id)
+            prepared[key] = chat["message_count"] if chat else message_count
+        elif key not in prepared:
+            return
+
+    export_format_info = EXPORT_FORMATS[export_format]
+    st.download_button(
+        label=f"Export to {export_format_info.label}",
+        data=export_chat(chat_store, chat_id, export_format, prepared[key]),
+        file_name=f"chat_{chat_id}.{export_format_info.extension}",
+        mime=export_format_info.mime,
+        key=f"export_{chat_id}",
+    )
 
 
 def clear_chat_history():
     """Clear the chat history and create a new chat session."""
+    old_chat_id = st.session_state.chat_id
+
     # Generate a new chat ID
     chat_id = generate_chat_id()
     st.session_state.chat_id = chat_id
     st.session_state.messages = []
-
-    # Save empty history
-    save_chat_history(chat_id, [])
-
-    # Tell the backend to delete all history
-    StreamlitView.delete_all_history()
+    st.session_state.message_count = 0
+    st.session_state.has_older_messages = False
+
+    # Drop the old history and record the new empty chat
+    chat_store.delete_all()
+    export_cache.invalidate(namespace=chat_store.path)
+    chat_store.create_chat(chat_id)
+    chat_store.set_current_chat_id(chat_id)
+
+    # Tell the backend to delete all history, or just ours when other
+    # users' chats share the backend
+    if is_shared_namespace():
+        StreamlitView.delete_all_history()
+    else:
+        StreamlitView.delete_chat(old_chat_id)
 
     logger.info(f"Chat history cleared, new chat ID: {chat_id}")
 
@@ -118,84 +199,119 @@ if "chat_id" not in st.session_state or "messages" not in st.session_state:
         # Create a new chat session
         loaded_chat_id = generate_chat_id()
         loaded_messages = []
+        chat_store.create_chat(loaded_chat_id)
+        chat_store.set_current_chat_id(loaded_chat_id)
     st.session_state.chat_id = loaded_chat_id
     st.session_state.messages = loaded_messages
+    st.session_state.has_older_messages = len(loaded_messages) == MESSAGE_PAGE_SIZE
+    # Kept up to date by append_message from here on
+    loaded_chat = chat_store.get_chat(loaded_chat_id)
+    st.session_state.message_count = loaded_chat["message_count"] if loaded_chat else 0
 
 # Display current chat ID under title
 st.caption(f"Chat ID: {st.session_state.chat_id}")
 
-# Sidebar with only the Clear History button
-with st.sidebar:
+@fragment
+def render_sidebar():
+    """Chat options; preparing an export reruns only this fragment."""
     st.subheader("Chat Options")
     if st.button("Clear History"):
         clear_chat_history()
         st.rerun()
 
-    # Export functionality
-    export_text = export_chat_to_text(st.session_state.messages)
-    st.download_button(
-        label="Export to TXT",
-        data=export_text,
-        file_name=f"chat_{st.session_state.chat_id}.txt",
-        mime="text/plain",
-    )
-
-    export_csv = export_chat_to_csv(st.session_state.messages)
-    st.download_button(
-        label="Export to CSV",
-        data=export_csv,
-        file_name=f"chat_{st.session_state.chat_id}.csv",
-        mime="text/csv",
-    )
-
-# Display message history
-for message in st.session_state.messages:
-    avatar = USER_AVATAR if message["role"] == "user" else BOT_AVATAR
-    with st.chat_message(message["role"], avatar=avatar):
-        st.markdown(message["content"])
-
-# Process user input
-if prompt := st.chat_input("How can I help?"):
-    # Add user message to history
-    st.session_state.messages.append({"role": "user", "content": prompt})
-
-    # Display the user message
-    with st.chat_message("user", avatar=USER_AVATAR):
-        st.markdown(prompt)
-
-    # Send the input and get immediate response
-    logger.info(f"Sending input to the model: {prompt}, {st.session_state.chat_id}")
-    message_id = str(uuid.uuid4())
-
-    # Get response directly from agent
-    with st.spinner("Thinking..."):
-        agent_response = StreamlitView.send_message(
-            prompt,
-            st.session_state.chat_id,
-            message_id,
+    # Export functionality covers the whole transcript, not just the window
+    render_export_controls(st.session_state.chat_id)
+
+
+@fragment
+def render_conversation():
+    """Turns since the last full run, plus the input; sending reruns only this."""
+    chat_id = st.session_state.chat_id
+    new_messages = st.session_state.messages[st.session_state.rendered_messages :]
+    for message in with_content(chat_store, new_messages):
+        render_message(message)
+    if st.session_state.pop("generation_stopped", False):
+        st.caption("Generation stopped.")
+
+    if prompt := st.chat_input("How can I help?"):
+        # Add user message to history and display it
+        render_message(append_message(Role.USER, prompt))
+
+        # Send the input and get immediate response
+        logger.info(f"Sending input to the model: {prompt}, {chat_id}")
+        message_id = str(uuid.uuid4())
+
+        # Stream the response into the chat bubble as it is generated
+        timings = {} if ServerConfig().show_timings else None
+        # Earlier turns go along only when a context budget is configured
+        history = (
+            with_content(chat_store, st.session_state.messages[:-1])
+            if ServerConfig().context_max_tokens > 0
+            else None
         )
+        context_report = {}
+        started = time.perf_counter()
+        with st.chat_message(Role.ASSISTANT.value, avatar=BOT_AVATAR):
+            stop_button = render_stop_button(
+                lambda: stop_generating(chat_id, message_id), key=f"stop-{message_id}"
+            )
+            try:
+                response_text = write_stream_with_retry(
+                    lambda: StreamlitView.stream_message(
+                        prompt,
+                        chat_id,
+                        message_id,
+                        timings=timings,
+                        history=history,
+                        context_report=context_report,
+                    )
+                )
+                render_timings(timings)
+                if ServerConfig().show_timings:
+                    render_context_report(context_report)
+            except StreamError as e:
+                response_text = None
+                error_msg = str(e)
+                logger.error(f"Error response: {error_msg}")
+                render_stream_error(e)
+            # Not in a finally: a Stop click unwinds this run, clearing it anyway
+            stop_button.empty()
+
+        if response_text is not None:
+            # Add the AI message to chat history
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            token_counts = (
+                {
+                    "prompt_tokens": context_report["total_tokens"],
+                    "completion_tokens": count_tokens(response_text),
+                }
+                if context_report
+                else {}
+            )
+            append_message(
+                Role.ASSISTANT, response_text, latency_ms=latency_ms, **token_counts
+            )
+            logger.info(f"AI response for chat {chat_id}: {response_text}")
 
-    # Process the response
-    if isinstance(agent_response, AgentResponse):
-        # Add the AI message to chat history
-        st.session_state.messages.append(
-            {"role": "assistant", "content": agent_response.message}
-        )
-        logger.info(
-            f"AI response for chat {st.session_state.chat_id}: {agent_response.message}"
-        )
 
-        # Display the AI response
-        with st.chat_message("assistant", avatar=BOT_AVATAR):
-            st.markdown(agent_response.message)
-    else:
-        # Handle error string
-        error_msg = str(agent_response)
-        logger.error(f"Error response: {error_msg}")
-        st.error(f"Error: {error_msg}")
+with st.sidebar:
+    render_sidebar()
 
-    # Save chat history
-    save_chat_history(st.session_state.chat_id, st.session_state.messages)
+# Display the most recent window of the message history. Settled messages
+# are drawn only on full runs; fragment reruns draw new turns.
+if st.session_state.has_older_messages:
+    if st.button("Load older messages"):
+        load_older_messages()
+        st.rerun()
 
-# Save chat history at the end
-save_chat_history(st.session_state.chat_id, st.session_state.messages)
+st.session_state.rendered_messages = render_history(
+    with_content(chat_store, st.session_state.messages)
+)
+render_conversation()
+
+# Only measured when something reads it, and then sampled (see record_session)
+if ServerConfig().show_memory or ServerConfig().ui_metrics_port:
+    session_bytes = record_session(current_session_id(), st.session_state)
+    if ServerConfig().show_memory:
+        with st.sidebar:
+            render_memory_report(session_bytes, memory_report())
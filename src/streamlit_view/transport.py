@@ -0,0 +1,647 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from common_utils.schemas import AgentRequest, AgentResponse, RequestStatus
+from streamlit_view.admission import AdmissionError
+from streamlit_view.batch import BatchResult, decode_batch, encode_batch_request
+from streamlit_view.context import ChatContext
+from streamlit_view.dispatcher import (
+    DeadlineExceededError,
+    Dispatcher,
+    JobCancelledError,
+    JobFailedError,
+)
+from streamlit_view.envelope import accept_encodings, available_media_types, decode_response
+from streamlit_view.jobs import QueueFullError
+from streamlit_view.metrics import RequestTimer
+from streamlit_view.routing import rendezvous_pick
+from streamlit_view.streaming import StreamError, decode_stream
+from streamlit_view.view_configurations import (
+    CHAT_ID_HEADER,
+    CLIENT_CLOSED_STATUS,
+    CONTEXT_FIELD,
+    HTTP_TRANSPORT,
+    IDEMPOTENCY_HEADER,
+    INPROCESS_TRANSPORT,
+    REQUEST_TIMEOUT_HEADER,
+    TIMING_HEADER,
+    UDS_TRANSPORT,
+    V2_RESPONSE_FORMAT,
+    ServerConfig,
+)
+
+# requests (via http_client) is imported when an HTTP transport is built,
+# so the in-process transport never loads it
+if TYPE_CHECKING:
+    import requests
+
+    from streamlit_view.http_client import HttpClient
+
+
+logger = logging.getLogger(__name__)
+
+
+class TransportError(Exception):
+    """A request could not be delivered or the server answered with an error.
+
+    ``retry_after`` carries the server's Retry-After, in seconds, when it
+    turned the request away as rate limited (429) or busy (503).
+    """
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def busy(self) -> bool:
+        return self.status_code in (429, 503)
+
+
+class Transport(ABC):
+    """How StreamlitView's client methods reach the dispatcher behind the agent.
+
+    Methods raise TransportError on failure. ``timings``, when given, is
+    filled with the server-side stage timings in milliseconds. ``timeout``
+    is how many seconds the caller waits for a turn; the server drops the
+    turn once it has passed. ``context`` is trimmed history that reaches
+    the agent next to the prompt (see context.current_context).
+    """
+
+    @abstractmethod
+    def send(
+        self,
+        agent_request: AgentRequest,
+        message_id: Optional[str] = None,
+        bypass_cache: bool = False,
+        timings: Optional[Dict[str, float]] = None,
+        timeout: Optional[float] = None,
+        context: Optional[ChatContext] = None,
+    ) -> AgentResponse:
+        ...
+
+    @abstractmethod
+    def stream(
+        self,
+        agent_request: AgentRequest,
+        message_id: Optional[str] = None,
+        bypass_cache: bool = False,
+        timings: Optional[Dict[str, float]] = None,
+        timeout: Optional[float] = None,
+        context: Optional[ChatContext] = None,
+    ) -> Iterator[AgentResponse]:
+        ...
+
+    @abstractmethod
+    def batch(
+        self,
+        agent_requests: Sequence[AgentRequest],
+        concurrency: int,
+        bypass_cache: bool = False,
+    ) -> Iterator[BatchResult]:
+        """Run many requests, yielding each result (in completion order) as it finishes."""
+
+    @abstractmethod
+    def submit(self, agent_request: AgentRequest, message_id: Optional[str] = None) -> str:
+        """Queue a request without waiting; returns the job id."""
+
+    @abstractmethod
+    def get_job(self, job_id: str, wait: float = 0) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def cancel(self, chat_id: str, message_id: str) -> bool:
+        """Stop the turn sent with ``message_id``; False when it had already finished."""
+
+    @abstractmethod
+    def delete_all_history(self, agent_request: AgentRequest) -> str:
+        """Start purging all history; returns the purge's job id."""
+
+    @abstractmethod
+    def delete_chat(self, agent_request: AgentRequest) -> str:
+        """Start purging one chat; returns the purge's job id."""
+
+    def close(self) -> None:
+        pass
+
+
+def _request_headers(
+    message_id: Optional[str],
+    bypass_cache: bool = False,
+    want_timings: bool = False,
+    timeout: Optional[float] = None,
+) -> Dict[str, str]:
+    headers = {IDEMPOTENCY_HEADER: message_id} if message_id else {}
+    if bypass_cache:
+        headers["Cache-Control"] = "no-cache"
+    if want_timings:
+        headers[TIMING_HEADER] = "1"
+    if timeout:
+        headers[REQUEST_TIMEOUT_HEADER] = f"{timeout:g}"
+    return headers
+
+
+def _request_body(agent_request: AgentRequest, context: Optional[ChatContext]) -> str:
+    """The AgentRequest as JSON, with ``context`` beside its fields when given."""
+    if context is None:
+        return agent_request.model_dump_json()
+    data = agent_request.model_dump(mode="json")
+    data[CONTEXT_FIELD] = context.to_dict()
+    return json.dumps(data)
+
+
+def _parse_server_timing(headers) -> Dict[str, float]:
+    """Parse ``Server-Timing: name;dur=1.23, ...`` into {name: milliseconds}."""
+    timings = {}
+    for metric in headers.get("Server-Timing", "").split(","):
+        name, _, params = metric.strip().partition(";")
+        if name and params.startswith("dur="):
+            timings[name] = float(params[len("dur="):])
+    return timings
+
+
+def _read_timeout(timeout: Optional[float]) -> Optional[tuple]:
+    """(connect, read) that outlasts ``timeout``, so the server's 504 arrives first."""
+    if not timeout:
+        return None
+    connect, read = ServerConfig().timeout
+    return (connect, max(read, timeout + 1.0))
+
+
+def _retry_after(response: "requests.Response") -> Optional[float]:
+    # The server sends delay-seconds; an HTTP date from a proxy is ignored
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _check_status(response: "requests.Response", expected=(RequestStatus.SUCCESS.code,)):
+    if response.status_code not in expected:
+        raise TransportError(
+            f"Request failed with status code {response.status_code}",
+            response.status_code,
+            _retry_after(response),
+        )
+
+
+class HttpTransport(Transport):
+    """The FastAPI endpoints over a pooled ``requests`` session.
+
+    When ``ServerConfig().replicas`` lists several servers, each chat is
+    pinned to one of them by rendezvous hashing on chat_id, so a chat's
+    turns always reach the replica holding its model state.
+    """
+
+    # Remembered replica per submitted job, bounded so it cannot grow forever
+    MAX_JOB_ROUTES = 1024
+
+    def __init__(self, client: Optional["HttpClient"] = None):
+        from requests.exceptions import RequestException
+
+        if client is None:
+            from streamlit_view.http_client import HttpClient
+
+            client = HttpClient()
+        self.client = client
+        self._network_errors = RequestException
+        self._job_routes: "OrderedDict[str, str]" = OrderedDict()
+
+    def _route(self, key: Optional[str]) -> Optional[str]:
+        replicas = ServerConfig().replicas
+        return rendezvous_pick(key, replicas) if replicas else None
+
+    def send(
+        self,
+        agent_request,
+        message_id=None,
+        bypass_cache=False,
+        timings=None,
+        timeout=None,
+        context=None,
+    ):
+        headers = _request_headers(message_id, bypass_cache, timings is not None, timeout)
+        headers[CHAT_ID_HEADER] = str(agent_request.chat_id)
+        if ServerConfig().response_format == V2_RESPONSE_FORMAT:
+            # Servers that predate the v2 envelope ignore this and answer legacy
+            headers["Accept"] = ", ".join(available_media_types() + ("application/json",))
+            headers["Accept-Encoding"] = accept_encodings()
+        try:
+            response = self.client.post_body(
+                "/input",
+                _request_body(agent_request, context),
+                timeout=_read_timeout(timeout),
+                headers=headers,
+                base_url=self._route(agent_request.chat_id),
+            )
+        except self._network_errors as e:
+            raise TransportError(str(e)) from e
+        if timings is not None:
+            timings.update(_parse_server_timing(response.headers))
+        _check_status(response)
+        return decode_response(response.content, response.headers.get("Content-Type"))
+
+    def stream(
+        self,
+        agent_request,
+        message_id=None,
+        bypass_cache=False,
+        timings=None,
+        timeout=None,
+        context=None,
+    ):
+        headers = _request_headers(message_id, bypass_cache, timings is not None, timeout)
+        headers[CHAT_ID_HEADER] = str(agent_request.chat_id)
+        trailer: Dict[str, Any] = {}
+        try:
+            with self.client.post_body(
+                "/input/stream",
+                _request_body(agent_request, context),
+                # A stall between chunks gives up with the turn's deadline too
+                timeout=_read_timeout(timeout),
+                headers=headers,
+                base_url=self._route(agent_request.chat_id),
+                stream=True,
+            ) as response:
+                _check_status(response)
+                yield from decode_stream(response.iter_lines(), trailer)
+        except self._network_errors as e:
+            raise TransportError(str(e)) from e
+        if timings is not None:
+            timings.update(trailer.get("timings", {}))
+
+    def batch(self, agent_requests, concurrency, bypass_cache=False):
+        # Each chat's turns go to its own replica, as with single requests
+        groups: "OrderedDict[Optional[str], List[int]]" = OrderedDict()
+        for index, agent_request in enumerate(agent_requests):
+            groups.setdefault(self._route(agent_request.chat_id), []).append(index)
+        parts = [
+            lambda base_url=base_url, indices=indices: self._batch(
+                base_url, agent_requests, indices, concurrency, bypass_cache
+            )
+            for base_url, indices in groups.items()
+        ]
+        if len(parts) == 1:
+            yield from parts[0]()
+        else:
+            yield from _merge(parts)
+
+    def _batch(self, base_url, agent_requests, indices, concurrency, bypass_cache):
+        body = encode_batch_request([agent_requests[i] for i in indices], concurrency)
+        headers = _request_headers(None, bypass_cache)
+        try:
+            with self.client.post_body(
+                "/input/batch", body, headers=headers, base_url=base_url, stream=True
+            ) as response:
+                _check_status(response)
+                for result in decode_batch(response.iter_lines()):
+                    yield result._replace(index=indices[result.index])
+        except self._network_errors as e:
+            raise TransportError(str(e)) from e
+        except StreamError as e:
+            raise TransportError(str(e)) from e
+
+    def submit(self, agent_request, message_id=None):
+        headers = {"Prefer": "respond-async", **_request_headers(message_id)}
+        headers[CHAT_ID_HEADER] = str(agent_request.chat_id)
+        return self._accept(
+            "/input", agent_request, headers, self._route(agent_request.chat_id)
+        )
+
+    def _accept(self, path, agent_request, headers, base_url):
+        """POST a request the server answers with 202 + job id, remembering its replica."""
+        try:
+            response = self.client.post(
+                path, agent_request, headers=headers, base_url=base_url
+            )
+        except self._network_errors as e:
+            raise TransportError(str(e)) from e
+        _check_status(response, (202,))
+        job_id = response.json()["job_id"]
+        if base_url is not None:
+            self._job_routes[job_id] = base_url
+            while len(self._job_routes) > self.MAX_JOB_ROUTES:
+                self._job_routes.popitem(last=False)
+        return job_id
+
+    def get_job(self, job_id, wait=0):
+        # Any replica can answer from the shared job registry, but the one
+        # that queued the job answers without polling it
+        base_url = self._job_routes.get(job_id) or self._route(job_id)
+        try:
+            response = self.client.get(
+                f"/jobs/{job_id}", params={"wait": wait}, base_url=base_url
+            )
+        except self._network_errors as e:
+            raise TransportError(str(e)) from e
+        _check_status(response, (200, 202))
+        return response.json()
+
+    def cancel(self, chat_id, message_id):
+        body = json.dumps({"chat_id": str(chat_id), "message_id": message_id})
+        try:
+            response = self.client.post_body(
+                "/cancel",
+                body,
+                headers={CHAT_ID_HEADER: str(chat_id)},
+                base_url=self._route(str(chat_id)),
+            )
+        except self._network_errors as e:
+            raise TransportError(str(e)) from e
+        _check_status(response)
+        return response.json()["cancelled"]
+
+    def delete_all_history(self, agent_request):
+        replicas = ServerConfig().replicas or (None,)
+        job_id = self._accept("/delete_all_history", agent_request, {}, replicas[0])
+        # The callback purges once; every other replica only drops its caches
+        for base_url in replicas[1:]:
+            self._post("/delete_all_history?scope=cache", agent_request, base_url)
+        return job_id
+
+    def delete_chat(self, agent_request):
+        headers = {CHAT_ID_HEADER: str(agent_request.chat_id)}
+        return self._accept(
+            "/delete_chat", agent_request, headers, self._route(agent_request.chat_id)
+        )
+
+    def close(self):
+        self.client.close()
+
+    def _post(
+        self, path: str, agent_request: AgentRequest, base_url: Optional[str] = None
+    ) -> None:
+        try:
+            response = self.client.post(path, agent_request, base_url=base_url)
+        except self._network_errors as e:
+            raise TransportError(str(e)) from e
+        _check_status(response)
+
+
+class UnixSocketTransport(HttpTransport):
+    """HttpTransport over the Unix domain socket uvicorn is bound to."""
+
+    def __init__(self):
+        from streamlit_view.http_client import UnixSocketClient
+
+        super().__init__(UnixSocketClient())
+
+
+_DONE = object()
+
+
+def _shed(e: AdmissionError) -> TransportError:
+    """The TransportError an HTTP client would see for a shed request."""
+    return TransportError(str(e), e.status_code, e.retry_after)
+
+
+def _merge(parts: Sequence[Callable[[], Iterator[Any]]]) -> Iterator[Any]:
+    """Drain several blocking iterators on threads, yielding items as they arrive."""
+    items: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+
+    def drain(part):
+        iterator = part()
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            iterator.close()
+            items.put(_DONE)
+
+    for part in parts:
+        threading.Thread(target=drain, args=(part,), daemon=True).start()
+    remaining = len(parts)
+    try:
+        while remaining:
+            item = items.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+class InProcessTransport(Transport):
+    """Calls the Dispatcher directly when the UI runs in the agent's process.
+
+    Requests and responses are handed over as objects, so nothing is encoded,
+    sent or validated. Work is scheduled on the event loop the server runs
+    on (see ``Dispatcher.bind_loop``) and the calling Streamlit thread blocks
+    on the result.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, timeout: Optional[float] = None):
+        self.dispatcher = dispatcher
+        self.timeout = timeout
+
+    def _run(self, coro, timeout: Optional[float] = None):
+        loop = self.dispatcher.loop
+        if loop is None or loop.is_closed():
+            coro.close()
+            raise TransportError("The in-process dispatcher is not running")
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            # Cancelling the future on timeout also drops the job (Dispatcher.wait)
+            return future.result(timeout or self.timeout or ServerConfig().timeout[1])
+        except AdmissionError as e:
+            raise _shed(e) from e
+        except QueueFullError as e:
+            raise TransportError(str(e), 503, 1.0) from e
+        except JobFailedError as e:
+            raise TransportError(str(e), 500) from e
+        except DeadlineExceededError as e:
+            raise TransportError(str(e), 504) from e
+        except JobCancelledError as e:
+            raise TransportError(str(e), CLIENT_CLOSED_STATUS) from e
+        except concurrent.futures.TimeoutError as e:
+            future.cancel()
+            raise TransportError("Timed out waiting for the agent", 504) from e
+
+    def send(
+        self,
+        agent_request,
+        message_id=None,
+        bypass_cache=False,
+        timings=None,
+        timeout=None,
+        context=None,
+    ):
+        timer = RequestTimer("inprocess")
+        response = self._run(
+            self.dispatcher.respond(
+                agent_request,
+                message_id,
+                read_cache=not bypass_cache,
+                timer=timer,
+                deadline=time.time() + timeout if timeout else None,
+                context=context,
+            ),
+            timeout,
+        )
+        timer.finish(RequestStatus.SUCCESS.code)
+        if timings is not None:
+            timings.update(timer.as_dict())
+        return response
+
+    def _iterate(self, source: Callable[[], Any]) -> Iterator[Any]:
+        """Consume the async iterator ``source()`` on the server loop from this thread."""
+        items: "queue.Queue" = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in source():
+                    items.put(item)
+            except Exception as e:
+                items.put(e)
+            items.put(_DONE)
+
+        loop = self.dispatcher.loop
+        if loop is None or loop.is_closed():
+            raise TransportError("The in-process dispatcher is not running")
+        future = asyncio.run_coroutine_threadsafe(pump(), loop)
+        try:
+            while True:
+                item = items.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, AdmissionError):
+                    raise _shed(item) from item
+                if isinstance(item, QueueFullError):
+                    raise TransportError(str(item), 503, 1.0) from item
+                if isinstance(item, Exception):
+                    raise TransportError(str(item)) from item
+                yield item
+        finally:
+            # Stops forwarding if the consumer gave up early
+            future.cancel()
+
+    def stream(
+        self,
+        agent_request,
+        message_id=None,
+        bypass_cache=False,
+        timings=None,
+        timeout=None,
+        context=None,
+    ):
+        deadline = time.time() + timeout if timeout else None
+
+        async def follow():
+            stream = await self.dispatcher.open_stream(
+                agent_request,
+                message_id,
+                read_cache=not bypass_cache,
+                deadline=deadline,
+                context=context,
+            )
+            # The shared stream keeps running for any other subscriber
+            async for chunk in stream.subscribe():
+                yield chunk
+
+        return self._iterate(follow)
+
+    def batch(self, agent_requests, concurrency, bypass_cache=False):
+        async def run():
+            admitted, release = self.dispatcher.admit_batch(concurrency)
+            try:
+                async for result in self.dispatcher.run_batch(
+                    enumerate(agent_requests), admitted, read_cache=not bypass_cache
+                ):
+                    yield result
+            finally:
+                release()
+
+        return self._iterate(run)
+
+    def submit(self, agent_request, message_id=None):
+        async def submit():
+            return self.dispatcher.submit(agent_request, message_id)
+
+        return self._run(submit()).job_id
+
+    def get_job(self, job_id, wait=0):
+        job_manager = self.dispatcher.job_manager
+
+        async def get_job():
+            job = job_manager.get(job_id)
+            if job is None:
+                raise TransportError("Unknown or expired job", 404)
+            if wait > 0 and not job.done:
+                try:
+                    await job_manager.wait(job, timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            return job.to_dict()
+
+        return self._run(get_job())
+
+    def cancel(self, chat_id, message_id):
+        async def cancel():
+            return self.dispatcher.cancel(str(chat_id), message_id)
+
+        return self._run(cancel())
+
+    def delete_all_history(self, agent_request):
+        return self._purge(agent_request)
+
+    def delete_chat(self, agent_request):
+        return self._purge(agent_request)
+
+    def _purge(self, agent_request):
+        async def purge():
+            return self.dispatcher.purge(agent_request)
+
+        return self._run(purge()).job_id
+
+
+_transport: Optional[Transport] = None
+_transport_lock = threading.Lock()
+
+
+def set_transport(transport: Optional[Transport]) -> None:
+    """Install the transport used by StreamlitView's client methods."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+
+def get_transport() -> Transport:
+    """The installed transport, or one built from ``ServerConfig().transport``."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                kind = ServerConfig().transport
+                if kind == HTTP_TRANSPORT:
+                    _transport = HttpTransport()
+                elif kind == UDS_TRANSPORT:
+                    _transport = UnixSocketTransport()
+                elif kind == INPROCESS_TRANSPORT:
+                    raise TransportError(
+                        "The in-process transport needs the agent in this process; "
+                        "start the app with StreamlitView.run_inprocess()"
+                    )
+                else:
+                    raise TransportError(f"Unknown transport: {kind}")
+    return _transport
@@ -1,17 +1,35 @@
 import os
 import subprocess
-import requests
+import sys
+import threading
+import time
 import logging
 import asyncio
-import uvicorn
-import uuid
-import json
-from typing import Callable, Dict, Any, Optional, Tuple, Union
-from fastapi import FastAPI
-from streamlit_view.view_configurations import define_endpoints, ServerConfig
+from typing import Callable, Dict, Any, Iterator, Optional, Sequence, Tuple, Union
+from streamlit_view.view_configurations import (
+    INPROCESS_TRANSPORT,
+    UDS_TRANSPORT,
+    define_endpoints,
+    ServerConfig,
+)
+from streamlit_view.admission import AdmissionController
+from streamlit_view.batch import DEFAULT_BATCH_CONCURRENCY, MAX_BATCH_SIZE, BatchResult
+from streamlit_view.context import ChatContext, build_context
+from streamlit_view.job_registry import JobRegistry
+from streamlit_view.jobs import JobManager
+from streamlit_view.messages import ChatMessage
+from streamlit_view.metrics import CLIENT_ROUND_TRIP_SECONDS, CONTEXT_TOKENS
+from streamlit_view.response_cache import ResponseCache
+from streamlit_view.streaming import StreamError
+from streamlit_view.transport import (
+    InProcessTransport,
+    TransportError,
+    get_transport,
+    set_transport,
+)
 
 # Todo: Need to create own schemas for views, and combine views into one repo
-from common_utils.schemas import AgentRequest, AgentResponse, RequestStatus
+from common_utils.schemas import AgentRequest, AgentResponse
 from common_utils.view.view_abc import BaseView
 from common_utils.logging import get_logger
 
@@ -31,10 +49,19 @@ class StreamlitView(BaseView):
         title="Streamlit Chatbot Interface",
         host="0.0.0.0",
         port=5051,
+        http_options: Optional[Dict[str, Any]] = None,
+        stream_callback: Optional[Callable] = None,
+        job_options: Optional[Dict[str, Any]] = None,
+        cache_options: Optional[Dict[str, Any]] = None,
+        admission_options: Optional[Dict[str, Any]] = None,
     ):
         logging.info(
             f"Initializing StreamlitView - host: {host}, port: {port}, title: {title}"
         )
+        # Server-only; the Streamlit process imports this module for the client
+        # methods and should not pay for FastAPI at startup
+        from fastapi import FastAPI
+
         self.config = config
         self.title = title
         self.app = FastAPI()
@@ -43,10 +70,45 @@ class StreamlitView(BaseView):
         self._host = host
         self._port = port
         
-        # Configure the server settings
-        ServerConfig().configure(host=host, port=port)
+        # Configure the server settings (pool size, timeouts and retries are
+        # optional and fall back to the ServerConfig defaults)
+        ServerConfig().configure(host=host, port=port, **(http_options or {}))
+
+        # Bounded queue + worker pool in front of the callback; with a shared
+        # state file, job status is visible to every replica
+        state_path = ServerConfig().state_path
+        self.job_manager = JobManager(
+            view_callback,
+            registry=JobRegistry(state_path) if state_path else None,
+            **(job_options or {}),
+        )
+
+        # The response cache is opt-in; it reuses answers within a chat unless
+        # {"scope": "global"} shares them across chats (FAQ-style agents only)
+        self.response_cache = (
+            ResponseCache(**cache_options) if cache_options is not None else None
+        )
 
-        define_endpoints(self.app, view_callback)
+        # Rate limits and load shedding are opt-in too, e.g.
+        # {"chat_rate": 1, "ip_rate": 5, "max_in_flight": 32}
+        self.admission = (
+            AdmissionController(**admission_options)
+            if admission_options is not None
+            else None
+        )
+
+        self.dispatcher = define_endpoints(
+            self.app,
+            view_callback,
+            stream_callback,
+            self.job_manager,
+            self.response_cache,
+            admission=self.admission,
+        )
+
+        # With the UI in this process its calls skip HTTP entirely
+        if ServerConfig().transport == INPROCESS_TRANSPORT:
+            set_transport(InProcessTransport(self.dispatcher))
 
     @property
     def host(self) -> str:
@@ -67,17 +129,31 @@ class StreamlitView(BaseView):
             title=config.title,
             host=config.fastapi.host,
             port=config.fastapi.port,
+            http_options=getattr(config, "http", None),
+            job_options=getattr(config, "jobs", None),
+            cache_options=getattr(config, "cache", None),
+            admission_options=getattr(config, "admission", None),
         )
 
     def run_streamlit(self):
         logger.info("Running Streamlit app")
         try:
             filename = os.path.join(os.path.dirname(__file__), self.config.ui_file)
-            command = ["streamlit", "run", filename, "--", "--title", self.title]
+            # Same as ``streamlit run``, but with the UI's imports preloaded
+            command = [
+                sys.executable,
+                "-m",
+                "streamlit_view.launcher",
+                filename,
+                "--",
+                "--title",
+                self.title,
+            ]
             env = os.environ.copy()
             env["PYTHONPATH"] = os.path.abspath(
                 os.path.join(os.path.dirname(__file__), "../../")
             )  # Set project root as PYTHONPATH
+            env.update(ServerConfig().to_env())
 
             subprocess.run(command, check=True, env=env)
         except subprocess.CalledProcessError as e:
@@ -85,71 +161,310 @@ class StreamlitView(BaseView):
 
     async def run_uvicorn(self) -> None:
         """Run the FastAPI server."""
-        logger.info(
-            "Starting FastAPI server", extra={"host": self.host, "port": self.port}
-        )
-        config = uvicorn.Config(
-            self.app, host=self.host, port=self.port, log_level="info", loop="asyncio"
-        )
+        import uvicorn
+
+        self.dispatcher.bind_loop()
+        server_config = ServerConfig()
+        if server_config.workers > 1:
+            await self.run_replicas()
+            return
+        if server_config.transport == UDS_TRANSPORT:
+            logger.info("Starting FastAPI server", extra={"uds": server_config.uds_path})
+            config = uvicorn.Config(
+                self.app, uds=server_config.uds_path, log_level="info", loop="asyncio"
+            )
+        else:
+            logger.info(
+                "Starting FastAPI server", extra={"host": self.host, "port": self.port}
+            )
+            config = uvicorn.Config(
+                self.app, host=self.host, port=self.port, log_level="info", loop="asyncio"
+            )
         server = uvicorn.Server(config)
         await server.serve()
 
+    async def run_replicas(self) -> None:
+        """Serve ``ServerConfig().workers`` replicas on consecutive ports.
+
+        uvicorn's own ``--workers`` share one socket and the kernel picks the
+        worker, which cannot keep a chat on one process. Separate ports let
+        clients pin each chat to a replica (see HttpTransport), and the job
+        registry at ``state_path`` lets any replica answer /jobs.
+        """
+        server_config = ServerConfig()
+        if not server_config.app_factory:
+            raise RuntimeError(
+                "Running more than one worker needs ServerConfig().app_factory "
+                "('module:function' returning the FastAPI app)"
+            )
+        env = os.environ.copy()
+        env.update(server_config.to_env())
+        processes = []
+        try:
+            for i in range(server_config.workers):
+                port = self.port + i
+                logger.info(
+                    "Starting FastAPI replica", extra={"host": self.host, "port": port}
+                )
+                processes.append(
+                    await asyncio.create_subprocess_exec(
+                        sys.executable,
+                        "-m",
+                        "uvicorn",
+                        server_config.app_factory,
+                        "--factory",
+                        "--host",
+                        self.host,
+                        "--port",
+                        str(port),
+                        "--loop",
+                        "asyncio",
+                        env=env,
+                    )
+                )
+            await asyncio.gather(*(process.wait() for process in processes))
+        finally:
+            for process in processes:
+                if process.returncode is None:
+                    process.terminate()
+                    await process.wait()
+
     def run_fastapi(self) -> asyncio.Task:
         """Start the FastAPI server."""
         return asyncio.create_task(self.run_uvicorn())
 
     async def run(self):
         """Run both FastAPI server and Streamlit application."""
+        if ServerConfig().transport == INPROCESS_TRANSPORT:
+            raise RuntimeError(
+                "The in-process transport runs Streamlit in this process; "
+                "call run_inprocess() instead of run()"
+            )
         fastapi_task = self.run_fastapi()
         streamlit_task = asyncio.create_task(asyncio.to_thread(self.run_streamlit))
 
         return await asyncio.gather(fastapi_task, streamlit_task)
 
+    def run_inprocess(self) -> None:
+        """Run the agent and the Streamlit UI in this process.
+
+        The FastAPI server (still serving /metrics, /jobs and external
+        clients) runs on a background thread, and Streamlit takes the main
+        thread, which it needs for its signal handlers. The UI reaches the
+        agent through the InProcessTransport installed in ``__init__``.
+        """
+        from streamlit.web import bootstrap
+
+        server_config = ServerConfig()
+        if server_config.transport != INPROCESS_TRANSPORT:
+            server_config.configure(
+                self.host, self.port, transport=INPROCESS_TRANSPORT
+            )
+            set_transport(InProcessTransport(self.dispatcher))
+
+        threading.Thread(
+            target=asyncio.run, args=(self.run_uvicorn(),), name="fastapi", daemon=True
+        ).start()
+
+        filename = os.path.join(os.path.dirname(__file__), self.config.ui_file)
+        logger.info("Running Streamlit app in-process")
+        bootstrap.run(filename, False, ["--title", self.title], {})
+
     @staticmethod
-    def send_message(chat_id: str, message: str) -> Union[AgentResponse, str]:
-        """Send user input to the FastAPI server and return a proper AgentResponse."""
-        logger.info(f"Sending user input for chat_id: {chat_id}")
+    def _context_for(
+        user_input: str,
+        history: Optional[Sequence[ChatMessage]],
+        context_report: Optional[Dict[str, int]],
+    ) -> Optional[ChatContext]:
+        """As much of ``history`` as the budget leaves room for next to ``user_input``."""
         server_config = ServerConfig()
-        logger.debug(f"posting to {server_config.base_url}/input")
+        if history is None or server_config.context_max_tokens <= 0:
+            return None
+        window = build_context(
+            history,
+            user_input,
+            server_config.context_max_tokens,
+            server_config.context_strategy,
+        )
+        CONTEXT_TOKENS.observe(window.total_tokens)
+        if context_report is not None:
+            context_report.update(window.report())
+        return window.context()
+
+    @staticmethod
+    def send_message(
+        user_input: str,
+        chat_id: str,
+        message_id: Optional[str] = None,
+        bypass_cache: bool = False,
+        timings: Optional[Dict[str, float]] = None,
+        history: Optional[Sequence[ChatMessage]] = None,
+        context_report: Optional[Dict[str, int]] = None,
+        timeout: Optional[float] = None,
+    ) -> Union[AgentResponse, str]:
+        """Send user input to the agent and return a proper AgentResponse.
+
+        Pass a dict as ``timings`` to have it filled with the server's stage
+        timings and the client round trip, in milliseconds. With a context
+        budget configured, ``history`` (earlier messages, oldest first) is
+        trimmed to it and sent next to the prompt (never inside it), and
+        ``context_report`` gets the token counts. ``timeout`` (default ``ServerConfig().request_timeout``) is
+        the turn's deadline in seconds; the server stops working on it then.
+        """
+        logger.info("Sending user input for chat_id: %s", chat_id)
         try:
-            # Create metadata with message_id
-            request = AgentRequest.text(
-                chat_id=str(chat_id), message=user_input
-            )
+            context = StreamlitView._context_for(user_input, history, context_report)
+            request = AgentRequest.text(chat_id=str(chat_id), message=user_input)
 
-            # Send request to FastAPI server
-            response = requests.post(
-                f"{server_config.base_url}/input",
-                json=json.loads(request.model_dump_json()),
+            started = time.perf_counter()
+            response = get_transport().send(
+                request,
+                message_id,
+                bypass_cache,
+                timings,
+                StreamlitView._timeout(timeout),
+                context,
             )
-
-            if response.status_code == RequestStatus.SUCCESS.code:
-                response_data = response.json()
-                return AgentResponse.model_validate_json(response_data["response"])
-            else:
-                return f"Error: Request failed with status code {response.status_code}"
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Network error: {e}")
+            round_trip = time.perf_counter() - started
+            CLIENT_ROUND_TRIP_SECONDS.observe(round_trip, endpoint="/input")
+            if timings is not None:
+                timings["round_trip"] = round(round_trip * 1000, 2)
+            return response
+        except TransportError as e:
+            logger.error(f"Transport error: {e}")
             return f"Error: {str(e)}"
         except Exception as e:
             logger.error(f"Error sending input: {e}")
             return f"Error: {str(e)}"
 
+    @staticmethod
+    def cancel_message(chat_id: str, message_id: str) -> bool:
+        """Stop generating the turn sent with ``message_id``, freeing the agent for others.
+
+        Returns False when there was nothing left to stop or the request failed.
+        """
+        logger.info("Cancelling message %s of chat_id: %s", message_id, chat_id)
+        try:
+            return get_transport().cancel(str(chat_id), message_id)
+        except Exception as e:
+            logger.error(f"Error cancelling message {message_id}: {e}")
+            return False
+
+    @staticmethod
+    def _timeout(timeout: Optional[float]) -> Optional[float]:
+        if timeout is None:
+            timeout = ServerConfig().request_timeout
+        return timeout or None
+
+    @staticmethod
+    def submit_message(
+        user_input: str, chat_id: str, message_id: Optional[str] = None
+    ) -> str:
+        """Queue user input without waiting for the answer; returns the job id."""
+        logger.info(f"Submitting user input for chat_id: {chat_id}")
+        try:
+            request = AgentRequest.text(chat_id=str(chat_id), message=user_input)
+            return get_transport().submit(request, message_id)
+        except Exception as e:
+            logger.error(f"Error submitting input: {e}")
+            return f"Error: {str(e)}"
+
+    @staticmethod
+    def get_job(job_id: str, wait: float = 0) -> Union[Dict[str, Any], str]:
+        """Fetch a job's status, long-polling up to ``wait`` seconds for it to finish."""
+        try:
+            return get_transport().get_job(job_id, wait)
+        except Exception as e:
+            logger.error(f"Error fetching job {job_id}: {e}")
+            return f"Error: {str(e)}"
+
+    @staticmethod
+    def stream_message(
+        user_input: str,
+        chat_id: str,
+        message_id: Optional[str] = None,
+        bypass_cache: bool = False,
+        timings: Optional[Dict[str, float]] = None,
+        history: Optional[Sequence[ChatMessage]] = None,
+        context_report: Optional[Dict[str, int]] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator[str]:
+        """Send user input and yield the response text as it is generated.
+
+        Meant to be passed straight to ``st.write_stream``. Raises StreamError
+        when the request fails, including failures after the first chunk.
+        ``timings`` works as in send_message and also gets ``first_chunk``;
+        ``history``, ``context_report`` and ``timeout`` work as in
+        send_message. Closing the generator early abandons the turn, and
+        the server stops it unless another request follows it too.
+        """
+        logger.info("Streaming user input for chat_id: %s", chat_id)
+        context = StreamlitView._context_for(user_input, history, context_report)
+        request = AgentRequest.text(chat_id=str(chat_id), message=user_input)
+        started = time.perf_counter()
+        first_chunk = None
+        try:
+            for chunk in get_transport().stream(
+                request,
+                message_id,
+                bypass_cache,
+                timings,
+                StreamlitView._timeout(timeout),
+                context,
+            ):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                if chunk.message:
+                    yield chunk.message
+        except TransportError as e:
+            logger.error(f"Transport error: {e}")
+            raise StreamError(str(e), e.retry_after) from e
+        round_trip = time.perf_counter() - started
+        CLIENT_ROUND_TRIP_SECONDS.observe(round_trip, endpoint="/input/stream")
+        if timings is not None:
+            timings["round_trip"] = round(round_trip * 1000, 2)
+            if first_chunk is not None:
+                timings["client_first_chunk"] = round(first_chunk * 1000, 2)
+
+    @staticmethod
+    def send_batch(
+        agent_requests: Sequence[AgentRequest],
+        concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+        bypass_cache: bool = False,
+    ) -> Iterator[BatchResult]:
+        """Send many requests at once and yield each result as it finishes.
+
+        Results arrive in completion order; ``BatchResult.index`` is the
+        request's position in ``agent_requests``. A failed item carries its
+        error instead of a response. Raises StreamError if the batch as a
+        whole fails.
+        """
+        logger.info("Sending a batch of %d requests", len(agent_requests))
+        started = time.perf_counter()
+        try:
+            # Larger inputs go over as several batches, one after another
+            for offset in range(0, len(agent_requests), MAX_BATCH_SIZE):
+                part = agent_requests[offset:offset + MAX_BATCH_SIZE]
+                for result in get_transport().batch(part, concurrency, bypass_cache):
+                    yield result._replace(index=result.index + offset)
+        except TransportError as e:
+            logger.error(f"Transport error: {e}")
+            raise StreamError(str(e)) from e
+        CLIENT_ROUND_TRIP_SECONDS.observe(
+            time.perf_counter() - started, endpoint="/input/batch"
+        )
+
     @staticmethod
     def delete_all_history():
         """Delete all chat history."""
         try:
-            server_config = ServerConfig()
-            agent_request = AgentRequest.delete_history()
-            response = requests.post(
-                f"{server_config.base_url}/delete_all_history",
-                json=json.loads(agent_request.model_dump_json()),
-            )
-
-            if response.status_code == RequestStatus.SUCCESS.code:
-                return "History deleted successfully"
-            else:
-                return f"Error: Failed to delete history (code: {response.status_code})"
+            job_id = get_transport().delete_all_history(AgentRequest.delete_history())
+            # The purge runs in the background; get_job(job_id) reports on it
+            return f"History deletion started (job: {job_id})"
+        except TransportError as e:
+            if e.status_code is not None:
+                return f"Error: Failed to delete history (code: {e.status_code})"
+            return f"Error: {str(e)}"
         except Exception as e:
             logger.error(f"Error deleting history: {e}")
             return f"Error: {str(e)}"
@@ -158,17 +473,13 @@ class StreamlitView(BaseView):
     def delete_chat(chat_id):
         """Delete chat history for a specific chat."""
         try:
-            server_config = ServerConfig()
             agent_request = AgentRequest.delete_entries_by_chat_id(chat_id=str(chat_id))
-            response = requests.post(
-                f"{server_config.base_url}/delete_chat",
-                json=json.loads(agent_request.model_dump_json()),
-            )
-
-            if response.status_code == RequestStatus.SUCCESS.code:
-                return "Chat deleted successfully"
-            else:
-                return f"Error: Failed to delete chat (code: {response.status_code})"
+            job_id = get_transport().delete_chat(agent_request)
+            return f"Chat deletion started (job: {job_id})"
+        except TransportError as e:
+            if e.status_code is not None:
+                return f"Error: Failed to delete chat (code: {e.status_code})"
+            return f"Error: {str(e)}"
         except Exception as e:
             logger.error(f"Error deleting chat: {e}")
             return f"Error: {str(e)}"
@@ -1,91 +1,594 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
 import logging
-from pydantic import ValidationError
 import json
 import os
 import sys
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+# FastAPI is imported inside define_endpoints: the Streamlit process only
+# needs ServerConfig from this module and should not pay for it at startup
+if TYPE_CHECKING:
+    from fastapi import Request
 
 
 from common_utils.schemas import AgentRequest, AgentResponse, RequestStatus
+from streamlit_view.admission import AdmissionError
+from streamlit_view.batch import (
+    MAX_BATCH_SIZE,
+    BatchResult,
+    clamp_concurrency,
+    encode_result,
+)
+from streamlit_view.chat_store import SYNC_MODES
+from streamlit_view.context import CONTEXT_STRATEGIES, WINDOW_STRATEGY, ChatContext
+from streamlit_view.dispatcher import (
+    DeadlineExceededError,
+    Dispatcher,
+    JobCancelledError,
+    JobFailedError,
+)
+from streamlit_view.envelope import compress, encode_response, envelope_headers, negotiate
+from streamlit_view.jobs import FINISHED_STATUSES, QueueFullError
+from streamlit_view.metrics import (
+    IN_FLIGHT,
+    PROMETHEUS_CONTENT_TYPE,
+    QUEUE_DEPTH,
+    REGISTRY,
+    STAGE_SECONDS,
+    RequestTimer,
+)
+from streamlit_view.streaming import (
+    DONE,
+    ERROR,
+    NDJSON_MEDIA_TYPE,
+    StreamCancelledError,
+    encode_chunk,
+    encode_line,
+)
 
 
 logger = logging.getLogger(__name__)
 
+ENV_PREFIX = "STREAMLIT_VIEW_"
+
+# Carries the UI's message_id so duplicate posts of one turn are coalesced
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# Set by clients that want per-stage timings back (Server-Timing / done line)
+TIMING_HEADER = "X-Request-Timing"
+# Seconds the client will wait for the answer; relative, so the client's and
+# server's clocks need not agree. The server gives up on the turn after it.
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+# Status logged for requests whose client went away first (nginx's convention)
+CLIENT_CLOSED_STATUS = 499
+
+HTTP_TRANSPORT = "http"
+UDS_TRANSPORT = "uds"
+INPROCESS_TRANSPORT = "inprocess"
+TRANSPORTS = (HTTP_TRANSPORT, UDS_TRANSPORT, INPROCESS_TRANSPORT)
+DEFAULT_UDS_PATH = "/tmp/streamlit_view.sock"
+
+# How the UI partitions chat history between visitors
+SHARED_NAMESPACE_MODE = "shared"
+USER_NAMESPACE_MODE = "user"
+SESSION_NAMESPACE_MODE = "session"
+NAMESPACE_MODES = (SHARED_NAMESPACE_MODE, USER_NAMESPACE_MODE, SESSION_NAMESPACE_MODE)
+
+# Body field carrying the trimmed history next to the AgentRequest's own
+# fields, so the prompt in "message" reaches the agent unchanged
+CONTEXT_FIELD = "context"
+
+# Lets a load balancer hash on the chat (e.g. nginx ``hash $http_x_chat_id``)
+CHAT_ID_HEADER = "X-Chat-Id"
+
+LEGACY_RESPONSE_FORMAT = "legacy"
+V2_RESPONSE_FORMAT = "v2"
+RESPONSE_FORMATS = (LEGACY_RESPONSE_FORMAT, V2_RESPONSE_FORMAT)
+
+
+def _prefers_async(request: "Request") -> bool:
+    """True when the client asked for a 202 + job id (RFC 7240 respond-async)."""
+    return "respond-async" in request.headers.get("prefer", "").lower()
+
+
+def _cache_policy(request: "Request") -> Tuple[bool, bool]:
+    """(may read, may write) the response cache, per the request's Cache-Control."""
+    cache_control = request.headers.get("cache-control", "").lower()
+    if "no-store" in cache_control:
+        return False, False
+    return "no-cache" not in cache_control, True
+
+
+def _deadline(request: "Request") -> Optional[float]:
+    """The ``time.time()`` by which the client stops waiting, from its timeout header."""
+    timeout = request.headers.get(REQUEST_TIMEOUT_HEADER)
+    if not timeout:
+        return None
+    try:
+        seconds = float(timeout)
+    except ValueError:
+        logger.warning("Ignoring malformed %s: %s", REQUEST_TIMEOUT_HEADER, timeout)
+        return None
+    return time.time() + seconds if seconds > 0 else None
+
+
+def _pop_context(data) -> Optional[ChatContext]:
+    """Take the history sent next to the prompt out of a request body.
+
+    Raises ValueError when it is malformed.
+    """
+    raw = data.pop(CONTEXT_FIELD, None) if isinstance(data, dict) else None
+    return ChatContext.from_dict(raw) if raw is not None else None
+
+
+async def _until_disconnected(request: "Request") -> None:
+    # The body has been read, so the next ASGI message is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before its answer was ready."""
+
+
+async def _unless_disconnected(request: "Request", coro):
+    """Await ``coro``, cancelling it if the client disconnects first."""
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(_until_disconnected(request))
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise ClientDisconnected()
+    return task.result()
+
+
+def _wants_timing(request: "Request") -> bool:
+    return request.headers.get(TIMING_HEADER, "").lower() in ("1", "true", "yes")
+
+
+def _timed_response(timer, request, content, status_code=200, headers=None):
+    """JSONResponse that carries Server-Timing when the client asked for it."""
+    from fastapi.responses import JSONResponse
+
+    headers = dict(headers or {})
+    if _wants_timing(request):
+        headers["Server-Timing"] = timer.server_timing()
+    return JSONResponse(content, status_code=status_code, headers=headers)
+
+
+def _envelope_response(timer, request, agent_response, headers=None):
+    """Successful /input result in the format and encoding the client accepts."""
+    from fastapi.responses import Response
+
+    with timer.stage("serialize"):
+        media_type = negotiate(request.headers.get("accept"))
+        body, encoding = compress(
+            encode_response(agent_response, media_type),
+            request.headers.get("accept-encoding"),
+            ServerConfig().compress_min_size,
+        )
+    headers = {**envelope_headers(media_type, encoding), **(headers or {})}
+    if _wants_timing(request):
+        headers["Server-Timing"] = timer.server_timing()
+    return Response(body, headers=headers)
+
+
+def _releasing_stream(content, release):
+    """NDJSON StreamingResponse that calls ``release`` however the response ends.
+
+    A body generator's own ``finally`` never runs when the client goes away
+    before Starlette first iterates it, so it cannot be trusted to give
+    admission slots back.
+    """
+    from fastapi.responses import StreamingResponse
+
+    class ReleasingResponse(StreamingResponse):
+        async def __call__(self, scope, receive, send):
+            try:
+                await super().__call__(scope, receive, send)
+            finally:
+                release()
+
+    return ReleasingResponse(content, media_type=NDJSON_MEDIA_TYPE)
+
+
+def define_endpoints(
+    app,
+    view_callback,
+    stream_callback=None,
+    job_manager=None,
+    response_cache=None,
+    dispatcher=None,
+    admission=None,
+):
+    """Register the HTTP API on ``app`` and return the Dispatcher behind it."""
+    from fastapi import HTTPException, Request
+    from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+    from pydantic import ValidationError
+
+    if dispatcher is None:
+        dispatcher = Dispatcher(
+            view_callback, stream_callback, job_manager, response_cache, admission
+        )
+    job_manager = dispatcher.job_manager
+    response_cache = dispatcher.response_cache
+    admission = dispatcher.admission
+    app.state.dispatcher = dispatcher
+    app.state.job_manager = job_manager
+    app.state.response_cache = response_cache
+
+    QUEUE_DEPTH.set_function(lambda: job_manager.queue_depth)
+    IN_FLIGHT.set_function(lambda: job_manager.in_flight)
+
+    def client_ip(request: Request) -> Optional[str]:
+        return admission.client_ip(request) if admission is not None else None
+
+    def shed(e: AdmissionError) -> HTTPException:
+        """Fast 429/503 for a request admission control turned away."""
+        logger.info("Shedding request: %s", e)
+        return HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": e.retry_after_header},
+        )
+
+    async def read_json(request: Request, timer: Optional[RequestTimer] = None):
+        """The parsed request body; a 400 when it is not JSON."""
+        try:
+            return await request.json()
+        except ValueError as e:
+            if timer is not None:
+                timer.finish(400)
+            raise HTTPException(status_code=400, detail=f"Malformed JSON body: {e}")
+
+    async def read_object(request: Request, timer: Optional[RequestTimer] = None) -> dict:
+        """The parsed request body; a 400 unless it is a JSON object."""
+        data = await read_json(request, timer)
+        if not isinstance(data, dict):
+            if timer is not None:
+                timer.finish(400)
+            raise HTTPException(status_code=400, detail="Expected a JSON object")
+        return data
 
-def define_endpoints(app, view_callback):
     @app.post("/input")
     async def receive_input(request: Request):
+        timer = RequestTimer("/input")
+        status_code = 500
         try:
-            data = await request.json()
-            logger.info(f"Processing input request - chat_id: {data.get('chat_id')}, message: {data.get('message', '')}")
+            with timer.stage("parse"):
+                data = await read_object(request, timer)
+            logger.debug("Processing input request - chat_id: %s", data.get("chat_id"))
 
             try:
-                agent_request = AgentRequest.model_validate(data)
+                with timer.stage("validate"):
+                    context = _pop_context(data)
+                    agent_request = AgentRequest.model_validate(data)
             except ValidationError as e:
-                logger.error(f"Invalid request format: {e}")
+                logger.error("Invalid request format: %s", e)
                 raise HTTPException(
                     status_code=400,
                     detail=f"Invalid request format: {str(e)}",
                 )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid context: {e}")
 
-            # Get response directly from agent
-            agent_response = await view_callback(agent_request)
-            
-            logger.debug(f"Agent response: {agent_response}")
+            read_cache, write_cache = _cache_policy(request)
+            if response_cache is not None and read_cache:
+                with timer.stage("cache"):
+                    cached = await dispatcher.lookup_cache(agent_request)
+                if cached is not None:
+                    status_code = 200
+                    return _envelope_response(
+                        timer, request, cached, headers={"X-Cache": "HIT"}
+                    )
 
-            # Handle None response by creating a pending response
-            if agent_response is None:
-                agent_response = AgentResponse(
-                    chat_id=agent_request.chat_id,  # Use chat_id from request
-                    message="Request received and queued for processing",
+            try:
+                job = dispatcher.submit(
+                    agent_request,
+                    request.headers.get(IDEMPOTENCY_HEADER),
+                    write_cache,
+                    client_ip(request),
+                    _deadline(request),
+                    context,
+                )
+            except AdmissionError as e:
+                raise shed(e)
+            except QueueFullError as e:
+                logger.warning("Rejecting input request: %s", e)
+                raise HTTPException(
+                    status_code=503, detail=str(e), headers={"Retry-After": "1"}
                 )
-            logger.debug(f"Agent response now: {agent_response}")
 
-            return JSONResponse(
-                {"status": "success", "response": agent_response.model_dump_json()},
-                status_code=200,
-            )
-        except HTTPException:
+            if _prefers_async(request):
+                # Caller polls /jobs/{job_id} instead of holding the connection
+                status_code = 202
+                return _timed_response(
+                    timer,
+                    request,
+                    {"status": "accepted", "job_id": job.job_id},
+                    status_code=202,
+                    headers={"Location": f"/jobs/{job.job_id}"},
+                )
+
+            try:
+                # A client that goes away takes its job with it
+                agent_response = await _unless_disconnected(
+                    request, dispatcher.wait(job, timer)
+                )
+            except JobFailedError as e:
+                raise HTTPException(status_code=500, detail=str(e))
+            except DeadlineExceededError as e:
+                raise HTTPException(status_code=504, detail=str(e))
+            except JobCancelledError as e:
+                raise HTTPException(status_code=CLIENT_CLOSED_STATUS, detail=str(e))
+            except ClientDisconnected:
+                logger.info("Client went away; dropped job %s", job.job_id)
+                raise HTTPException(
+                    status_code=CLIENT_CLOSED_STATUS, detail="Client disconnected"
+                )
+            logger.debug("Agent response: %s", agent_response)
+
+            status_code = 200
+            return _envelope_response(timer, request, agent_response)
+        except HTTPException as e:
+            status_code = e.status_code
             raise
         except Exception as e:
-            logger.error(f"Error processing input: {e}", exc_info=True)
+            logger.error("Error processing input: %s", e, exc_info=True)
             # Create an error response instead of raising an exception
             raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            timer.finish(status_code)
+
+    @app.post("/input/stream")
+    async def receive_input_stream(request: Request):
+        """Same as /input, but forwards partial responses as NDJSON lines."""
+        timer = RequestTimer("/input/stream")
+        with timer.stage("parse"):
+            data = await read_object(request, timer)
+        logger.debug("Processing streaming input request - chat_id: %s", data.get("chat_id"))
+
+        try:
+            with timer.stage("validate"):
+                context = _pop_context(data)
+                agent_request = AgentRequest.model_validate(data)
+        except ValidationError as e:
+            logger.error("Invalid request format: %s", e)
+            timer.finish(400)
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid request format: {str(e)}",
+            )
+        except ValueError as e:
+            timer.finish(400)
+            raise HTTPException(status_code=400, detail=f"Invalid context: {e}")
+
+        read_cache, write_cache = _cache_policy(request)
+        try:
+            stream = await dispatcher.open_stream(
+                agent_request,
+                request.headers.get(IDEMPOTENCY_HEADER),
+                read_cache,
+                write_cache,
+                client_ip(request),
+                _deadline(request),
+                context,
+            )
+        except AdmissionError as e:
+            timer.finish(e.status_code)
+            raise shed(e)
+        except QueueFullError as e:
+            logger.warning("Rejecting streaming request: %s", e)
+            timer.finish(503)
+            raise HTTPException(
+                status_code=503, detail=str(e), headers={"Retry-After": "1"}
+            )
+        include_timings = _wants_timing(request)
+
+        async def body():
+            started = time.perf_counter()
+            first_chunk = True
+            try:
+                async for chunk in stream.subscribe():
+                    if first_chunk:
+                        timer.record("first_chunk", time.perf_counter() - started)
+                        first_chunk = False
+                    yield encode_chunk(chunk)
+                timer.record("callback", time.perf_counter() - started)
+                timer.finish(200)
+                if include_timings:
+                    yield encode_line(DONE, timings=timer.as_dict())
+                else:
+                    yield encode_line(DONE)
+            except StreamCancelledError as e:
+                logger.info("Stream stopped: %s", e)
+                timer.finish(504 if e.expired else CLIENT_CLOSED_STATUS)
+                yield encode_line(ERROR, detail=str(e))
+            except (GeneratorExit, asyncio.CancelledError):
+                # The client disconnected mid-stream
+                timer.finish(CLIENT_CLOSED_STATUS)
+                raise
+            except Exception as e:
+                # Headers are already sent, so report the failure in-band
+                logger.error("Error streaming response: %s", e, exc_info=True)
+                timer.finish(500)
+                yield encode_line(ERROR, detail=str(e))
+
+        return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+    @app.post("/input/batch")
+    async def receive_input_batch(request: Request):
+        """Run many requests through the callback, streaming NDJSON results as they finish.
+
+        The body is ``{"requests": [AgentRequest, ...], "concurrency": N}``.
+        Each result line carries its request's index; invalid or failing
+        items get a "failed" line and the batch carries on.
+        """
+        timer = RequestTimer("/input/batch")
+        with timer.stage("parse"):
+            data = await read_json(request, timer)
+        if isinstance(data, list):
+            data = {"requests": data}
+        raw_requests = data.get("requests") if isinstance(data, dict) else None
+        if not isinstance(raw_requests, list):
+            timer.finish(400)
+            raise HTTPException(status_code=400, detail="Expected a list of requests")
+        if len(raw_requests) > MAX_BATCH_SIZE:
+            timer.finish(413)
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {MAX_BATCH_SIZE} requests per batch",
+            )
+
+        invalid = []
+        valid = []
+        with timer.stage("validate"):
+            for index, raw in enumerate(raw_requests):
+                try:
+                    valid.append((index, AgentRequest.model_validate(raw)))
+                except ValidationError as e:
+                    chat_id = raw.get("chat_id") if isinstance(raw, dict) else None
+                    invalid.append(
+                        BatchResult(index, chat_id, None, f"Invalid request format: {e}", {})
+                    )
+        logger.debug(
+            "Processing batch of %d requests (%d invalid)", len(raw_requests), len(invalid)
+        )
+
+        read_cache, write_cache = _cache_policy(request)
+        try:
+            concurrency = clamp_concurrency(data.get("concurrency"))
+        except (TypeError, ValueError, OverflowError):
+            timer.finish(400)
+            raise HTTPException(status_code=400, detail="Invalid concurrency")
+        try:
+            concurrency, release = dispatcher.admit_batch(concurrency, client_ip(request))
+        except AdmissionError as e:
+            timer.finish(e.status_code)
+            raise shed(e)
+
+        async def body():
+            failed = len(invalid)
+            try:
+                for result in invalid:
+                    yield encode_result(result)
+                async for result in dispatcher.run_batch(
+                    valid, concurrency, read_cache, write_cache
+                ):
+                    for stage, ms in result.timings.items():
+                        STAGE_SECONDS.observe(ms / 1000, endpoint="/input/batch", stage=stage)
+                    failed += result.error is not None
+                    yield encode_result(result)
+                timer.finish(200)
+                yield encode_line(DONE, count=len(raw_requests), failed=failed)
+            except Exception as e:
+                logger.error("Error running batch: %s", e, exc_info=True)
+                timer.finish(500)
+                yield encode_line(ERROR, detail=str(e))
+            except (GeneratorExit, asyncio.CancelledError):
+                timer.finish(CLIENT_CLOSED_STATUS)
+                raise
+            finally:
+                release()
+
+        return _releasing_stream(body(), release)
+
+    @app.post("/cancel")
+    async def cancel(request: Request):
+        """Stop a turn, queued, running or streaming: ``{"chat_id", "message_id"}``."""
+        data = await read_object(request)
+        if data.get("chat_id") is None:
+            raise HTTPException(status_code=400, detail="No chat ID provided")
+        if not data.get("message_id"):
+            raise HTTPException(status_code=400, detail="No message ID provided")
+        cancelled = dispatcher.cancel(str(data["chat_id"]), str(data["message_id"]))
+        return JSONResponse({"cancelled": cancelled}, status_code=200)
+
+    @app.get("/metrics")
+    async def metrics():
+        """Prometheus text exposition of the latency histograms and gauges."""
+        return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.get("/jobs/{job_id}")
+    async def job_status(job_id: str, wait: float = 0):
+        """Status of a queued job; ``wait`` long-polls up to that many seconds."""
+        job = job_manager.get(job_id)
+        if job is None and job_manager.registry is not None:
+            # Queued on another replica; answer from the shared registry
+            if wait > 0:
+                data = await job_manager.registry.wait(job_id, timeout=wait)
+            else:
+                data = await job_manager.registry.fetch(job_id)
+            if data is not None:
+                done = data["status"] in (status.value for status in FINISHED_STATUSES)
+                return JSONResponse(data, status_code=200 if done else 202)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+        if wait > 0 and not job.done:
+            try:
+                await job_manager.wait(job, timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+        return JSONResponse(job.to_dict(), status_code=200 if job.done else 202)
+
+    @app.get("/cache/stats")
+    async def cache_stats():
+        if response_cache is None:
+            return JSONResponse({"enabled": False}, status_code=200)
+        return JSONResponse({"enabled": True, **response_cache.stats()}, status_code=200)
+
+    def accept_purge(agent_request: AgentRequest, request: Request):
+        job = dispatcher.purge(agent_request, request.headers.get(IDEMPOTENCY_HEADER))
+        # Large purges take a while; the caller polls /jobs/{job_id} if it cares
+        return JSONResponse(
+            {"status": "accepted", "job_id": job.job_id},
+            status_code=202,
+            headers={"Location": f"/jobs/{job.job_id}"},
+        )
 
     @app.post("/delete_all_history")
     async def delete_history(request: Request):
         try:
-            # For now, just return success - we'll implement this later
-            return JSONResponse(
-                {"status": "success", "message": "Chat history deleted"},
-                status_code=200,
-            )
+            if request.query_params.get("scope") == "cache":
+                # Sent to the replicas that do not run the purge themselves
+                dispatcher.clear_caches()
+                return JSONResponse(
+                    {"status": "success", "message": "Caches cleared"},
+                    status_code=200,
+                )
+
+            agent_request = AgentRequest.delete_history()
+            return accept_purge(agent_request, request)
         except Exception as e:
             logger.error(f"Error deleting history: {e}")
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.post("/delete_chat")
     async def delete_chat(request: Request):
+        data = await read_object(request)
         try:
-            data = await request.json()
-
             agent_request = AgentRequest.model_validate(data)
-
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid request format: {e}")
+        try:
             if not agent_request.chat_id:
                 raise HTTPException(status_code=400, detail="No chat ID provided")
 
-            # For now, just return success - we'll implement this later
-            return JSONResponse(
-                {"status": "success", "message": "Chat deleted"},
-                status_code=200,
-            )
+            return accept_purge(agent_request, request)
         except HTTPException:
             raise
         except Exception as e:
             logger.error(f"Error deleting chat: {e}")
             raise HTTPException(status_code=500, detail=str(e))
 
+    return dispatcher
+
 
 class ServerConfig:
     _instance = None
@@ -98,8 +601,68 @@ class ServerConfig:
 
     def __init__(self):
         if not self._initialized:
-            self._host = "localhost"
-            self._port = 5051
+            # The Streamlit UI runs in its own interpreter, so every setting can
+            # also be seeded from the environment written by ``to_env``.
+            self._host = os.environ.get(f"{ENV_PREFIX}HOST", "localhost")
+            self._port = int(os.environ.get(f"{ENV_PREFIX}PORT", 5051))
+            self._pool_connections = int(
+                os.environ.get(f"{ENV_PREFIX}POOL_CONNECTIONS", 4)
+            )
+            self._pool_maxsize = int(os.environ.get(f"{ENV_PREFIX}POOL_MAXSIZE", 32))
+            self._connect_timeout = float(
+                os.environ.get(f"{ENV_PREFIX}CONNECT_TIMEOUT", 3.05)
+            )
+            self._read_timeout = float(
+                os.environ.get(f"{ENV_PREFIX}READ_TIMEOUT", 300.0)
+            )
+            self._request_timeout = float(
+                os.environ.get(f"{ENV_PREFIX}REQUEST_TIMEOUT", 300.0)
+            )
+            self._max_retries = int(os.environ.get(f"{ENV_PREFIX}MAX_RETRIES", 3))
+            self._backoff_factor = float(
+                os.environ.get(f"{ENV_PREFIX}BACKOFF_FACTOR", 0.3)
+            )
+            self._show_timings = os.environ.get(f"{ENV_PREFIX}SHOW_TIMINGS", "0") == "1"
+            self._compress_min_size = int(
+                os.environ.get(f"{ENV_PREFIX}COMPRESS_MIN_SIZE", 4096)
+            )
+            self._response_format = os.environ.get(
+                f"{ENV_PREFIX}RESPONSE_FORMAT", V2_RESPONSE_FORMAT
+            )
+            self._transport = os.environ.get(f"{ENV_PREFIX}TRANSPORT", HTTP_TRANSPORT)
+            self._uds_path = os.environ.get(f"{ENV_PREFIX}UDS_PATH", DEFAULT_UDS_PATH)
+            self._workers = int(os.environ.get(f"{ENV_PREFIX}WORKERS", 1))
+            self._app_factory = os.environ.get(f"{ENV_PREFIX}APP_FACTORY") or None
+            self._replicas = tuple(
+                url.strip().rstrip("/")
+                for url in os.environ.get(f"{ENV_PREFIX}REPLICAS", "").split(",")
+                if url.strip()
+            )
+            self._state_path = os.environ.get(f"{ENV_PREFIX}STATE_PATH") or None
+            self._namespace_mode = os.environ.get(
+                f"{ENV_PREFIX}NAMESPACE_MODE", SHARED_NAMESPACE_MODE
+            )
+            self._profile_startup = (
+                os.environ.get(f"{ENV_PREFIX}PROFILE_STARTUP", "0") == "1"
+            )
+            self._message_cache_bytes = int(
+                os.environ.get(f"{ENV_PREFIX}MESSAGE_CACHE_BYTES", 32 * 1024 * 1024)
+            )
+            self._show_memory = os.environ.get(f"{ENV_PREFIX}SHOW_MEMORY", "0") == "1"
+            self._context_max_tokens = int(
+                os.environ.get(f"{ENV_PREFIX}CONTEXT_MAX_TOKENS", 0)
+            )
+            self._context_strategy = os.environ.get(
+                f"{ENV_PREFIX}CONTEXT_STRATEGY", WINDOW_STRATEGY
+            )
+            self._persist_interval = float(
+                os.environ.get(f"{ENV_PREFIX}PERSIST_INTERVAL", 0.0)
+            )
+            self._persist_batch_size = int(
+                os.environ.get(f"{ENV_PREFIX}PERSIST_BATCH_SIZE", 100)
+            )
+            self._persist_sync = os.environ.get(f"{ENV_PREFIX}PERSIST_SYNC", "normal")
+            self._ui_metrics_port = int(os.environ.get(f"{ENV_PREFIX}UI_METRICS_PORT", 0))
             self._initialized = True
 
     @property
@@ -110,9 +673,269 @@ class ServerConfig:
     def port(self) -> int:
         return self._port
 
-    def configure(self, host: str, port: int):
+    @property
+    def pool_connections(self) -> int:
+        return self._pool_connections
+
+    @property
+    def pool_maxsize(self) -> int:
+        return self._pool_maxsize
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        """(connect, read) timeout tuple in the form ``requests`` expects."""
+        return (self._connect_timeout, self._read_timeout)
+
+    @property
+    def request_timeout(self) -> float:
+        """Seconds a turn may take end to end before the server gives up on it; 0 for no limit."""
+        return self._request_timeout
+
+    @property
+    def max_retries(self) -> int:
+        return self._max_retries
+
+    @property
+    def backoff_factor(self) -> float:
+        return self._backoff_factor
+
+    @property
+    def show_timings(self) -> bool:
+        """Whether the UI asks for and displays per-request timings."""
+        return self._show_timings
+
+    @property
+    def compress_min_size(self) -> int:
+        """Smallest /input body the server compresses; negative disables it."""
+        return self._compress_min_size
+
+    @property
+    def response_format(self) -> str:
+        """/input format the client asks for: "v2" or "legacy"."""
+        return self._response_format
+
+    @property
+    def transport(self) -> str:
+        """How the UI reaches the agent: "http", "uds" or "inprocess"."""
+        return self._transport
+
+    @property
+    def uds_path(self) -> str:
+        return self._uds_path
+
+    @property
+    def workers(self) -> int:
+        """Number of server replicas ``run_uvicorn`` starts (ports port..port+workers-1)."""
+        return self._workers
+
+    @property
+    def app_factory(self) -> Optional[str]:
+        """``"module:function"`` returning the FastAPI app, needed when workers > 1.
+
+        Each replica is a fresh interpreter, so the view callback has to be
+        rebuilt there, typically by ``StreamlitView.from_config(...).app``.
+        """
+        return self._app_factory
+
+    @property
+    def replicas(self) -> Tuple[str, ...]:
+        """Base URLs clients spread chats over; empty means just ``base_url``."""
+        if self._replicas:
+            return self._replicas
+        if self._workers > 1:
+            return tuple(
+                f"http://{self._host}:{self._port + i}" for i in range(self._workers)
+            )
+        return ()
+
+    @property
+    def state_path(self) -> Optional[str]:
+        """SQLite file holding the job registry shared by all replicas."""
+        return self._state_path
+
+    @property
+    def namespace_mode(self) -> str:
+        """Whether the UI keeps one history for everyone ("shared"), one per
+        signed-in user ("user") or one per browser session ("session")."""
+        return self._namespace_mode
+
+    @property
+    def profile_startup(self) -> bool:
+        """Whether the UI launcher reports per-module import times."""
+        return self._profile_startup
+
+    @property
+    def message_cache_bytes(self) -> int:
+        """Budget for message bodies the UI process keeps in memory, shared by all sessions."""
+        return self._message_cache_bytes
+
+    @property
+    def show_memory(self) -> bool:
+        """Whether the UI displays its session and message cache memory use."""
+        return self._show_memory
+
+    @property
+    def context_max_tokens(self) -> int:
+        """Token budget for history sent with each prompt; 0 sends the prompt alone."""
+        return self._context_max_tokens
+
+    @property
+    def context_strategy(self) -> str:
+        """How history over the budget is cut: "window" or "summary"."""
+        return self._context_strategy
+
+    @property
+    def persist_interval(self) -> float:
+        """Seconds chat history writes may wait to be batched; 0 (the default) writes them through.
+
+        Write-behind is opt-in: a crash or kill loses up to this many seconds
+        of messages the UI already showed as sent.
+        """
+        return self._persist_interval
+
+    @property
+    def persist_batch_size(self) -> int:
+        """Queued chat history writes that trigger a flush before the interval is up."""
+        return self._persist_batch_size
+
+    @property
+    def persist_sync(self) -> str:
+        """SQLite fsync policy for chat history: "off", "normal" or "full"."""
+        return self._persist_sync
+
+    @property
+    def ui_metrics_port(self) -> int:
+        """Port the Streamlit process serves its own /metrics on; 0 turns it off."""
+        return self._ui_metrics_port
+
+    def configure(
+        self,
+        host: str,
+        port: int,
+        pool_connections: Optional[int] = None,
+        pool_maxsize: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        request_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_factor: Optional[float] = None,
+        show_timings: Optional[bool] = None,
+        transport: Optional[str] = None,
+        uds_path: Optional[str] = None,
+        compress_min_size: Optional[int] = None,
+        response_format: Optional[str] = None,
+        workers: Optional[int] = None,
+        app_factory: Optional[str] = None,
+        replicas: Optional[Tuple[str, ...]] = None,
+        state_path: Optional[str] = None,
+        namespace_mode: Optional[str] = None,
+        profile_startup: Optional[bool] = None,
+        message_cache_bytes: Optional[int] = None,
+        show_memory: Optional[bool] = None,
+        context_max_tokens: Optional[int] = None,
+        context_strategy: Optional[str] = None,
+        persist_interval: Optional[float] = None,
+        persist_batch_size: Optional[int] = None,
+        persist_sync: Optional[str] = None,
+        ui_metrics_port: Optional[int] = None,
+    ):
         self._host = host
         self._port = port
+        if pool_connections is not None:
+            self._pool_connections = pool_connections
+        if pool_maxsize is not None:
+            self._pool_maxsize = pool_maxsize
+        if connect_timeout is not None:
+            self._connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self._read_timeout = read_timeout
+        if request_timeout is not None:
+            self._request_timeout = request_timeout
+        if max_retries is not None:
+            self._max_retries = max_retries
+        if backoff_factor is not None:
+            self._backoff_factor = backoff_factor
+        if show_timings is not None:
+            self._show_timings = show_timings
+        if transport is not None:
+            if transport not in TRANSPORTS:
+                raise ValueError(f"Unknown transport: {transport}")
+            self._transport = transport
+        if uds_path is not None:
+            self._uds_path = uds_path
+        if compress_min_size is not None:
+            self._compress_min_size = compress_min_size
+        if response_format is not None:
+            if response_format not in RESPONSE_FORMATS:
+                raise ValueError(f"Unknown response format: {response_format}")
+            self._response_format = response_format
+        if workers is not None:
+            self._workers = workers
+        if app_factory is not None:
+            self._app_factory = app_factory
+        if replicas is not None:
+            self._replicas = tuple(url.rstrip("/") for url in replicas)
+        if state_path is not None:
+            self._state_path = state_path
+        if namespace_mode is not None:
+            if namespace_mode not in NAMESPACE_MODES:
+                raise ValueError(f"Unknown namespace mode: {namespace_mode}")
+            self._namespace_mode = namespace_mode
+        if profile_startup is not None:
+            self._profile_startup = profile_startup
+        if message_cache_bytes is not None:
+            self._message_cache_bytes = message_cache_bytes
+        if show_memory is not None:
+            self._show_memory = show_memory
+        if context_max_tokens is not None:
+            self._context_max_tokens = context_max_tokens
+        if context_strategy is not None:
+            if context_strategy not in CONTEXT_STRATEGIES:
+                raise ValueError(f"Unknown context strategy: {context_strategy}")
+            self._context_strategy = context_strategy
+        if persist_interval is not None:
+            self._persist_interval = persist_interval
+        if persist_batch_size is not None:
+            self._persist_batch_size = persist_batch_size
+        if persist_sync is not None:
+            if persist_sync not in SYNC_MODES:
+                raise ValueError(f"Unknown persist sync mode: {persist_sync}")
+            self._persist_sync = persist_sync
+        if ui_metrics_port is not None:
+            self._ui_metrics_port = ui_metrics_port
+
+    def to_env(self) -> Dict[str, str]:
+        """Export the settings so a child Streamlit process picks them up."""
+        return {
+            f"{ENV_PREFIX}HOST": self._host,
+            f"{ENV_PREFIX}PORT": str(self._port),
+            f"{ENV_PREFIX}POOL_CONNECTIONS": str(self._pool_connections),
+            f"{ENV_PREFIX}POOL_MAXSIZE": str(self._pool_maxsize),
+            f"{ENV_PREFIX}CONNECT_TIMEOUT": str(self._connect_timeout),
+            f"{ENV_PREFIX}READ_TIMEOUT": str(self._read_timeout),
+            f"{ENV_PREFIX}REQUEST_TIMEOUT": str(self._request_timeout),
+            f"{ENV_PREFIX}MAX_RETRIES": str(self._max_retries),
+            f"{ENV_PREFIX}BACKOFF_FACTOR": str(self._backoff_factor),
+            f"{ENV_PREFIX}SHOW_TIMINGS": "1" if self._show_timings else "0",
+            f"{ENV_PREFIX}TRANSPORT": self._transport,
+            f"{ENV_PREFIX}UDS_PATH": self._uds_path,
+            f"{ENV_PREFIX}COMPRESS_MIN_SIZE": str(self._compress_min_size),
+            f"{ENV_PREFIX}RESPONSE_FORMAT": self._response_format,
+            f"{ENV_PREFIX}WORKERS": str(self._workers),
+            f"{ENV_PREFIX}APP_FACTORY": self._app_factory or "",
+            f"{ENV_PREFIX}REPLICAS": ",".join(self._replicas),
+            f"{ENV_PREFIX}STATE_PATH": self._state_path or "",
+            f"{ENV_PREFIX}NAMESPACE_MODE": self._namespace_mode,
+            f"{ENV_PREFIX}PROFILE_STARTUP": "1" if self._profile_startup else "0",
+            f"{ENV_PREFIX}MESSAGE_CACHE_BYTES": str(self._message_cache_bytes),
+            f"{ENV_PREFIX}SHOW_MEMORY": "1" if self._show_memory else "0",
+            f"{ENV_PREFIX}CONTEXT_MAX_TOKENS": str(self._context_max_tokens),
+            f"{ENV_PREFIX}CONTEXT_STRATEGY": self._context_strategy,
+            f"{ENV_PREFIX}PERSIST_INTERVAL": str(self._persist_interval),
+            f"{ENV_PREFIX}PERSIST_BATCH_SIZE": str(self._persist_batch_size),
+            f"{ENV_PREFIX}PERSIST_SYNC": self._persist_sync,
+            f"{ENV_PREFIX}UI_METRICS_PORT": str(self._ui_metrics_port),
+        }
 
     @property
     def base_url(self) -> str:
@@ -0,0 +1,110 @@
+import pytest
+
+from streamlit_view import admission
+from streamlit_view.admission import (
+    AdmissionController,
+    OverloadedError,
+    RateLimitedError,
+    RateLimiter,
+    TokenBucket,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_token_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(rate=2.0, capacity=3.0, now=0.0)
+    assert [bucket.take(0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(0.0) == pytest.approx(0.5)
+    assert bucket.take(0.5) == 0.0
+    # A long pause never banks more than the capacity
+    bucket.take(100.0)
+    assert bucket.tokens == pytest.approx(2.0)
+
+
+def test_rate_limiter_forgets_least_recently_used_keys():
+    limiter = RateLimiter(rate=1.0, burst=1.0, max_keys=2)
+    assert limiter.check("a", 0.0) == 0.0
+    assert limiter.check("b", 0.0) == 0.0
+    assert limiter.check("a", 0.0) > 0
+    limiter.check("c", 0.0)
+    assert list(limiter._buckets) == ["a", "c"]
+    # A forgotten key starts over with a full bucket
+    assert limiter.check("b", 0.0) == 0.0
+
+
+def test_rate_limiter_rejects_non_positive_rates():
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0)
+
+
+def test_chat_and_client_rates_are_limited_separately(clock):
+    controller = AdmissionController(chat_rate=1.0, ip_rate=2.0)
+    controller.admit("chat", "10.0.0.1")
+    with pytest.raises(RateLimitedError) as excinfo:
+        controller.admit("chat", "10.0.0.2")
+    assert "chat" in str(excinfo.value)
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.retry_after_header == "1"
+
+    controller.admit("other", "10.0.0.1")
+    with pytest.raises(RateLimitedError) as excinfo:
+        controller.admit("third", "10.0.0.1")
+    assert "client" in str(excinfo.value)
+
+    clock.now += 1.0
+    controller.admit("chat", "10.0.0.1")
+
+
+def test_in_flight_cap_sheds_until_slots_are_released(clock):
+    controller = AdmissionController(max_in_flight=2)
+    taken = [controller.admit("a"), controller.admit("b")]
+    assert controller.admitted == 2
+    with pytest.raises(OverloadedError) as excinfo:
+        controller.admit("c")
+    assert excinfo.value.status_code == 503
+    for slots in taken:
+        controller.release(slots)
+    assert controller.admitted == 0
+    controller.admit("c")
+
+
+def test_overload_is_checked_before_the_rate(clock):
+    controller = AdmissionController(chat_rate=1.0, max_in_flight=1)
+    controller.admit("a")
+    with pytest.raises(OverloadedError):
+        controller.admit("b")
+    controller.release()
+    # The shed attempt did not use up chat b's only token
+    controller.admit("b")
+
+
+def test_batches_take_at_most_the_in_flight_cap(clock):
+    controller = AdmissionController(max_in_flight=4)
+    slots = controller.admit(None, slots=10)
+    assert slots == 4
+    with pytest.raises(OverloadedError):
+        controller.admit("a")
+    controller.release(slots)
+    assert controller.admitted == 0
+
+
+def test_release_never_goes_negative():
+    controller = AdmissionController(max_in_flight=1)
+    controller.release(3)
+    assert controller.admitted == 0
+    controller.admit("a")
+    assert controller.admitted == 1
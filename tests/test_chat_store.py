@@ -0,0 +1,329 @@
+import sqlite3
+import time
+
+import pytest
+
+from streamlit_view.chat_store import ID_BLOCK_SIZE, ChatStore
+from streamlit_view.messages import Role
+
+
+# Long enough that the writer thread never flushes during a test
+INTERVAL = 3600.0
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "chats.sqlite3")
+
+
+@pytest.fixture
+def store(path):
+    store = ChatStore(path, flush_interval=INTERVAL)
+    yield store
+    store.close()
+
+
+def on_disk(path, query, params=()):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(query, params).fetchall()
+
+
+def traced(store):
+    """The statements the store's writer runs from now on."""
+    statements = []
+    if store._writer is None:
+        store._writer = store._connect()
+    store._writer.set_trace_callback(statements.append)
+    return statements
+
+
+def test_queued_writes_are_read_back_before_they_are_flushed(store, path):
+    store.create_chat("a", title="First")
+    first = store.append_message("a", Role.USER, "hello world")
+    second = store.append_message("a", Role.ASSISTANT, "hi there")
+    store.rename_chat("a", "Renamed")
+    store.set_current_chat_id("a")
+
+    assert on_disk(path, "SELECT COUNT(*) FROM messages") == [(0,)]
+    assert [m.content for m in store.load_messages("a")] == ["hello world", "hi there"]
+    assert store.load_messages("a", limit=1) == [second]
+    assert store.load_messages_since("a", first.id) == [second]
+    assert store.load_contents([first.id]) == {first.id: "hello world"}
+    assert [m.id for m in store.iter_messages("a")] == [first.id, second.id]
+    assert store.get_current_chat_id() == "a"
+    assert store.count_chats() == 1
+    assert not store.is_empty()
+    (chat,) = store.list_chats()
+    assert (chat["title"], chat["message_count"]) == ("Renamed", 2)
+    assert store.get_chat("a")["message_count"] == 2
+    assert [(hit.chat_id, hit.message_id) for hit in store.search("hell")] == [
+        ("a", first.id)
+    ]
+    assert store.search("renam")[0].message_id is None
+
+    store.flush()
+    assert on_disk(path, "SELECT title, message_count FROM chats") == [("Renamed", 2)]
+    assert store.list_chats() == [chat]
+    assert [m.content for m in store.load_messages("a")] == ["hello world", "hi there"]
+
+
+def test_the_writer_thread_flushes_once_the_interval_has_passed(path):
+    store = ChatStore(path, flush_interval=0.05)
+    try:
+        store.append_message("a", Role.USER, "later")
+        deadline = time.monotonic() + 5
+        while not on_disk(path, "SELECT 1 FROM messages") and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert on_disk(path, "SELECT content FROM messages") == [("later",)]
+        assert store.flush_due() is None
+    finally:
+        store.close()
+
+
+def test_reads_merge_committed_and_queued_messages(store):
+    store.append_message("a", Role.USER, "one")
+    store.flush()
+    store.append_message("a", Role.ASSISTANT, "two")
+    store.append_message("b", Role.USER, "elsewhere")
+
+    assert [m.content for m in store.load_messages("a")] == ["one", "two"]
+    assert [m.content for m in store.iter_messages("a", batch_size=1)] == ["one", "two"]
+    assert [chat["message_count"] for chat in store.list_chats()] == [2, 1]
+    assert [chat["chat_id"] for chat in store.list_chats(limit=1, offset=1)] == ["b"]
+
+
+def test_paging_forward_spans_committed_and_queued_messages(store):
+    first = store.append_message("a", Role.USER, "one")
+    store.append_message("a", Role.ASSISTANT, "two")
+    store.flush()
+    store.append_message("a", Role.USER, "three")
+    store.append_message("a", Role.ASSISTANT, "four")
+
+    page = store.load_messages_since("a", first.id, limit=2)
+    assert [m.content for m in page] == ["two", "three"]
+    rest = store.load_messages_since("a", page[-1].id, limit=2)
+    assert [m.content for m in rest] == ["four"]
+
+
+def test_renames_and_chat_switches_coalesce(store):
+    store.create_chat("a")
+    store.flush()
+    statements = traced(store)
+    for length in range(1, 21):
+        store.rename_chat("a", "x" * length)
+    for chat_id in ("a", "b", "a"):
+        store.set_current_chat_id(chat_id)
+    store.flush()
+
+    # Distinct statements: triggers echo the one that fired them
+    assert len({s for s in statements if s.startswith("UPDATE chats SET title")}) == 1
+    assert len({s for s in statements if s.startswith("INSERT INTO meta")}) == 1
+    assert statements.count("COMMIT") == 1
+    assert store.get_chat("a")["title"] == "x" * 20
+
+
+def test_write_through_commits_each_call_in_one_transaction(path):
+    store = ChatStore(path)
+    try:
+        store.create_chat("a")
+        statements = traced(store)
+        message = store.append_message("a", Role.USER, "hi")
+
+        assert statements.count("COMMIT") == 1
+        assert on_disk(path, "SELECT id, content FROM messages") == [(message.id, "hi")]
+        assert on_disk(path, "SELECT message_count FROM chats") == [(1,)]
+    finally:
+        store.close()
+
+
+def test_stores_sharing_a_file_reserve_distinct_ids(path):
+    first = ChatStore(path, flush_interval=INTERVAL)
+    second = ChatStore(path, flush_interval=INTERVAL)
+    try:
+        ids = []
+        for index in range(ID_BLOCK_SIZE + 5):
+            ids.append(first.append_message("a", Role.USER, f"a{index}").id)
+            ids.append(second.append_message("b", Role.USER, f"b{index}").id)
+        first.flush()
+        second.flush()
+
+        assert len(set(ids)) == len(ids)
+        assert ids[0::2] == sorted(ids[0::2])
+        assert on_disk(path, "SELECT COUNT(*) FROM messages") == [(len(ids),)]
+    finally:
+        first.close()
+        second.close()
+
+
+def test_ids_continue_after_reopening(path):
+    store = ChatStore(path)
+    last = store.append_message("a", Role.USER, "before").id
+    store.close()
+    store = ChatStore(path)
+    try:
+        assert store.append_message("a", Role.USER, "after").id > last
+    finally:
+        store.close()
+
+
+def test_a_bad_change_is_dropped_alone(store, path):
+    store.append_message("a", Role.USER, "kept")
+    store.append_message("a", Role.USER, None)  # violates NOT NULL
+    store.append_message("b", Role.USER, "also kept")
+    store.flush()
+
+    assert on_disk(path, "SELECT content FROM messages ORDER BY id") == [
+        ("kept",),
+        ("also kept",),
+    ]
+    assert on_disk(path, "SELECT chat_id, message_count FROM chats ORDER BY chat_id") == [
+        ("a", 1),
+        ("b", 1),
+    ]
+
+
+def test_a_busy_database_keeps_the_batch_for_a_retry(store, path):
+    store.append_message("a", Role.USER, "reserves ids")
+    store.flush()
+    statements = traced(store)
+    store._writer.execute("PRAGMA busy_timeout = 0")
+    blocker = sqlite3.connect(path)
+    blocker.execute("BEGIN IMMEDIATE")
+    store.append_message("a", Role.USER, "waits")
+    store.flush()
+
+    assert [m.content for m in store.load_messages("a")] == ["reserves ids", "waits"]
+    assert store.flush_due() is not None
+    blocker.rollback()
+    blocker.close()
+    store.flush()
+    assert "COMMIT" in statements
+    assert on_disk(path, "SELECT content FROM messages ORDER BY id") == [
+        ("reserves ids",),
+        ("waits",),
+    ]
+
+
+def test_deleting_drops_queued_changes(store, path):
+    store.append_message("a", Role.USER, "gone")
+    store.rename_chat("a", "gone too")
+    store.append_message("b", Role.USER, "stays")
+    store.delete_chat("a")
+
+    assert store.get_chat("a") is None
+    assert store.load_messages("a") == []
+    store.flush()
+    assert on_disk(path, "SELECT chat_id FROM chats") == [("b",)]
+
+    store.append_message("b", Role.USER, "queued")
+    store.delete_all()
+    assert store.is_empty()
+    assert store.flush_due() is None
+
+
+def test_close_flushes_and_later_use_raises(path):
+    store = ChatStore(path, flush_interval=INTERVAL)
+    store.append_message("a", Role.USER, "saved on close")
+    store.close()
+
+    assert on_disk(path, "SELECT content FROM messages") == [("saved on close",)]
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.append_message("a", Role.USER, "too late")
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.rename_chat("a", "too late")
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.load_messages("a")
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.flush()
+    store.close()
+
+
+def test_migration_needs_an_actual_shelve(tmp_path):
+    store = ChatStore(str(tmp_path / "chat_history.sqlite3"))
+    try:
+        assert not store.migrate_from_shelve(str(tmp_path / "chat_history"))
+        assert not store.migrate_from_shelve(str(tmp_path / "chat"))
+    finally:
+        store.close()
+    assert sorted(p.name for p in tmp_path.iterdir() if ".sqlite3" not in p.name) == []
+
+
+def test_legacy_shelve_is_migrated(tmp_path):
+    import shelve
+
+    legacy = str(tmp_path / "chat_history")
+    with shelve.open(legacy) as db:
+        db["chats"] = {
+            "1": {"title": "Old", "messages": [{"role": "user", "content": "kept"}]}
+        }
+        db["current_chat_id"] = "1"
+    store = ChatStore(str(tmp_path / "chat_history.sqlite3"))
+    try:
+        assert store.migrate_from_shelve(legacy)
+        assert [m.content for m in store.load_messages("1")] == ["kept"]
+        assert store.get_current_chat_id() == "1"
+        assert not store.migrate_from_shelve(legacy)
+    finally:
+        store.close()
+
+
+def test_a_store_under_its_previous_name_is_moved(tmp_path):
+    from streamlit_view.chat_migration import adopt_previous_file
+
+    previous, path = str(tmp_path / "chat_history.db"), str(tmp_path / "chat_history.sqlite3")
+    old = ChatStore(previous)
+    old.append_message("a", Role.USER, "carried over")
+    old.close()
+
+    adopt_previous_file(path, previous)
+    store = ChatStore(path)
+    try:
+        assert [m.content for m in store.load_messages("a")] == ["carried over"]
+    finally:
+        store.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_legacy_integer_ids_and_uuids_live_side_by_side(tmp_path):
+    import shelve
+    import uuid
+
+    from streamlit_view.export import export_cache, export_chat
+
+    legacy = str(tmp_path / "chat_history")
+    with shelve.open(legacy) as db:
+        # Chat ids were small integers before they became UUIDs
+        db["chats"] = {7: {"title": "Old", "messages": [{"role": "user", "content": "old"}]}}
+        db["current_chat_id"] = 7
+    path = str(tmp_path / "chat_history.sqlite3")
+    store = ChatStore(path)
+    try:
+        assert store.migrate_from_shelve(legacy)
+        new_id = uuid.uuid4().hex
+        store.create_chat(new_id, "New")
+        store.append_message(new_id, Role.USER, "new")
+
+        assert [chat["chat_id"] for chat in store.list_chats()] == ["7", new_id]
+        assert store.get_current_chat_id() == "7"
+        assert [m.content for m in store.load_messages("7")] == ["old"]
+        assert [m.content for m in store.load_messages(new_id)] == ["new"]
+        assert export_chat(store, "7", "txt", 1) == b"human: old\n\n"
+        assert export_chat(store, new_id, "txt", 1) == b"human: new\n\n"
+
+        store.delete_chat("7")
+        assert store.get_chat("7") is None
+        assert [m.content for m in store.load_messages(new_id)] == ["new"]
+        wait_for(lambda: not on_disk(path, "SELECT id FROM messages WHERE chat_id = '7'"))
+
+        store.delete_chat(new_id)
+        assert store.list_chats() == []
+        wait_for(lambda: not on_disk(path, "SELECT id FROM messages"))
+    finally:
+        store.close()
+        export_cache.invalidate()
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from streamlit_view.context import (
+    MESSAGE_OVERHEAD_TOKENS,
+    SUMMARY_STRATEGY,
+    ChatContext,
+    build_context,
+    count_tokens,
+    current_context,
+    set_tokenizer,
+    using_context,
+)
+from streamlit_view.messages import ChatMessage, Role
+
+
+def turn(index, content):
+    role = Role.USER if index % 2 == 0 else Role.ASSISTANT
+    return ChatMessage(index, role, content, 0.0)
+
+
+# Six turns of exactly five tokens each, plus the per-message overhead
+HISTORY = [turn(i, f"turn {i} of the chat") for i in range(6)]
+PER_MESSAGE = 5 + MESSAGE_OVERHEAD_TOKENS
+
+
+@pytest.fixture(autouse=True)
+def default_tokenizer():
+    yield
+    set_tokenizer(None)
+
+
+def test_the_window_keeps_the_newest_messages_that_fit():
+    window = build_context(HISTORY, "next one", 2 + 3 * PER_MESSAGE)
+
+    assert [m.id for m in window.messages] == [3, 4, 5]
+    assert window.summary is None
+    assert (window.prompt_tokens, window.context_tokens) == (2, 3 * PER_MESSAGE)
+    assert window.dropped == 3
+    assert window.report()["total_tokens"] == 2 + 3 * PER_MESSAGE
+
+
+def test_history_within_the_budget_is_sent_whole():
+    window = build_context(HISTORY, "next one", 1000)
+    assert window.messages == HISTORY
+    assert window.dropped == 0
+    assert window.context() == ChatContext(HISTORY, None)
+
+
+def test_the_summary_strategy_condenses_what_the_window_drops():
+    window = build_context(HISTORY, "next one", 2 + 4 * PER_MESSAGE, SUMMARY_STRATEGY)
+
+    # A quarter of the budget goes to the summary, so one turn fewer is kept
+    assert [m.id for m in window.messages] == [3, 4, 5]
+    assert window.summary == "user: turn 0 of the chat"
+    assert window.context_tokens == 3 * PER_MESSAGE + count_tokens(window.summary)
+    assert window.context().summary == window.summary
+
+
+def test_an_empty_history_sends_nothing_but_the_prompt():
+    window = build_context([], "just this", 100, SUMMARY_STRATEGY)
+    assert (window.messages, window.summary, window.dropped) == ([], None, 0)
+    assert window.context() is None
+
+
+def test_a_prompt_over_the_budget_leaves_no_room_for_history():
+    window = build_context(HISTORY, "a prompt far longer than the budget", 3)
+
+    assert window.messages == []
+    assert window.dropped == len(HISTORY)
+    assert window.prompt_tokens > 3
+    assert window.context() is None
+
+
+def test_unknown_strategies_are_rejected():
+    with pytest.raises(ValueError):
+        build_context(HISTORY, "x", 100, "everything")
+
+
+def test_set_tokenizer_changes_how_the_budget_is_spent():
+    set_tokenizer(len)
+    per_message = len(HISTORY[0].content) + MESSAGE_OVERHEAD_TOKENS
+    window = build_context(HISTORY, "abc", 3 + 2 * per_message)
+    assert window.prompt_tokens == 3
+    assert [m.id for m in window.messages] == [4, 5]
+
+    set_tokenizer(None)
+    assert count_tokens("abc") == 1
+
+
+def test_the_context_travels_as_its_own_structure():
+    sent = ChatContext(HISTORY[:2], "earlier")
+    received = ChatContext.from_dict(sent.to_dict())
+
+    assert [(m.role, m.content) for m in received.messages] == [
+        (m.role, m.content) for m in sent.messages
+    ]
+    assert received.summary == "earlier"
+    assert received.transcript() == (
+        "Summary of the earlier conversation:\nearlier\n\n"
+        "user: turn 0 of the chat\nassistant: turn 1 of the chat"
+    )
+    for malformed in ([], {"messages": "x"}, {"messages": [{"role": "nobody", "content": ""}]}):
+        with pytest.raises(ValueError):
+            ChatContext.from_dict(malformed)
+
+
+def test_the_context_is_current_only_inside_its_block():
+    sent = ChatContext(HISTORY[:1])
+    with using_context(sent):
+        assert current_context() is sent
+    assert current_context() is None
+
+
+def test_callbacks_see_the_context_on_the_executor_thread():
+    pytest.importorskip("common_utils")
+    from common_utils.schemas import AgentRequest
+    from streamlit_view.jobs import call_view_callback
+
+    sent = ChatContext(HISTORY[:1])
+
+    async def run():
+        with using_context(sent):
+            return await call_view_callback(lambda _: current_context(), AgentRequest())
+
+    assert asyncio.run(run()) is sent
+    assert current_context() is None
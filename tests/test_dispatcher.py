@@ -0,0 +1,102 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("common_utils")
+httpx = pytest.importorskip("httpx")
+
+from common_utils.schemas import AgentRequest, AgentResponse
+from fastapi import FastAPI
+
+from streamlit_view.dispatcher import Dispatcher
+from streamlit_view.jobs import JobManager
+from streamlit_view.view_configurations import define_endpoints
+
+
+def test_concurrent_posts_with_one_idempotency_key_run_the_callback_once():
+    calls = []
+
+    async def respond(agent_request):
+        calls.append(agent_request.message)
+        await asyncio.sleep(0.05)
+        return AgentResponse(chat_id=agent_request.chat_id, message=f"answer {len(calls)}")
+
+    app = FastAPI()
+    define_endpoints(app, respond)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            def post():
+                return client.post(
+                    "/input",
+                    json={"chat_id": "a", "message": "hi"},
+                    headers={"Idempotency-Key": "m1", "Cache-Control": "no-store"},
+                )
+
+            return await asyncio.gather(post(), post())
+
+    responses = asyncio.run(run())
+    assert [r.status_code for r in responses] == [200, 200]
+    assert responses[0].content == responses[1].content
+    assert calls == ["hi"]
+
+
+def test_run_batch_keeps_to_its_concurrency_and_each_chats_order():
+    active = Counter()
+    peaks = Counter()
+    order = []
+
+    async def respond(agent_request):
+        chat_id = agent_request.chat_id
+        active[chat_id] += 1
+        active["all"] += 1
+        peaks[chat_id] = max(peaks[chat_id], active[chat_id])
+        peaks["all"] = max(peaks["all"], active["all"])
+        order.append(agent_request.message)
+        await asyncio.sleep(0.01)
+        active[chat_id] -= 1
+        active["all"] -= 1
+
+    chats = ["a", "b", "c", "a", "b", "c", "d", "a"]
+    items = [
+        (index, AgentRequest(chat_id=chat_id, message=f"{chat_id}{index}"))
+        for index, chat_id in enumerate(chats)
+    ]
+
+    async def run():
+        dispatcher = Dispatcher(respond, job_manager=JobManager(respond, batch_workers=8))
+        return [result async for result in dispatcher.run_batch(items, concurrency=3)]
+
+    results = asyncio.run(run())
+    assert sorted(result.index for result in results) == list(range(len(chats)))
+    assert all(result.error is None for result in results)
+    assert peaks["all"] == 3
+    assert max(peaks[chat_id] for chat_id in set(chats)) == 1
+    assert [m for m in order if m.startswith("a")] == ["a0", "a3", "a7"]
+
+
+def test_batches_share_the_batch_lane():
+    active = []
+    peak = []
+
+    async def respond(agent_request):
+        active.append(agent_request)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(agent_request)
+
+    def batch(prefix):
+        return [(i, AgentRequest(chat_id=f"{prefix}{i}", message="x")) for i in range(4)]
+
+    async def run():
+        dispatcher = Dispatcher(respond, job_manager=JobManager(respond, batch_workers=2))
+
+        async def drain(items):
+            return [result async for result in dispatcher.run_batch(items, concurrency=4)]
+
+        await asyncio.gather(drain(batch("a")), drain(batch("b")))
+
+    asyncio.run(run())
+    assert max(peak) == 2
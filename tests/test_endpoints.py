@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("common_utils")
+httpx = pytest.importorskip("httpx")
+
+from common_utils.schemas import AgentResponse
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from streamlit_view.metrics import REGISTRY
+from streamlit_view.view_configurations import define_endpoints
+
+
+def answer(agent_request):
+    return AgentResponse(chat_id=agent_request.chat_id, message="hi")
+
+
+def requests_total(endpoint, status):
+    prefix = f'streamlit_view_requests_total{{endpoint="{endpoint}",status="{status}"}} '
+    for line in REGISTRY.render().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+async def stalls(agent_request):
+    await asyncio.sleep(30)
+
+
+async def streams_then_stalls(agent_request):
+    yield "first"
+    await asyncio.sleep(30)
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    define_endpoints(app, answer)
+    with TestClient(app, raise_server_exceptions=False) as client:
+        yield client
+
+
+@pytest.mark.parametrize("endpoint", ["/input", "/input/stream"])
+@pytest.mark.parametrize("body", ["not json", "[1, 2]"])
+def test_a_bad_body_is_a_counted_400(client, endpoint, body):
+    before = requests_total(endpoint, 400)
+    response = client.post(endpoint, content=body)
+    assert response.status_code == 400
+    assert requests_total(endpoint, 400) == before + 1
+    assert requests_total(endpoint, 500) == 0
+
+
+@pytest.mark.parametrize("body", ["not json", "[1, 2]", '{"chat_id": [1]}', "{}"])
+def test_delete_chat_rejects_bad_bodies(client, body):
+    assert client.post("/delete_chat", content=body).status_code == 400
+
+
+@pytest.mark.parametrize(
+    "body", ["not json", "[1, 2]", "{}", '{"chat_id": "a"}', '{"message_id": "m"}']
+)
+def test_cancel_needs_a_chat_and_a_message_id(client, body):
+    assert client.post("/cancel", content=body).status_code == 400
+
+
+def test_cancelling_an_unknown_turn_reports_nothing_stopped(client):
+    response = client.post("/cancel", json={"chat_id": "a", "message_id": "m"})
+    assert response.json() == {"cancelled": False}
+
+
+def test_a_turn_past_its_deadline_answers_504():
+    app = FastAPI()
+    define_endpoints(app, stalls)
+    with TestClient(app) as client:
+        response = client.post(
+            "/input", json={"chat_id": "a", "message": "hi"}, headers={"X-Request-Timeout": "0.1"}
+        )
+    assert response.status_code == 504
+
+
+def test_cancel_ends_a_running_stream():
+    app = FastAPI()
+    dispatcher = define_endpoints(app, stalls, stream_callback=streams_then_stalls)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            streaming = asyncio.ensure_future(
+                client.post(
+                    "/input/stream",
+                    json={"chat_id": "a", "message": "hi"},
+                    headers={"Idempotency-Key": "m"},
+                )
+            )
+            while dispatcher.streams.find("a", "m") is None:
+                await asyncio.sleep(0.01)
+            cancelled = await client.post("/cancel", json={"chat_id": "a", "message_id": "m"})
+            return cancelled.json(), await asyncio.wait_for(streaming, 5)
+
+    cancelled, streamed = asyncio.run(run())
+    assert cancelled == {"cancelled": True}
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    assert lines[-1]["status"] == "error"
+
+
+def test_a_full_queue_answers_503():
+    from streamlit_view.jobs import JobManager
+
+    app = FastAPI()
+    define_endpoints(app, stalls, job_manager=JobManager(stalls, max_queue_size=1, workers=1))
+    with TestClient(app) as client:
+        responses = [
+            client.post(
+                "/input",
+                json={"chat_id": "a", "message": f"turn {i}"},
+                headers={"Prefer": "respond-async"},
+            )
+            for i in range(3)
+        ]
+    assert responses[0].status_code == 202
+    assert responses[-1].status_code == 503
+    assert responses[-1].headers["Retry-After"] == "1"
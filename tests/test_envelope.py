@@ -0,0 +1,77 @@
+import gzip
+
+import pytest
+
+pytest.importorskip("common_utils")
+
+from common_utils.schemas import AgentResponse
+
+from streamlit_view import envelope
+from streamlit_view.envelope import (
+    LEGACY_MEDIA_TYPE,
+    V2_JSON_MEDIA_TYPE,
+    V2_MSGPACK_MEDIA_TYPE,
+    compress,
+    decode_response,
+    encode_response,
+    envelope_headers,
+    negotiate,
+)
+
+
+RESPONSE = AgentResponse(chat_id="a", message="héllo \"world\"\n" * 10)
+
+
+@pytest.mark.parametrize("media_type", [LEGACY_MEDIA_TYPE, V2_JSON_MEDIA_TYPE])
+def test_json_codecs_round_trip(media_type):
+    body = encode_response(RESPONSE, media_type)
+    assert decode_response(body, f"{media_type}; charset=utf-8") == RESPONSE
+
+
+def test_msgpack_round_trips():
+    pytest.importorskip("msgpack")
+    body = encode_response(RESPONSE, V2_MSGPACK_MEDIA_TYPE)
+    assert decode_response(body, V2_MSGPACK_MEDIA_TYPE) == RESPONSE
+
+
+def test_a_legacy_body_carries_the_response_as_a_string():
+    body = envelope.loads(encode_response(RESPONSE, LEGACY_MEDIA_TYPE))
+    assert isinstance(body["response"], str)
+    # An old server's body is decoded whatever its Content-Type says
+    assert decode_response(encode_response(RESPONSE, LEGACY_MEDIA_TYPE), None) == RESPONSE
+
+
+def test_clients_that_do_not_name_v2_get_the_legacy_format():
+    assert negotiate(None) == LEGACY_MEDIA_TYPE
+    assert negotiate("application/json, */*") == LEGACY_MEDIA_TYPE
+    assert negotiate(f"{V2_JSON_MEDIA_TYPE}, application/json") == V2_JSON_MEDIA_TYPE
+
+
+def test_gzip_round_trips():
+    body = encode_response(RESPONSE, V2_JSON_MEDIA_TYPE)
+    compressed, encoding = compress(body, "gzip, deflate", min_size=0)
+    assert encoding == "gzip"
+    assert envelope_headers(V2_JSON_MEDIA_TYPE, encoding)["Content-Encoding"] == "gzip"
+    assert decode_response(gzip.decompress(compressed), V2_JSON_MEDIA_TYPE) == RESPONSE
+
+
+def test_brotli_round_trips():
+    brotli = pytest.importorskip("brotli")
+    body = encode_response(RESPONSE, V2_JSON_MEDIA_TYPE)
+    compressed, encoding = compress(body, "br, gzip", min_size=0)
+    assert encoding == "br"
+    assert decode_response(brotli.decompress(compressed), V2_JSON_MEDIA_TYPE) == RESPONSE
+
+
+def test_brotli_is_only_used_when_available(monkeypatch):
+    monkeypatch.setattr(envelope, "brotli", None)
+    assert compress(b"x" * 100, "br, gzip", min_size=0)[1] == "gzip"
+    assert envelope.accept_encodings() == "gzip"
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, min_size", [("gzip", 1000), ("identity", 0), (None, 0)]
+)
+def test_small_bodies_and_plain_clients_are_not_compressed(accept_encoding, min_size):
+    body = encode_response(RESPONSE, V2_JSON_MEDIA_TYPE)
+    assert compress(body, accept_encoding, min_size) == (body, None)
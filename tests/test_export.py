@@ -0,0 +1,47 @@
+import pytest
+
+from streamlit_view.chat_store import ChatStore
+from streamlit_view.export import ExportCache, export_cache, export_chat
+from streamlit_view.messages import ChatMessage, Role
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChatStore(str(tmp_path / "chats.sqlite3"))
+    yield store
+    store.close()
+    export_cache.invalidate()
+
+
+def test_an_export_is_pinned_to_the_message_count_it_was_prepared_at(store):
+    store.append_message("a", Role.USER, "one")
+    store.append_message("a", Role.ASSISTANT, "two")
+    prepared = export_chat(store, "a", "txt", 2)
+
+    store.append_message("a", Role.USER, "three")
+    assert export_chat(store, "a", "txt", 2) is prepared
+    export_cache.invalidate()
+    assert export_chat(store, "a", "txt", 2) == b"human: one\n\nai: two\n\n"
+    assert b"three" in export_chat(store, "a", "txt", 3)
+
+
+def test_the_cache_is_bounded_by_bytes_but_keeps_the_newest_export():
+    cache = ExportCache(max_bytes=150)
+    messages = [ChatMessage(i, Role.USER, "x" * 20, 0.0) for i in range(10)]
+    rendered = []
+
+    def export(chat_id, count):
+        def render():
+            rendered.append(chat_id)
+            return messages[:count]
+
+        return cache.get_or_render("ns", chat_id, count, "jsonl", render)
+
+    export("a", 1)
+    export("b", 1)
+    assert len(export("a", 1)) + len(export("b", 1)) == cache._bytes
+    # c alone is over budget: everything older goes, c stays
+    export("c", 10)
+    assert list(cache._entries) == [("ns", "c", 10, "jsonl")]
+    export("c", 10)
+    assert rendered == ["a", "b", "c"]
@@ -0,0 +1,74 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip("common_utils")
+
+from streamlit_view.job_registry import JobRegistry
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+@pytest.fixture
+def registry(path):
+    registry = JobRegistry(path, result_ttl=0.0)
+    yield registry
+    registry.close()
+
+
+def snapshot(job_id, status="queued"):
+    return {"job_id": job_id, "chat_id": "a", "status": status}
+
+
+def on_disk(path):
+    with sqlite3.connect(path) as conn:
+        return {row[0] for row in conn.execute("SELECT job_id FROM jobs")}
+
+
+def test_a_snapshot_is_fetched_before_it_is_written(registry, path):
+    # Holding the flush lock keeps the writer thread from taking the queue
+    with registry._flushing:
+        registry.put(snapshot("j1"))
+        assert asyncio.run(registry.fetch("j1")) == snapshot("j1")
+        assert on_disk(path) == set()
+
+    registry.flush()
+    assert on_disk(path) == {"j1"}
+    assert asyncio.run(registry.fetch("j1")) == snapshot("j1")
+
+
+def test_the_latest_snapshot_of_a_job_wins(registry):
+    with registry._flushing:
+        registry.put(snapshot("j1"))
+        registry.put(snapshot("j1", "running"))
+    registry.flush()
+    assert registry.get("j1")["status"] == "running"
+
+
+def test_prune_drops_old_finished_jobs_only(registry, path):
+    registry.put(snapshot("done", "succeeded"))
+    registry.put(snapshot("failed", "failed"))
+    registry.put(snapshot("running", "running"))
+    registry.flush()
+    assert on_disk(path) == {"done", "failed", "running"}
+
+    registry.prune()
+    registry.flush()
+    assert on_disk(path) == {"running"}
+    assert registry.get("done") is None
+
+
+def test_prune_keeps_jobs_younger_than_the_ttl(path):
+    registry = JobRegistry(path, result_ttl=3600.0)
+    try:
+        registry.put(snapshot("done", "succeeded"))
+        registry.flush()
+        registry.prune()
+        registry.flush()
+        assert on_disk(path) == {"done"}
+    finally:
+        registry.close()
@@ -0,0 +1,189 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("common_utils")
+
+from common_utils.schemas import AgentRequest, AgentResponse
+
+from streamlit_view.jobs import JobManager, JobStatus, QueueFullError
+
+
+class Agent:
+    """Async view callback that holds every turn until ``gate`` opens."""
+
+    def __init__(self):
+        self.started = []
+        self.cancelled = []
+        self.gate = asyncio.Event()
+
+    async def respond(self, agent_request):
+        self.started.append(agent_request.message)
+        try:
+            await self.gate.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(agent_request.message)
+            raise
+        return AgentResponse(chat_id=agent_request.chat_id, message=agent_request.message)
+
+
+def turn(chat_id, message):
+    return AgentRequest(chat_id=chat_id, message=message)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_a_queued_job_that_expires_never_reaches_the_callback():
+    async def run():
+        agent = Agent()
+        manager = JobManager(agent.respond, workers=1)
+        first = manager.submit(turn("a", "first"))
+        late = manager.submit(turn("a", "late"), deadline=time.time() + 0.05)
+        await manager.wait(late, timeout=5)
+
+        assert (late.status, late.error) == (JobStatus.EXPIRED, "Deadline exceeded")
+        assert manager.queue_depth == 0
+        agent.gate.set()
+        await manager.wait(first, timeout=5)
+        await settle()
+        await manager.shutdown()
+        return agent.started
+
+    assert asyncio.run(run()) == ["first"]
+
+
+def test_cancelling_a_running_async_callback_stops_it():
+    async def run():
+        agent = Agent()
+        manager = JobManager(agent.respond, workers=1)
+        job = manager.submit(turn("a", "long"))
+        await settle()
+        assert job.status == JobStatus.RUNNING
+
+        assert manager.cancel(job)
+        assert not manager.cancel(job)
+        await settle()
+        await manager.shutdown()
+        return job, agent, manager
+
+    job, agent, manager = asyncio.run(run())
+    assert job.status == JobStatus.CANCELLED
+    assert agent.cancelled == ["long"]
+    assert manager.in_flight == 0
+
+
+class Registry:
+    def __init__(self):
+        self.snapshots = {}
+
+    def put(self, data):
+        self.snapshots[data["job_id"]] = data
+
+    def prune(self):
+        pass
+
+
+def test_each_chats_turns_run_in_order_while_chats_overlap():
+    events = []
+
+    async def respond(agent_request):
+        events.append(("start", agent_request.message))
+        await asyncio.sleep(0.01)
+        events.append(("end", agent_request.message))
+
+    async def run():
+        manager = JobManager(respond, workers=4)
+        jobs = [manager.submit(turn("a", f"a{i}")) for i in range(3)]
+        jobs.append(manager.submit(turn("b", "b0")))
+        for job in jobs:
+            await manager.wait(job, timeout=5)
+        await manager.shutdown()
+
+    asyncio.run(run())
+    chat_a = [event for event in events if event[1].startswith("a")]
+    assert chat_a == [(edge, f"a{i}") for i in range(3) for edge in ("start", "end")]
+    # b did not wait for a's lane
+    assert events.index(("start", "b0")) < events.index(("end", "a0"))
+
+
+def test_a_duplicate_key_is_coalesced_onto_one_job():
+    async def run():
+        agent = Agent()
+        manager = JobManager(agent.respond, workers=2)
+        first = manager.submit(turn("a", "hi"), "m1")
+        again = manager.submit(turn("a", "hi"), "m1")
+        other_chat = manager.submit(turn("b", "hi"), "m1")
+        agent.gate.set()
+        for job in (first, other_chat):
+            await manager.wait(job, timeout=5)
+        await manager.shutdown()
+        return first, again, other_chat, agent.started
+
+    first, again, other_chat, started = asyncio.run(run())
+    assert again is first
+    assert other_chat is not first
+    assert started == ["hi", "hi"]
+
+
+def test_a_full_queue_refuses_bounded_jobs_only():
+    async def run():
+        agent = Agent()
+        manager = JobManager(agent.respond, max_queue_size=1, workers=1)
+        manager.submit(turn("a", "running"))
+        await settle()
+        manager.submit(turn("a", "queued"))
+        with pytest.raises(QueueFullError):
+            manager.submit(turn("b", "refused"))
+        purge = manager.submit(turn("b", "purge"), bounded=False)
+        depth = manager.queue_depth
+        await manager.shutdown()
+        return depth, purge
+
+    depth, purge = asyncio.run(run())
+    assert depth == 2
+    assert purge.status == JobStatus.CANCELLED
+
+
+def test_cancelling_a_queued_job_skips_it():
+    async def run():
+        agent = Agent()
+        manager = JobManager(agent.respond, workers=1)
+        first = manager.submit(turn("a", "first"))
+        queued = manager.submit(turn("a", "queued"))
+        await settle()
+        assert manager.cancel(queued)
+        assert manager.queue_depth == 0
+        agent.gate.set()
+        await manager.wait(first, timeout=5)
+        await settle()
+        await manager.shutdown()
+        return queued, agent.started
+
+    queued, started = asyncio.run(run())
+    assert (queued.status, queued.error) == (JobStatus.CANCELLED, "Cancelled")
+    assert started == ["first"]
+
+
+def test_shutdown_leaves_no_job_running_or_queued():
+    registry = Registry()
+
+    async def run():
+        agent = Agent()
+        manager = JobManager(agent.respond, workers=1, registry=registry)
+        running = manager.submit(turn("a", "running"))
+        queued = manager.submit(turn("a", "queued"))
+        await settle()
+        waiter = asyncio.ensure_future(manager.wait(running))
+        await manager.shutdown()
+        await asyncio.wait_for(waiter, 5)
+        return running, queued
+
+    running, queued = asyncio.run(run())
+    for job in (running, queued):
+        assert job.status == JobStatus.CANCELLED
+        assert job.finished_at is not None
+        assert registry.snapshots[job.job_id]["status"] == "cancelled"
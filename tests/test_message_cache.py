@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("common_utils")
+
+from streamlit_view import message_cache
+from streamlit_view.message_cache import estimate_size, memory_report, record_session
+
+
+@pytest.fixture(autouse=True)
+def sessions():
+    message_cache._sessions.clear()
+    yield
+    message_cache._sessions.clear()
+
+
+def test_a_session_is_remeasured_only_once_its_estimate_is_stale():
+    state = {"messages": ["hi"]}
+    first = record_session("s1", state)
+    assert first == estimate_size(state)
+
+    state["messages"].append("x" * 10_000)
+    assert record_session("s1", state) == first
+    assert record_session("s1", state, max_age=0) > first + 10_000
+
+
+def test_sampled_sizes_feed_the_memory_report():
+    record_session("s1", {"a": "x" * 1000})
+    record_session("s2", {"b": "y" * 2000})
+    report = memory_report()
+    assert report["sessions"] == 2
+    assert report["largest_session_bytes"] == estimate_size({"b": "y" * 2000})
+    assert message_cache._session_bytes_total() == report["session_bytes"]
+
+
+def test_a_state_without_a_session_is_always_measured():
+    state = {"a": []}
+    first = record_session(None, state)
+    state["a"].append("x" * 1000)
+    assert record_session(None, state) > first
+    assert memory_report()["sessions"] == 0
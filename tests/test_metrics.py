@@ -0,0 +1,32 @@
+import socket
+import urllib.request
+
+from streamlit_view.metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, RequestTimer, serve_metrics
+
+
+def count_of(endpoint):
+    prefix = f'streamlit_view_request_seconds_count{{endpoint="{endpoint}"}} '
+    for line in REGISTRY.render().splitlines():
+        if line.startswith(prefix):
+            return int(line[len(prefix):])
+    return 0
+
+
+def test_a_request_is_recorded_once_however_often_it_finishes():
+    timer = RequestTimer("/test/finish")
+    elapsed = timer.finish(200)
+    assert timer.finish(499) == elapsed
+    assert count_of("/test/finish") == 1
+    assert 'endpoint="/test/finish",status="499"' not in REGISTRY.render()
+
+
+def test_serve_metrics_exposes_the_registry():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    RequestTimer("/test/served").finish(200)
+    serve_metrics("127.0.0.1", port)
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        assert response.headers["Content-Type"] == PROMETHEUS_CONTENT_TYPE
+        assert 'endpoint="/test/served"' in response.read().decode("utf-8")
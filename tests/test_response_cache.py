@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+pytest.importorskip("common_utils")
+
+from common_utils.schemas import AgentRequest, AgentResponse
+
+from streamlit_view.response_cache import GLOBAL_SCOPE, ResponseCache
+
+
+def ask(chat_id, message):
+    return AgentRequest(chat_id=chat_id, message=message)
+
+
+def answer(chat_id, message):
+    return AgentResponse(chat_id=chat_id, message=message)
+
+
+def test_an_entry_expires_after_its_ttl():
+    cache = ResponseCache(ttl=0.05)
+    cache.put(ask("a", "hi"), answer("a", "hello"))
+    assert cache.get(ask("a", "hi")).message == "hello"
+
+    time.sleep(0.1)
+    assert cache.get(ask("a", "hi")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_the_least_recently_used_entry_is_evicted_first():
+    cache = ResponseCache(max_entries=2)
+    cache.put(ask("a", "one"), answer("a", "1"))
+    cache.put(ask("a", "two"), answer("a", "2"))
+    # Reading "one" makes "two" the least recently used
+    assert cache.get(ask("a", "one")) is not None
+    cache.put(ask("a", "three"), answer("a", "3"))
+
+    assert cache.get(ask("a", "two")) is None
+    assert cache.get(ask("a", "one")).message == "1"
+    assert cache.get(ask("a", "three")).message == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_chat_scoped_answers_stay_in_their_chat():
+    cache = ResponseCache()
+    cache.put(ask("a", "What is the plan?"), answer("a", "a's plan"))
+
+    assert cache.get(ask("b", "What is the plan?")) is None
+    # Case and spacing do not matter within the chat
+    assert cache.get(ask("a", "what  is the PLAN?")).message == "a's plan"
+
+
+def test_global_answers_are_shared_and_readdressed():
+    cache = ResponseCache(scope=GLOBAL_SCOPE)
+    cache.put(ask("a", "hi"), answer("a", "hello"))
+    response = cache.get(ask("b", "hi"))
+    assert response.message == "hello"
+    assert response.chat_id == "b"
+
+
+def test_invalidating_a_chat_drops_its_entries(tmp_path):
+    path = str(tmp_path / "responses.sqlite3")
+    cache = ResponseCache(disk_path=path)
+    cache.put(ask("a", "hi"), answer("a", "hello"))
+    cache.put(ask("b", "hi"), answer("b", "hey"))
+
+    assert cache.invalidate_chat("a") == 1
+    assert cache.get(ask("a", "hi")) is None
+    assert ResponseCache(disk_path=path).get(ask("b", "hi")).message == "hey"
+
+
+def test_the_disk_tier_outlives_the_instance(tmp_path):
+    path = str(tmp_path / "responses.sqlite3")
+    cache = ResponseCache(disk_path=path)
+    cache.put(ask("a", "hi"), answer("a", "hello"))
+    cache.flush()
+
+    reopened = ResponseCache(disk_path=path)
+    assert reopened.stats()["entries"] == 0
+    assert reopened.get(ask("a", "hi")).message == "hello"
+    # Promoted into memory on the way
+    assert reopened.stats()["entries"] == 1
+
+
+def test_an_entry_evicted_from_memory_is_read_back_from_disk(tmp_path):
+    cache = ResponseCache(max_entries=1, disk_path=str(tmp_path / "responses.sqlite3"))
+    cache.put(ask("a", "one"), answer("a", "1"))
+    cache.put(ask("a", "two"), answer("a", "2"))
+    assert cache.get(ask("a", "one")).message == "1"
+
+
+def test_cache_stats_counts_hits_and_misses():
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from streamlit_view.view_configurations import define_endpoints
+
+    calls = []
+
+    def respond(agent_request):
+        calls.append(agent_request.message)
+        return AgentResponse(chat_id=agent_request.chat_id, message="hello")
+
+    app = FastAPI()
+    define_endpoints(app, respond, response_cache=ResponseCache())
+    with TestClient(app) as client:
+        first = client.post("/input", json={"chat_id": "a", "message": "hi"})
+        second = client.post("/input", json={"chat_id": "a", "message": "hi"})
+        client.post("/input", json={"chat_id": "b", "message": "hi"})
+        stats = client.get("/cache/stats").json()
+
+    assert first.headers.get("X-Cache") != "HIT"
+    assert second.headers["X-Cache"] == "HIT"
+    assert calls == ["hi", "hi"]
+    assert stats["enabled"] is True
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert stats["hit_ratio"] == pytest.approx(1 / 3)
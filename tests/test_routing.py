@@ -0,0 +1,31 @@
+from collections import Counter
+
+from streamlit_view.routing import rendezvous_pick
+
+
+REPLICAS = ["http://a:8000", "http://b:8000", "http://c:8000", "http://d:8000"]
+CHATS = [f"chat-{i}" for i in range(400)]
+
+
+def test_a_chat_always_routes_to_the_same_replica():
+    first = [rendezvous_pick(chat_id, REPLICAS) for chat_id in CHATS]
+    assert [rendezvous_pick(chat_id, REPLICAS) for chat_id in CHATS] == first
+    # The replica list's order does not matter either
+    assert [rendezvous_pick(chat_id, REPLICAS[::-1]) for chat_id in CHATS] == first
+
+
+def test_chats_spread_across_replicas():
+    owners = Counter(rendezvous_pick(chat_id, REPLICAS) for chat_id in CHATS)
+    assert set(owners) == set(REPLICAS)
+    fair_share = len(CHATS) / len(REPLICAS)
+    assert all(count > fair_share / 2 for count in owners.values())
+
+
+def test_removing_a_replica_moves_only_its_chats():
+    before = {chat_id: rendezvous_pick(chat_id, REPLICAS) for chat_id in CHATS}
+    removed = REPLICAS[1]
+    remaining = [replica for replica in REPLICAS if replica != removed]
+    after = {chat_id: rendezvous_pick(chat_id, remaining) for chat_id in CHATS}
+
+    moved = {chat_id for chat_id in CHATS if before[chat_id] != after[chat_id]}
+    assert moved == {chat_id for chat_id in CHATS if before[chat_id] == removed}
@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("common_utils")
+
+from streamlit_view.streaming import StreamError, read_in_background, retry_busy
+
+
+class FakeStream:
+    """Yields ``chunks``, then raises ``error``; each chunk takes a ``gate`` permit."""
+
+    def __init__(self, chunks=(), error=None, gate=None):
+        self.chunks = list(chunks)
+        self.error = error
+        self.gate = gate
+        self.threads = set()
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.threads.add(threading.current_thread())
+        if self.gate is not None:
+            self.gate.acquire()
+        if self.chunks:
+            return self.chunks.pop(0)
+        if self.error is not None:
+            raise self.error
+        raise StopIteration
+
+    def close(self):
+        self.closed.set()
+
+
+def test_a_stream_error_is_raised_on_the_callers_thread():
+    stream = FakeStream(["a"], StreamError("boom"))
+    received = []
+    with pytest.raises(StreamError, match="boom"):
+        for chunk in read_in_background(stream, lambda: None, poll_seconds=0.01):
+            received.append(chunk)
+
+    assert received == ["a"]
+    assert threading.current_thread() not in stream.threads
+    assert stream.closed.wait(1.0)
+
+
+def test_the_caller_is_woken_while_the_stream_is_silent():
+    gate = threading.Semaphore(0)
+    stream = FakeStream(["a"], gate=gate)
+    idle = []
+
+    def on_idle():
+        idle.append(threading.current_thread())
+        if len(idle) == 3:
+            gate.release(2)
+
+    assert list(read_in_background(stream, on_idle, poll_seconds=0.01)) == ["a"]
+    assert idle == [threading.current_thread()] * 3
+
+
+def test_an_interrupted_reader_closes_the_stream():
+    gate = threading.Semaphore(1)
+    stream = FakeStream(["a", "b", "c"], gate=gate)
+    chunks = read_in_background(stream, lambda: None, poll_seconds=0.01)
+    assert next(chunks) == "a"
+
+    # What a Streamlit rerun does to the generator it was writing from
+    chunks.close()
+    gate.release(2)
+    assert stream.closed.wait(1.0)
+    # The reader stopped at the chunk it was waiting for
+    assert stream.chunks == ["c"]
+
+
+def test_a_busy_stream_is_retried_after_its_retry_after():
+    streams = [FakeStream(error=StreamError("busy", retry_after=2.0)), FakeStream(["a", "b"])]
+    waits = []
+
+    written = retry_busy(lambda: streams.pop(0), list, waits.append, retries=3)
+    assert written == ["a", "b"]
+    assert waits == [2.0]
+
+
+def test_a_stream_that_failed_part_way_is_not_retried():
+    opened = []
+    written = []
+
+    def open_stream():
+        opened.append(None)
+        return FakeStream(["a"], StreamError("busy", retry_after=0.0))
+
+    def write(chunks):
+        for chunk in chunks:
+            written.append(chunk)
+
+    with pytest.raises(StreamError):
+        retry_busy(open_stream, write, lambda seconds: None, retries=3)
+    assert len(opened) == 1
+    assert written == ["a"]
+
+
+def test_retries_run_out():
+    waits = []
+
+    def open_stream():
+        return FakeStream(error=StreamError("busy", retry_after=1.0))
+
+    with pytest.raises(StreamError, match="busy"):
+        retry_busy(open_stream, list, waits.append, retries=2)
+    assert waits == [1.0, 1.0]
+
+
+def test_other_errors_are_not_retried():
+    waits = []
+    with pytest.raises(StreamError, match="broken"):
+        retry_busy(lambda: FakeStream(error=StreamError("broken")), list, waits.append, retries=2)
+    assert waits == []
+
+
+def test_a_retry_writes_through_the_reader_without_duplicates():
+    streams = [
+        FakeStream(error=StreamError("busy", retry_after=0.0)),
+        FakeStream(["a", "b"]),
+    ]
+    written = retry_busy(
+        lambda: read_in_background(streams.pop(0), lambda: None, poll_seconds=0.01),
+        list,
+        lambda seconds: time.sleep(seconds),
+        retries=1,
+    )
+    assert written == ["a", "b"]
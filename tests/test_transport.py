@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("common_utils")
+pytest.importorskip("requests")
+
+from common_utils.schemas import AgentRequest, AgentResponse
+
+from streamlit_view.dispatcher import Dispatcher
+from streamlit_view.streaming import DONE, encode_line
+from streamlit_view.transport import HttpTransport, InProcessTransport
+from streamlit_view.view_configurations import ServerConfig, define_endpoints
+
+
+class StreamedResponse:
+    status_code = 200
+    headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_lines(self):
+        yield encode_line(DONE)
+
+
+class RecordingClient:
+    def __init__(self):
+        self.timeouts = []
+
+    def post_body(self, path, body, timeout=None, base_url=None, **kwargs):
+        self.timeouts.append(timeout)
+        return StreamedResponse()
+
+
+def test_a_stream_waits_no_longer_than_its_deadline_allows():
+    client = RecordingClient()
+    transport = HttpTransport(client)
+    list(transport.stream(AgentRequest(chat_id="a", message="hi"), timeout=30.0))
+
+    connect, read = ServerConfig().timeout
+    assert client.timeouts == [(connect, max(read, 31.0))]
+
+
+def answer(agent_request):
+    # Long enough for the HTTP body to be compressed
+    return AgentResponse(chat_id=agent_request.chat_id, message=agent_request.message * 5000)
+
+
+class AppClient:
+    """HttpClient's ``post_body`` over an in-memory TestClient."""
+
+    def __init__(self, test_client):
+        self.test_client = test_client
+        self.responses = []
+
+    def post_body(self, path, body, timeout=None, base_url=None, headers=None, **kwargs):
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        response = self.test_client.post(path, content=body, headers=headers)
+        self.responses.append(response)
+        return response
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def test_in_process_and_http_answer_a_turn_alike(loop):
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    agent_request = AgentRequest(chat_id="a", message="hi ")
+
+    app = FastAPI()
+    define_endpoints(app, answer)
+    with TestClient(app) as test_client:
+        client = AppClient(test_client)
+        timings = {}
+        over_http = HttpTransport(client).send(agent_request, timings=timings)
+    headers = client.responses[0].headers
+    assert headers["Content-Type"].startswith("application/vnd.streamlit-view.v2+")
+    assert headers["Content-Encoding"] in ("br", "gzip")
+
+    dispatcher = Dispatcher(answer)
+
+    async def bind():
+        dispatcher.bind_loop()
+
+    asyncio.run_coroutine_threadsafe(bind(), loop).result()
+    try:
+        in_process = InProcessTransport(dispatcher, timeout=5.0).send(agent_request)
+    finally:
+        asyncio.run_coroutine_threadsafe(dispatcher.job_manager.shutdown(), loop).result()
+
+    assert over_http == in_process == answer(agent_request)
+    assert "serialize" in timings